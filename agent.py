@@ -4,6 +4,7 @@ import os
 import requests # We will use the requests library directly
 import json
 from dotenv import load_dotenv
+from http_session import get_http_session, http_timeout
 
 def generate_whatsapp_message(match_data: dict):
     """
@@ -82,7 +83,7 @@ def generate_whatsapp_message(match_data: dict):
 
     try:
         # 3. Make the POST request
-        response = requests.post(api_url, headers=headers, data=json.dumps(data), timeout=20)
+        response = get_http_session().post(api_url, headers=headers, data=json.dumps(data), timeout=http_timeout(20))
         
         # Check for a successful response
         if response.status_code == 200:
@@ -1,86 +1,107 @@
 # analytics_etl.py
 
 import pandas as pd
-from db import read_data_from_db
-from log_db import read_log_data, write_dataframe_to_db
-from query import query_accepted_offers_log, query_order_details_by_ids
-from sqlalchemy import create_engine, text # <-- Adicionar importação de 'text'
-from dotenv import load_dotenv
-import os
+from db import read_data_by_id_chunks
+from log_db import read_log_data
+from query import query_accepted_offers_log, query_order_details_by_ids, query_open_orders_in_analytics
+from etl_state import (
+    TERMINAL_ORDER_STATUSES, WATERMARK_OVERLAP_IDS, get_watermark, save_watermark,
+    dataframe_to_rows, upsert_rows, update_order_details
+)
 
 # Define o nome da tabela de análise no banco de dados de BI
 ANALYTICS_TABLE_NAME = 'sai_performance_analytics'
 
+# Uma linha por evento PROVIDER_ACCEPTED (log_id da sai_event_log como chave)
+ANALYTICS_TABLE_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {ANALYTICS_TABLE_NAME} (
+        log_id INT PRIMARY KEY,
+        order_id INT NOT NULL,
+        provider_id INT NOT NULL,
+        accepted_at TIMESTAMP NULL,
+        final_status VARCHAR(50) NULL,
+        city_name VARCHAR(255) NULL,
+        created_at DATETIME NULL,
+        completed_at DATETIME NULL,
+        INDEX (order_id),
+        INDEX (final_status)
+    );
+"""
+
+EVENT_COLUMNS = ['log_id', 'order_id', 'provider_id', 'accepted_at']
+DETAIL_COLUMNS = ['final_status', 'city_name', 'created_at', 'completed_at']
+
 def run_analytics_etl():
     """
     Executa o processo de ETL para consolidar os dados de ofertas aceitas
     com o status final das corridas, atualizando a tabela de análise.
+
+    A carga é incremental: processa só os aceites com log_id acima da marca
+    d'água e atualiza os detalhes das corridas já carregadas cujo status ainda
+    pode mudar. Sem marca d'água (primeira execução), todo o log é carregado.
+    A tabela é criada (ou migrada do schema antigo) pelo setup_database.py.
     """
     print("\n--- INICIANDO PROCESSO DE ETL PARA ANÁLISE DE PERFORMANCE DO SAI ---")
 
-    # 1. EXTRAÇÃO: Buscar os logs de ofertas aceitas
-    print("ETAPA 1: Extraindo logs de ofertas aceitas do banco de BI...")
-    accepted_offers_df = read_log_data(query_accepted_offers_log())
+    watermark = get_watermark(ANALYTICS_TABLE_NAME)
+    if watermark is None:
+        print("ERRO: Não foi possível ler a marca d'água do ETL. Abortando ETL.")
+        return
+
+    # 1. EXTRAÇÃO: Buscar os novos logs de ofertas aceitas e as corridas ainda em aberto
+    print(f"ETAPA 1: Extraindo aceites com log_id > {watermark} e corridas em aberto do banco de BI...")
+    since_log_id = max(0, watermark - WATERMARK_OVERLAP_IDS) if watermark else None
+    accepted_offers_df = read_log_data(query_accepted_offers_log(since_log_id))
+    open_orders_df = read_log_data(query_open_orders_in_analytics(ANALYTICS_TABLE_NAME, TERMINAL_ORDER_STATUSES))
+
+    if accepted_offers_df is None or open_orders_df is None:
+        print("ERRO: Falha ao ler os dados do banco de BI. Abortando ETL.")
+        return
 
-    if accepted_offers_df is None or accepted_offers_df.empty:
-        print("INFO: Nenhuma nova oferta aceita encontrada nos logs para processar. Finalizando ETL.")
+    open_order_ids = set(open_orders_df['order_id'].astype(int))
+    if accepted_offers_df.empty and not open_order_ids:
+        print("INFO: Nenhuma nova oferta aceita nem corrida em aberto para processar. Finalizando ETL.")
+        save_watermark(ANALYTICS_TABLE_NAME, watermark)
         return
 
-    print(f"INFO: {len(accepted_offers_df)} ofertas aceitas encontradas.")
-    
-    order_ids_to_check = accepted_offers_df['order_id'].unique().tolist()
+    print(f"INFO: {len(accepted_offers_df)} ofertas aceitas novas e {len(open_order_ids)} corridas em aberto.")
+
+    accepted_offers_df['order_id'] = accepted_offers_df['order_id'].astype(int)
+    order_ids_to_check = sorted(set(accepted_offers_df['order_id']) | open_order_ids)
 
     # 2. EXTRAÇÃO: Buscar os detalhes e status finais das ordens
     print(f"ETAPA 2: Buscando detalhes de {len(order_ids_to_check)} corridas no banco de produção...")
-    order_details_df = read_data_from_db(query_order_details_by_ids(order_ids_to_check))
+    order_details_df = read_data_by_id_chunks(query_order_details_by_ids, order_ids_to_check)
 
-    if order_details_df is None or order_details_df.empty:
+    if order_details_df is None:
         print("ERRO: Não foi possível buscar os detalhes das corridas. Abortando ETL.")
         return
-    
+
     print(f"INFO: {len(order_details_df)} detalhes de corridas encontrados.")
 
     # 3. TRANSFORMAÇÃO: Juntar os DataFrames
     print("ETAPA 3: Transformando e juntando os dados...")
-    accepted_offers_df['order_id'] = accepted_offers_df['order_id'].astype(int)
     order_details_df['order_id'] = order_details_df['order_id'].astype(int)
 
     performance_df = pd.merge(accepted_offers_df, order_details_df, on='order_id', how='left')
+    open_details_df = order_details_df[order_details_df['order_id'].isin(open_order_ids)]
 
-    # 4. CARGA: Escrever o resultado na tabela de análise
+    # 4. CARGA: Upsert dos novos aceites e atualização das corridas em aberto
     print(f"ETAPA 4: Carregando os dados na tabela '{ANALYTICS_TABLE_NAME}'...")
-    
-    load_dotenv()
-    host = os.getenv('LOG_DB_HOST')
-    user = os.getenv('LOG_DB_USER')
-    password = os.getenv('LOG_DB_PASSWORD')
-    port = int(os.getenv('LOG_DB_PORT'))
-    db_name = os.getenv('LOG_DB_NAME')
-    
-    try:
-        engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}/{db_name}")
-        with engine.connect() as connection:
-            print(f"INFO: Limpando a tabela '{ANALYTICS_TABLE_NAME}' antes da inserção...")
-            # --- CORREÇÃO AQUI ---
-            connection.execute(text(f"TRUNCATE TABLE {ANALYTICS_TABLE_NAME}"))
-            connection.commit() # Adicionado commit para garantir a execução do TRUNCATE
-            # ---------------------
-            print("INFO: Tabela limpa com sucesso.")
-        
-        write_dataframe_to_db(performance_df, ANALYTICS_TABLE_NAME)
-    except Exception as e:
-        print(f"ERRO: Falha ao limpar ou carregar dados na tabela de análise: {e}")
+    columns = EVENT_COLUMNS + DETAIL_COLUMNS
+    upserted = upsert_rows(ANALYTICS_TABLE_NAME, columns, dataframe_to_rows(performance_df, columns), DETAIL_COLUMNS)
+    updated = update_order_details(ANALYTICS_TABLE_NAME, open_details_df, DETAIL_COLUMNS)
+
+    if upserted is None or updated is None:
+        print("ERRO: Falha ao carregar dados na tabela de análise (a tabela foi migrada pelo setup_database.py?). "
+              "A marca d'água não foi avançada.")
         return
 
+    new_watermark = watermark if accepted_offers_df.empty else max(watermark, int(accepted_offers_df['log_id'].max()))
+    save_watermark(ANALYTICS_TABLE_NAME, new_watermark)
+
+    print(f"INFO: {upserted} aceites gravados e {updated} corridas em aberto atualizadas.")
     print("\n--- PROCESSO DE ETL CONCLUÍDO COM SUCESSO! ---")
 
 if __name__ == "__main__":
-    try:
-        import sqlalchemy
-    except ImportError:
-        print("Instalando a dependência 'SQLAlchemy' necessária...")
-        import subprocess
-        import sys
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "SQLAlchemy"])
-    
     run_analytics_etl()
@@ -0,0 +1,169 @@
+# assignment.py
+
+import heapq
+import pandas as pd
+
+# --- MODOS DE ALOCAÇÃO ---
+# 'greedy': cada corrida escolhe os seus melhores entregadores de forma independente.
+# 'optimal': resolve a cidade inteira de uma vez como um fluxo de custo mínimo,
+#            com no máximo `max_offers` ofertas por corrida, 1 oferta por entregador
+#            e o mesmo total de ofertas que o modo guloso enviaria.
+ASSIGNMENT_MODE_GREEDY = 'greedy'
+ASSIGNMENT_MODE_OPTIMAL = 'optimal'
+ASSIGNMENT_MODES = (ASSIGNMENT_MODE_GREEDY, ASSIGNMENT_MODE_OPTIMAL)
+
+# Candidatos mantidos por corrida no modo 'optimal': CANDIDATES_PER_OFFER * max_offers
+CANDIDATES_PER_OFFER = 5
+# -------------------------
+
+
+def assign_offers_greedy(ranked_pairs_df, max_offers):
+    """
+    Comportamento original: pega as `max_offers` primeiras linhas de cada
+    corrida. Espera o DataFrame já ordenado por preferência dentro de cada corrida.
+    """
+    return ranked_pairs_df.groupby('order_id').head(max_offers)
+
+
+def _min_cost_flow(num_nodes, edges, source, sink, max_flow):
+    """
+    Fluxo de custo mínimo com valor até `max_flow`, pelo método primal-dual:
+    Dijkstra com potenciais (custos reduzidos não negativos) encontra a
+    distância mínima até o destino e, em seguida, buscas em profundidade
+    empurram de uma vez todos os caminhos aumentantes dessa distância.
+    `edges` é uma lista de (origem, destino, capacidade, custo), com custos >= 0.
+    Retorna uma lista com o fluxo final de cada aresta, na mesma ordem.
+    """
+    graph = [[] for _ in range(num_nodes)]
+    to, cap, cost = [], [], []
+    for u, v, capacity, edge_cost in edges:
+        graph[u].append(len(to)); to.append(v); cap.append(capacity); cost.append(edge_cost)
+        graph[v].append(len(to)); to.append(u); cap.append(0); cost.append(-edge_cost)
+
+    potential = [0] * num_nodes
+    flow = 0
+    while flow < max_flow:
+        # 1. Distâncias com custos reduzidos (todos >= 0 graças aos potenciais)
+        dist = [None] * num_nodes
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for e in graph[u]:
+                if cap[e] > 0:
+                    v = to[e]
+                    candidate = d + cost[e] + potential[u] - potential[v]
+                    if dist[v] is None or candidate < dist[v]:
+                        dist[v] = candidate
+                        heapq.heappush(heap, (candidate, v))
+        if dist[sink] is None:
+            break
+        for node in range(num_nodes):
+            if dist[node] is not None:
+                potential[node] += dist[node]
+
+        # 2. Empurra fluxo por todas as arestas de custo reduzido zero (caminhos mais baratos)
+        next_edge = [0] * num_nodes
+        while flow < max_flow:
+            path = []
+            on_path = [False] * num_nodes
+            on_path[source] = True
+            u = source
+            while u != sink:
+                edge_list = graph[u]
+                while next_edge[u] < len(edge_list):
+                    e = edge_list[next_edge[u]]
+                    v = to[e]
+                    if cap[e] > 0 and not on_path[v] and cost[e] + potential[u] - potential[v] == 0:
+                        break
+                    next_edge[u] += 1
+                if next_edge[u] == len(edge_list):
+                    # Beco sem saída: volta um passo e descarta a aresta usada para chegar aqui
+                    if not path:
+                        break
+                    on_path[u] = False
+                    e = path.pop()
+                    u = to[e ^ 1]
+                    next_edge[u] += 1
+                    continue
+                e = edge_list[next_edge[u]]
+                path.append(e)
+                u = to[e]
+                on_path[u] = True
+            if u != sink:
+                break
+
+            push = min(max_flow - flow, min(cap[e] for e in path))
+            for e in path:
+                cap[e] -= push
+                cap[e ^ 1] += push
+            flow += push
+
+    # O fluxo de cada aresta original é a capacidade acumulada na aresta reversa
+    return [cap[2 * i + 1] for i in range(len(edges))]
+
+
+def assign_offers_optimal(ranked_pairs_df, max_offers, max_total_offers=None):
+    """
+    Alocação global da cidade como fluxo de custo mínimo:
+    origem -> corrida (até `max_offers`) -> entregador (1 por entregador) -> destino.
+
+    O total de ofertas é limitado a `max_total_offers`; por padrão, ao número
+    de mensagens que o modo guloso realmente enviaria (1 por entregador), para
+    gastar o mesmo com WhatsApp e só redistribuir as ofertas entre as corridas.
+    O primeiro envio de cada corrida custa 0 e os demais recebem uma penalidade
+    maior que qualquer soma de custos de pares, então a solução primeiro
+    maximiza o número de corridas cobertas e só depois prefere os melhores
+    entregadores. O custo de um par é a sua posição no ranking da corrida, o
+    que preserva os mesmos critérios de ordenação do modo guloso.
+    Espera o DataFrame já ordenado por preferência dentro de cada corrida.
+    """
+    if ranked_pairs_df.empty or max_offers <= 0:
+        return ranked_pairs_df.iloc[:0]
+
+    if max_total_offers is None:
+        max_total_offers = assign_offers_greedy(ranked_pairs_df, max_offers)['provider_id'].nunique()
+
+    # Cada corrida só considera os seus melhores candidatos (poda do grafo)
+    ranked_pairs_df = ranked_pairs_df.groupby('order_id').head(CANDIDATES_PER_OFFER * max_offers)
+
+    ranks = ranked_pairs_df.groupby('order_id').cumcount().to_numpy()
+    order_ids = ranked_pairs_df['order_id'].to_numpy()
+    provider_ids = ranked_pairs_df['provider_id'].to_numpy()
+
+    order_nodes = {order_id: 1 + i for i, order_id in enumerate(pd.unique(order_ids))}
+    provider_nodes = {provider_id: 1 + len(order_nodes) + i for i, provider_id in enumerate(pd.unique(provider_ids))}
+    source, sink = 0, 1 + len(order_nodes) + len(provider_nodes)
+
+    extra_offer_penalty = (int(ranks.max()) + 1) * (len(order_nodes) * max_offers + 1)
+
+    edges = []
+    for node in order_nodes.values():
+        edges.append((source, node, 1, 0))
+        if max_offers > 1:
+            edges.append((source, node, max_offers - 1, extra_offer_penalty))
+    pair_edge_start = len(edges)
+    for order_id, provider_id, rank in zip(order_ids, provider_ids, ranks):
+        edges.append((order_nodes[order_id], provider_nodes[provider_id], 1, int(rank)))
+    for node in provider_nodes.values():
+        edges.append((node, sink, 1, 0))
+
+    flows = _min_cost_flow(sink + 1, edges, source, sink, int(max_total_offers))
+    selected = [flow > 0 for flow in flows[pair_edge_start:pair_edge_start + len(order_ids)]]
+    return ranked_pairs_df[selected]
+
+
+def select_best_matches(ranked_pairs_df, max_offers, mode=ASSIGNMENT_MODE_GREEDY, max_total_offers=None):
+    """
+    Escolhe os pares corrida-entregador que receberão oferta, no modo de alocação pedido.
+    `max_total_offers` (só no modo 'optimal') limita o total de ofertas; por
+    padrão, é o número de mensagens que o modo guloso enviaria.
+    """
+    max_offers = int(max_offers)
+    if mode == ASSIGNMENT_MODE_GREEDY:
+        return assign_offers_greedy(ranked_pairs_df, max_offers)
+    if mode == ASSIGNMENT_MODE_OPTIMAL:
+        return assign_offers_optimal(ranked_pairs_df, max_offers, max_total_offers)
+    raise ValueError(f"Modo de alocação desconhecido: '{mode}'. Use um de {ASSIGNMENT_MODES}.")
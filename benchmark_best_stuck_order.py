@@ -0,0 +1,135 @@
+# benchmark_best_stuck_order.py
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from db import read_data_from_db
+from query import query_available_providers, query_best_stuck_order_for_provider
+
+# Entregadores online usados como amostra e repetições por entregador
+SAMPLE_PROVIDERS = 20
+REPETITIONS = 3
+
+# Índice sugerido para o retângulo (bounding box) da nova query
+SUGGESTED_INDEX = ("ALTER TABLE giross_producao.user_requests "
+                   "ADD INDEX idx_status_store_location (status, s_latitude, s_longitude)")
+
+def query_best_stuck_order_for_provider_legacy(provider_id: int, provider_lat: float, provider_lon: float):
+    """
+    Versão anterior da query (Haversine no SELECT e de novo no WHERE, para todas
+    as corridas travadas, sem retângulo). Mantida aqui só para comparação.
+    """
+    return f"""
+        WITH active_configs AS (
+            SELECT city_id, stuck_order_threshold_minutes, offer_distance_km
+            FROM desenvolvimento_bi.sai_city_configs
+            WHERE is_active = TRUE
+        ),
+        stuck_orders AS (
+            SELECT
+                ur.id AS order_id,
+                ur.user_id,
+                ur.s_latitude,
+                ur.s_longitude,
+                ac.offer_distance_km
+            FROM
+                giross_producao.user_requests ur
+            JOIN
+                active_configs ac ON ur.city_id = ac.city_id
+            WHERE
+                ur.status = 'SEARCHING'
+                AND ur.provider_id IN (0, 1266)
+                AND TIMESTAMPDIFF(MINUTE, ur.original_created_at, NOW()) >= ac.stuck_order_threshold_minutes
+        )
+        SELECT
+            s.order_id,
+            (6371 * ACOS(
+                COS(RADIANS({provider_lat})) * COS(RADIANS(s.s_latitude)) *
+                COS(RADIANS(s.s_longitude) - RADIANS({provider_lon})) +
+                SIN(RADIANS({provider_lat})) * SIN(RADIANS(s.s_latitude))
+            )) AS distance_km
+        FROM
+            stuck_orders s
+        LEFT JOIN
+            giross_producao.user_provider_blocks b ON s.user_id = b.user_id AND b.provider_id = {provider_id}
+        WHERE
+            b.provider_id IS NULL
+            AND (6371 * ACOS(
+                COS(RADIANS({provider_lat})) * COS(RADIANS(s.s_latitude)) *
+                COS(RADIANS(s.s_longitude) - RADIANS({provider_lon})) +
+                SIN(RADIANS({provider_lat})) * SIN(RADIANS(s.s_latitude))
+            )) <= s.offer_distance_km
+        ORDER BY
+            distance_km ASC
+        LIMIT 1;
+    """
+
+QUERY_VERSIONS = {
+    'anterior': query_best_stuck_order_for_provider_legacy,
+    'bounding box': query_best_stuck_order_for_provider,
+}
+
+def _load_sample_providers(sample_size):
+    providers_df = read_data_from_db(query_available_providers())
+    if providers_df is None or providers_df.empty:
+        return None
+    for column in ['latitude', 'longitude']:
+        providers_df[column] = pd.to_numeric(providers_df[column], errors='coerce')
+    providers_df = providers_df.dropna(subset=['latitude', 'longitude'])
+    return providers_df.drop_duplicates('provider_id').head(sample_size)
+
+def _print_plan(name, query):
+    plan_df = read_data_from_db("EXPLAIN " + query.strip().rstrip(';'))
+    print(f"\n--- Plano (EXPLAIN) da query {name} ---")
+    if plan_df is None:
+        print("ERRO: Não foi possível obter o plano.")
+        return
+    columns = [c for c in ['id', 'select_type', 'table', 'type', 'possible_keys', 'key', 'rows', 'filtered', 'Extra']
+               if c in plan_df.columns]
+    print(plan_df[columns].to_string(index=False))
+
+def run_benchmark(sample_size=SAMPLE_PROVIDERS, repetitions=REPETITIONS):
+    """
+    Mede a latência das duas versões da query para uma amostra de entregadores
+    online, confere se elas escolhem a mesma corrida e imprime os planos.
+    Retorna True se os resultados coincidirem para todos os entregadores.
+    """
+    providers_df = _load_sample_providers(sample_size)
+    if providers_df is None or providers_df.empty:
+        print("ERRO: Nenhum entregador online com localização para a amostra.")
+        return False
+
+    first = providers_df.iloc[0]
+    for name, builder in QUERY_VERSIONS.items():
+        _print_plan(name, builder(int(first['provider_id']), first['latitude'], first['longitude']))
+
+    latencies = {name: [] for name in QUERY_VERSIONS}
+    mismatches = 0
+    for provider in providers_df.itertuples(index=False):
+        chosen = {}
+        for name, builder in QUERY_VERSIONS.items():
+            query = builder(int(provider.provider_id), provider.latitude, provider.longitude)
+            for _ in range(repetitions):
+                start = time.perf_counter()
+                result_df = read_data_from_db(query)
+                latencies[name].append(time.perf_counter() - start)
+            chosen[name] = None if result_df is None or result_df.empty else int(result_df.iloc[0]['order_id'])
+        if len(set(chosen.values())) > 1:
+            mismatches += 1
+            print(f"AVISO: Entregador {provider.provider_id}: corridas diferentes {chosen}.")
+
+    print(f"\n--- Latência ({len(providers_df)} entregadores x {repetitions} repetições) ---")
+    for name, values in latencies.items():
+        values_ms = np.array(values) * 1000
+        print(f"Query {name}: média = {values_ms.mean():.1f} ms, p50 = {np.percentile(values_ms, 50):.1f} ms, "
+              f"p95 = {np.percentile(values_ms, 95):.1f} ms, máx = {values_ms.max():.1f} ms")
+
+    print(f"\nINFO: Se o plano da query 'bounding box' não usar um índice de range em user_requests, "
+          f"considere criar:\n  {SUGGESTED_INDEX};")
+    print(f"Resultados divergentes: {mismatches} -> {'OK' if mismatches == 0 else 'FALHA'}")
+    return mismatches == 0
+
+if __name__ == "__main__":
+    print("--- A comparar a busca da melhor corrida travada (anterior x bounding box) ---")
+    sys.exit(0 if run_benchmark() else 1)
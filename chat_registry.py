@@ -0,0 +1,47 @@
+# chat_registry.py
+
+from log_db import read_log_data, execute_log_write
+from query import query_registered_chat
+
+# Por quanto tempo um chat confirmado no Chatguru é reaproveitado sem novo registro
+CHAT_REGISTRY_TTL_DAYS = 30
+
+
+def get_registered_chat_number(phone_number: str):
+    """
+    Retorna o número de chat já confirmado no Chatguru para o telefone
+    informado (inclusive o número 'corrigido'), ou None se não houver
+    registro válido no cache.
+    """
+    if not phone_number:
+        return None
+    registry_df = read_log_data(query_registered_chat(phone_number))
+    if registry_df is None or registry_df.empty:
+        return None
+    return registry_df.iloc[0]['chat_number']
+
+
+def save_chat_registration(phone_number: str, chat_number: str, registration_status: str):
+    """
+    Grava (ou renova) no cache o número de chat confirmado para o telefone,
+    com expiração em CHAT_REGISTRY_TTL_DAYS dias.
+    """
+    query = """
+        INSERT INTO sai_chat_registry (phone_number, chat_number, registration_status, expires_at)
+        VALUES (%s, %s, %s, NOW() + INTERVAL %s DAY)
+        ON DUPLICATE KEY UPDATE
+            chat_number = VALUES(chat_number),
+            registration_status = VALUES(registration_status),
+            expires_at = VALUES(expires_at)
+    """
+    if execute_log_write(query, (phone_number, chat_number, registration_status, CHAT_REGISTRY_TTL_DAYS)) is not None:
+        print(f"INFO: Chat {chat_number} do telefone {phone_number} guardado no cache de registros.")
+
+
+def invalidate_chat_registration(phone_number: str):
+    """
+    Remove o telefone do cache, forçando um novo registro no próximo envio
+    (usado quando um envio para um chat em cache falha).
+    """
+    execute_log_write("DELETE FROM sai_chat_registry WHERE phone_number = %s", (phone_number,))
+    print(f"INFO: Registro de chat do telefone {phone_number} removido do cache.")
@@ -2,6 +2,7 @@
 
 import requests
 import json
+from http_session import get_http_session, http_timeout
 
 class ChatguruWABA:
     """
@@ -18,7 +19,7 @@ class ChatguruWABA:
     def _send_request(self, params):
         """Envia uma requisição POST para a API do Chatguru."""
         try:
-            response = requests.post(self.base_url, data=params, timeout=20)
+            response = get_http_session().post(self.base_url, data=params, timeout=http_timeout(20))
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as http_err:
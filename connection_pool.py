@@ -0,0 +1,91 @@
+# connection_pool.py
+
+import os
+import threading
+from dotenv import load_dotenv
+from playhouse.pool import PooledMySQLDatabase
+
+load_dotenv()
+
+# --- CONFIGURAÇÕES DO POOL DE CONEXÕES ---
+POOL_MAX_CONNECTIONS = 20       # Conexões simultâneas por banco, por processo
+POOL_IDLE_TIMEOUT_SECONDS = 300 # Conexões ociosas há mais tempo que isso são descartadas
+POOL_WAIT_TIMEOUT_SECONDS = 30  # Espera máxima por uma conexão livre quando o pool está cheio
+CONNECT_TIMEOUT_SECONDS = 15
+READ_TIMEOUT_SECONDS = 300      # Uma leitura travada falha em vez de prender a thread (e a cidade) para sempre
+WRITE_TIMEOUT_SECONDS = 300
+# -----------------------------------------
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _create_pool(prefix_host, prefix_user, prefix_password, prefix_port, prefix_database):
+    """
+    Cria um pool de conexões MySQL (peewee/pymysql). Antes de entregar uma
+    conexão reaproveitada, o pool faz um ping (health check) e descarta
+    conexões mortas ou ociosas além de POOL_IDLE_TIMEOUT_SECONDS.
+    """
+    return PooledMySQLDatabase(
+        database=os.getenv(prefix_database),
+        user=os.getenv(prefix_user),
+        password=os.getenv(prefix_password),
+        host=os.getenv(prefix_host),
+        port=int(os.getenv(prefix_port)),
+        max_connections=POOL_MAX_CONNECTIONS,
+        stale_timeout=POOL_IDLE_TIMEOUT_SECONDS,
+        timeout=POOL_WAIT_TIMEOUT_SECONDS,
+        connect_timeout=CONNECT_TIMEOUT_SECONDS,
+        read_timeout=READ_TIMEOUT_SECONDS,
+        write_timeout=WRITE_TIMEOUT_SECONDS
+    )
+
+
+def _get_pool(name, factory):
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = factory()
+                _pools[name] = pool
+    return pool
+
+
+def get_production_db():
+    """Pool compartilhado do banco de produção (variáveis *_2 do .env)."""
+    return _get_pool('production', lambda: _create_pool('HOST_2', 'USER_2', 'PASSWORD_2', 'PORT_2', 'DATABASE_2'))
+
+
+def get_log_db():
+    """Pool compartilhado do banco de log/BI (variáveis LOG_DB_* do .env)."""
+    return _get_pool('log', lambda: _create_pool('LOG_DB_HOST', 'LOG_DB_USER', 'LOG_DB_PASSWORD', 'LOG_DB_PORT', 'LOG_DB_NAME'))
+
+
+def get_log_engine():
+    """
+    Engine SQLAlchemy compartilhada do banco de log, usada pelas escritas de
+    DataFrames (to_sql). Tem o seu próprio pool, com pre-ping e reciclagem.
+    """
+    def create_log_engine():
+        from sqlalchemy import create_engine
+        host = os.getenv('LOG_DB_HOST')
+        user = os.getenv('LOG_DB_USER')
+        password = os.getenv('LOG_DB_PASSWORD')
+        port = int(os.getenv('LOG_DB_PORT'))
+        db_name = os.getenv('LOG_DB_NAME')
+        return create_engine(
+            f"mysql+pymysql://{user}:{password}@{host}:{port}/{db_name}",
+            pool_size=5,
+            max_overflow=5,
+            pool_pre_ping=True,
+            pool_recycle=POOL_IDLE_TIMEOUT_SECONDS,
+            pool_timeout=POOL_WAIT_TIMEOUT_SECONDS,
+            connect_args={'read_timeout': READ_TIMEOUT_SECONDS, 'write_timeout': WRITE_TIMEOUT_SECONDS}
+        )
+    return _get_pool('log_engine', create_log_engine)
+
+
+def log_db_configured():
+    """Indica se todas as variáveis LOG_DB_* estão definidas no ambiente."""
+    return all(os.getenv(name) for name in ('LOG_DB_HOST', 'LOG_DB_USER', 'LOG_DB_PASSWORD', 'LOG_DB_PORT', 'LOG_DB_NAME'))
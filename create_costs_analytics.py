@@ -4,9 +4,8 @@ import pandas as pd
 from db import read_data_from_db
 from log_db import read_log_data, write_dataframe_to_db
 from query import query_sai_costs_daily, query_tracking_link_costs_daily, query_nps_costs_daily
-from sqlalchemy import create_engine, text
-from dotenv import load_dotenv
-import os
+from sqlalchemy import text
+from connection_pool import get_log_engine
 
 # Define o nome da tabela de análise e o custo por mensagem
 ANALYTICS_TABLE_NAME = 'whatsapp_costs_daily'
@@ -43,15 +42,8 @@ def run_costs_etl():
     # 3. CARGA: Escreve o resultado na tabela de análise
     print(f"ETAPA 3: Carregando os dados na tabela '{ANALYTICS_TABLE_NAME}'...")
     
-    load_dotenv()
-    host = os.getenv('LOG_DB_HOST')
-    user = os.getenv('LOG_DB_USER')
-    password = os.getenv('LOG_DB_PASSWORD')
-    port = int(os.getenv('LOG_DB_PORT'))
-    db_name = os.getenv('LOG_DB_NAME')
-    
     try:
-        engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}/{db_name}")
+        engine = get_log_engine()
         
         # Lógica robusta que assume que a tabela já existe
         with engine.connect() as connection:
@@ -1,91 +1,109 @@
 # create_sent_offers_analytics.py
 
 import pandas as pd
-from db import read_data_from_db
-from log_db import read_log_data, write_dataframe_to_db
-from query import query_sent_offers_log, query_order_details_by_ids
-from sqlalchemy import create_engine
-from dotenv import load_dotenv
-import os
+from db import read_data_by_id_chunks
+from log_db import read_log_data
+from query import query_sent_offers_log, query_order_details_by_ids, query_open_orders_in_analytics
+from etl_state import (
+    TERMINAL_ORDER_STATUSES, WATERMARK_OVERLAP_IDS, get_watermark, save_watermark,
+    dataframe_to_rows, upsert_rows, update_order_details
+)
 
 # Define o nome da NOVA tabela que será criada no banco de dados de BI
 ANALYTICS_TABLE_NAME = 'sai_sent_offers_analytics'
 
+# Uma linha por evento OFFER_SENT (log_id da sai_event_log como chave)
+ANALYTICS_TABLE_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {ANALYTICS_TABLE_NAME} (
+        log_id INT PRIMARY KEY,
+        order_id INT NOT NULL,
+        provider_id INT NOT NULL,
+        sent_at TIMESTAMP NULL,
+        final_status VARCHAR(50) NULL,
+        city_name VARCHAR(255) NULL,
+        created_at DATETIME NULL,
+        completed_at DATETIME NULL,
+        INDEX (order_id),
+        INDEX (provider_id),
+        INDEX (sent_at),
+        INDEX (final_status)
+    );
+"""
+
+EVENT_COLUMNS = ['log_id', 'order_id', 'provider_id', 'sent_at']
+DETAIL_COLUMNS = ['final_status', 'city_name', 'created_at', 'completed_at']
+
 def run_sent_offers_etl():
     """
     Executa o processo de ETL para consolidar os dados de ofertas ENVIADAS
     com os detalhes das corridas para análise.
+
+    A tabela não é mais recriada a cada execução: apenas as ofertas acima da
+    marca d'água são acrescentadas (upsert por log_id) e os detalhes são
+    atualizados só para as corridas ainda em andamento. A tabela é criada
+    (ou migrada da versão antiga) pelo setup_database.py, com índices.
     """
     print("\n--- INICIANDO PROCESSO DE ETL PARA ANÁLISE DE OFERTAS ENVIADAS ---")
 
-    # 1. EXTRAÇÃO: Buscar os logs de ofertas ENVIADAS
-    print("ETAPA 1: Extraindo logs de ofertas ENVIADAS do banco de BI...")
-    sent_offers_df = read_log_data(query_sent_offers_log())
+    watermark = get_watermark(ANALYTICS_TABLE_NAME)
+    if watermark is None:
+        print("ERRO: Não foi possível ler a marca d'água do ETL. Abortando ETL.")
+        return
+
+    # 1. EXTRAÇÃO: Buscar os novos logs de ofertas ENVIADAS e as corridas ainda em andamento
+    print(f"ETAPA 1: Extraindo ofertas ENVIADAS com log_id > {watermark} e corridas em andamento do banco de BI...")
+    since_log_id = max(0, watermark - WATERMARK_OVERLAP_IDS) if watermark else None
+    sent_offers_df = read_log_data(query_sent_offers_log(since_log_id))
+    open_orders_df = read_log_data(query_open_orders_in_analytics(ANALYTICS_TABLE_NAME, TERMINAL_ORDER_STATUSES))
+
+    if sent_offers_df is None or open_orders_df is None:
+        print("ERRO: Falha ao ler os dados do banco de BI. Abortando ETL.")
+        return
 
-    if sent_offers_df is None or sent_offers_df.empty:
-        print("INFO: Nenhuma oferta enviada encontrada nos logs para processar. Finalizando ETL.")
+    open_order_ids = set(open_orders_df['order_id'].astype(int))
+    if sent_offers_df.empty and not open_order_ids:
+        print("INFO: Nenhuma oferta nova nem corrida em andamento para processar. Finalizando ETL.")
+        save_watermark(ANALYTICS_TABLE_NAME, watermark)
         return
 
-    print(f"INFO: {len(sent_offers_df)} ofertas enviadas encontradas.")
-    
-    order_ids_to_check = sent_offers_df['order_id'].unique().tolist()
+    print(f"INFO: {len(sent_offers_df)} ofertas enviadas novas e {len(open_order_ids)} corridas em andamento.")
+
+    sent_offers_df['order_id'] = sent_offers_df['order_id'].astype(int)
+    order_ids_to_check = sorted(set(sent_offers_df['order_id']) | open_order_ids)
 
     # 2. EXTRAÇÃO: Buscar os detalhes das ordens no banco de produção
     print(f"ETAPA 2: Buscando detalhes de {len(order_ids_to_check)} corridas no banco de produção...")
-    order_details_df = read_data_from_db(query_order_details_by_ids(order_ids_to_check))
+    order_details_df = read_data_by_id_chunks(query_order_details_by_ids, order_ids_to_check)
 
-    if order_details_df is None or order_details_df.empty:
+    if order_details_df is None:
         print("ERRO: Não foi possível buscar os detalhes das corridas. Abortando ETL.")
         return
-    
+
     print(f"INFO: {len(order_details_df)} detalhes de corridas encontrados.")
 
     # 3. TRANSFORMAÇÃO: Juntar os DataFrames
     print("ETAPA 3: Transformando e juntando os dados...")
-    sent_offers_df['order_id'] = sent_offers_df['order_id'].astype(int)
     order_details_df['order_id'] = order_details_df['order_id'].astype(int)
 
     analytics_df = pd.merge(sent_offers_df, order_details_df, on='order_id', how='left')
+    open_details_df = order_details_df[order_details_df['order_id'].isin(open_order_ids)]
 
-    # 4. CARGA: Escrever o resultado na nova tabela de análise
+    # 4. CARGA: Acrescentar as novas ofertas e atualizar as corridas em andamento
     print(f"ETAPA 4: Carregando os dados na tabela '{ANALYTICS_TABLE_NAME}'...")
-    
-    load_dotenv()
-    host = os.getenv('LOG_DB_HOST')
-    user = os.getenv('LOG_DB_USER')
-    password = os.getenv('LOG_DB_PASSWORD')
-    port = int(os.getenv('LOG_DB_PORT'))
-    db_name = os.getenv('LOG_DB_NAME')
-    
-    try:
-        engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}/{db_name}")
-        
-        # --- CORREÇÃO AQUI ---
-        # A estratégia 'replace' lida com a criação da tabela na primeira vez
-        # e com a limpeza (DROP/CREATE/INSERT) nas execuções seguintes.
-        print(f"INFO: Recriando e populando a tabela '{ANALYTICS_TABLE_NAME}'...")
-        analytics_df.to_sql(
-            ANALYTICS_TABLE_NAME, 
-            con=engine, 
-            if_exists='replace', # 'replace' irá dropar a tabela se existir e criar uma nova
-            index=False
-        )
-        print("INFO: Tabela de análise atualizada com sucesso.")
-        # ---------------------
-
-    except Exception as e:
-        print(f"ERRO: Falha ao carregar dados na tabela de análise: {e}")
+    columns = EVENT_COLUMNS + DETAIL_COLUMNS
+    upserted = upsert_rows(ANALYTICS_TABLE_NAME, columns, dataframe_to_rows(analytics_df, columns), DETAIL_COLUMNS)
+    updated = update_order_details(ANALYTICS_TABLE_NAME, open_details_df, DETAIL_COLUMNS)
+
+    if upserted is None or updated is None:
+        print("ERRO: Falha ao carregar dados na tabela de análise (a tabela foi migrada pelo setup_database.py?). "
+              "A marca d'água não foi avançada.")
         return
 
+    new_watermark = watermark if sent_offers_df.empty else max(watermark, int(sent_offers_df['log_id'].max()))
+    save_watermark(ANALYTICS_TABLE_NAME, new_watermark)
+
+    print(f"INFO: {upserted} ofertas gravadas e {updated} corridas em andamento atualizadas.")
     print("\n--- PROCESSO DE ETL DE OFERTAS ENVIADAS CONCLUÍDO COM SUCESSO! ---")
 
 if __name__ == "__main__":
-    try:
-        import sqlalchemy
-    except ImportError:
-        print("Instalando a dependência 'SQLAlchemy' necessária...")
-        import subprocess
-        import sys
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "SQLAlchemy"])
-    
     run_sent_offers_etl()
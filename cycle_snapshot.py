@@ -0,0 +1,69 @@
+# cycle_snapshot.py
+
+from datetime import datetime
+from db import read_data_from_db
+from log_db import read_log_data
+from query import query_available_providers, query_providers_on_active_orders, query_offers_sent_for_orders
+from data_cache import BLOCKED_PAIRS, FIXED_PROVIDERS
+from pair_exclusion import PairExclusionSet
+
+
+class CycleSnapshot:
+    """
+    Fotografia dos dados que NÃO dependem da cidade (entregadores online,
+    entregadores em corrida, fixos e bloqueios).
+    É carregada uma única vez por ciclo do worker e compartilhada por todas
+    as cidades processadas nesse ciclo. As ofertas já enviadas dependem das
+    corridas travadas e são buscadas por cidade (ver load_offers_already_sent).
+    """
+    def __init__(self, online_providers_df, busy_providers_df, fixed_providers_df, blocked_pairs_df):
+        self.loaded_at = datetime.now()
+        self.online_providers_df = online_providers_df
+        self.busy_provider_ids = self._ids(busy_providers_df)
+        self.fixed_provider_ids = self._ids(fixed_providers_df)
+        self.blocked_pairs_df = blocked_pairs_df
+
+        # Pares excluídos como chaves int64 empacotadas (verificação vetorizada, sem merges)
+        self.blocked_pairs = PairExclusionSet.from_frame(blocked_pairs_df, 'user_id', 'provider_id')
+
+    @staticmethod
+    def _ids(df):
+        if df is None or df.empty:
+            return []
+        return df['provider_id'].unique().tolist()
+
+    @classmethod
+    def load(cls):
+        """
+        Executa as queries globais uma única vez e monta a fotografia do ciclo.
+        Bloqueios e entregadores fixos vêm do cache de dados de referência.
+        """
+        print("\nINFO: Carregando a fotografia global do ciclo (entregadores e bloqueios)...")
+        snapshot = cls(
+            online_providers_df=read_data_from_db(query_available_providers()),
+            busy_providers_df=read_data_from_db(query_providers_on_active_orders()),
+            fixed_providers_df=FIXED_PROVIDERS.get(),
+            blocked_pairs_df=BLOCKED_PAIRS.get()
+        )
+        online_count = len(snapshot.online_providers_df) if snapshot.online_providers_df is not None else 0
+        print(f"INFO: Fotografia carregada: {online_count} entregadores online, "
+              f"{len(snapshot.busy_provider_ids)} em corrida, {len(snapshot.fixed_provider_ids)} fixos, "
+              f"{len(snapshot.blocked_pairs)} bloqueios.")
+        return snapshot
+
+    def online_providers(self):
+        """Cópia dos entregadores online, para que cada cidade possa alterá-la livremente."""
+        if self.online_providers_df is None:
+            return None
+        return self.online_providers_df.copy()
+
+
+def load_offers_already_sent(order_ids):
+    """
+    Busca no log apenas os pares (corrida, entregador) já ofertados para as
+    corridas informadas e devolve-os como PairExclusionSet.
+    """
+    offers_sent_df = read_log_data(query_offers_sent_for_orders(order_ids))
+    if offers_sent_df is None:
+        print("AVISO: A tabela 'sai_event_log' não foi encontrada. A assumir que nenhuma oferta foi enviada.")
+    return PairExclusionSet.from_frame(offers_sent_df, 'order_id', 'provider_id')
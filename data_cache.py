@@ -0,0 +1,307 @@
+# data_cache.py
+
+import threading
+import time
+import pandas as pd
+from db import read_data_from_db
+from log_db import read_log_data
+from query import (
+    query_blocked_pairs, query_fixed_providers, query_store_location_attributes, query_provider_release_counts,
+    query_provider_scores, query_provider_offer_state_snapshot
+)
+
+# Margem extra (segundos) na janela de alterações das cargas incrementais,
+# para cobrir a diferença entre o relógio do worker e o do banco.
+INCREMENTAL_WINDOW_MARGIN_SECONDS = 120
+
+
+class CachedDataset:
+    """
+    Cache em memória de um dataset de referência lido do banco (via
+    `read_data_from_db` ou `read_log_data`), com:
+      - TTL: dentro dele o DataFrame em memória é devolvido sem tocar no banco;
+      - recarga incremental: ao expirar, se houver `incremental_query`, busca só
+        as linhas acima da marca d'água (`watermark_column`) e as mescla por `key_columns`;
+      - recarga completa periódica (`full_reload_seconds`), para capturar
+        remoções físicas que a carga incremental não enxerga;
+      - invalidação explícita e contadores de hit/miss;
+      - `derive` (opcional): transformação do DataFrame (ex.: pivot) calculada
+        uma vez por recarga e devolvida por `get(derived=True)`.
+    Os DataFrames devolvidos são compartilhados: não os altere.
+    """
+    def __init__(self, name, reader, full_query, ttl_seconds, incremental_query=None,
+                 watermark_column=None, key_columns=None, deleted_column=None, full_reload_seconds=None,
+                 derive=None):
+        self.name = name
+        self.reader = reader
+        self.full_query = full_query
+        self.ttl_seconds = ttl_seconds
+        self.incremental_query = incremental_query
+        self.watermark_column = watermark_column
+        self.key_columns = key_columns
+        self.deleted_column = deleted_column
+        self.full_reload_seconds = full_reload_seconds
+        self.derive = derive
+
+        self._lock = threading.Lock()
+        self._df = None
+        self._derived_df = None
+        self._watermark = None
+        self._last_refresh = None
+        self._last_full_load = None
+        self.stats = {'hits': 0, 'misses': 0, 'incremental_refreshes': 0, 'errors': 0}
+
+    def invalidate(self):
+        """Descarta os dados em memória; a próxima leitura fará uma carga completa."""
+        with self._lock:
+            self._df = None
+            self._derived_df = None
+            self._watermark = None
+            self._last_refresh = None
+            self._last_full_load = None
+
+    def get(self, force_refresh=False, derived=False):
+        """
+        Retorna o DataFrame do dataset (ou, com `derived=True`, o resultado de
+        `derive`), recarregando do banco apenas quando necessário.
+        """
+        with self._lock:
+            now = time.monotonic()
+
+            if self._df is not None and not force_refresh and now - self._last_refresh < self.ttl_seconds:
+                self.stats['hits'] += 1
+                return self._derived_df if derived else self._df
+
+            needs_full_load = (
+                self._df is None
+                or force_refresh
+                or self.incremental_query is None
+                or self._watermark is None
+                or (self.full_reload_seconds is not None and now - self._last_full_load >= self.full_reload_seconds)
+            )
+
+            if needs_full_load:
+                self._full_load(now)
+            else:
+                self._incremental_load(now)
+            return self._derived_df if derived else self._df
+
+    def _full_load(self, now):
+        self.stats['misses'] += 1
+        df = self.reader(self.full_query())
+        if df is None:
+            self._on_error()
+            return
+        self._df = self._drop_deleted(df)
+        self._update_derived()
+        self._update_watermark(df)
+        self._last_refresh = now
+        self._last_full_load = now
+        print(f"CACHE: '{self.name}' carregado por completo ({len(self._df)} linhas).")
+
+    def _incremental_load(self, now):
+        self.stats['incremental_refreshes'] += 1
+        elapsed_seconds = int(now - self._last_refresh) + INCREMENTAL_WINDOW_MARGIN_SECONDS
+        delta_df = self.reader(self.incremental_query(self._watermark, elapsed_seconds))
+        if delta_df is None:
+            self._on_error()
+            return
+
+        if not delta_df.empty:
+            merged_df = pd.concat([self._df, delta_df], ignore_index=True)
+            if self.key_columns:
+                merged_df = merged_df.drop_duplicates(subset=self.key_columns, keep='last')
+            self._df = self._drop_deleted(merged_df).reset_index(drop=True)
+            self._update_derived()
+            self._update_watermark(delta_df)
+        self._last_refresh = now
+        print(f"CACHE: '{self.name}' atualizado incrementalmente (+{len(delta_df)} linhas, total {len(self._df)}).")
+
+    def _on_error(self):
+        # Mantém os dados antigos (se houver) em vez de derrubar o ciclo
+        self.stats['errors'] += 1
+        if self._df is not None:
+            print(f"AVISO DE CACHE: Falha ao recarregar '{self.name}'. Usando a versão em memória.")
+        else:
+            print(f"ERRO DE CACHE: Falha ao carregar '{self.name}' e não há versão em memória.")
+
+    def _update_derived(self):
+        if self.derive is not None:
+            self._derived_df = self.derive(self._df)
+
+    def _drop_deleted(self, df):
+        if self.deleted_column and self.deleted_column in df.columns:
+            return df[df[self.deleted_column].isna()]
+        return df
+
+    def _update_watermark(self, df):
+        if self.watermark_column and not df.empty:
+            max_value = df[self.watermark_column].max()
+            if self._watermark is None or max_value > self._watermark:
+                self._watermark = max_value
+
+
+# --- DATASETS DE REFERÊNCIA (mudam na escala de horas) ---
+BLOCKED_PAIRS = CachedDataset(
+    name='blocked_pairs',
+    reader=read_data_from_db,
+    full_query=query_blocked_pairs,
+    ttl_seconds=300,
+    incremental_query=lambda last_id, _elapsed: query_blocked_pairs(since_id=last_id),
+    watermark_column='id',
+    key_columns=['id'],
+    full_reload_seconds=3600  # captura desbloqueios (remoções físicas)
+)
+
+FIXED_PROVIDERS = CachedDataset(
+    name='fixed_providers',
+    reader=read_data_from_db,
+    full_query=query_fixed_providers,
+    ttl_seconds=300,
+    incremental_query=lambda last_id, elapsed: query_fixed_providers(since_id=last_id, changed_in_last_seconds=elapsed),
+    watermark_column='id',
+    key_columns=['id'],
+    deleted_column='deleted_at',
+    full_reload_seconds=6 * 3600
+)
+
+def _pivot_store_locations(attributes_df):
+    """Uma linha por loja (user_id, store_latitude, store_longitude), com coordenadas numéricas."""
+    # O mais recente de cada loja/atributo, como nas CTEs originais (MAX(id))
+    latest_df = attributes_df.sort_values('id').drop_duplicates(subset=['user_id', 'attribute_id'], keep='last')
+    locations_df = latest_df.pivot(index='user_id', columns='attribute_id', values='value')
+    locations_df = locations_df.reindex(columns=[2, 3]).rename(columns={2: 'store_latitude', 3: 'store_longitude'})
+    locations_df = locations_df.apply(pd.to_numeric, errors='coerce')
+    locations_df.columns.name = None
+    return locations_df.reset_index()
+
+STORE_LOCATION_ATTRIBUTES = CachedDataset(
+    name='store_locations',
+    reader=read_data_from_db,
+    full_query=query_store_location_attributes,
+    ttl_seconds=300,
+    incremental_query=lambda last_id, _elapsed: query_store_location_attributes(since_id=last_id),
+    watermark_column='id',
+    key_columns=['user_id', 'attribute_id'],  # o registro mais novo (maior id) vence
+    full_reload_seconds=6 * 3600,
+    derive=_pivot_store_locations
+)
+
+# Agregado numa janela móvel de 14 dias: não há carga incremental, só recarga por TTL
+PROVIDER_RELEASES = CachedDataset(
+    name='provider_releases',
+    reader=read_data_from_db,
+    full_query=lambda: query_provider_release_counts(days=14),
+    ttl_seconds=900
+)
+
+# Scores são recalculados em lote: sem coluna de alteração, só recarga por TTL
+PROVIDER_SCORES = CachedDataset(
+    name='provider_scores',
+    reader=read_data_from_db,
+    full_query=query_provider_scores,
+    ttl_seconds=900
+)
+
+# Estado de ofertas (banco de log): muda a cada ciclo, então o TTL é curto e o
+# refresh_provider_offer_state invalida o cache depois de gravar. Evita duas
+# consultas ao log por cidade (cooldown e filtro de ativos).
+PROVIDER_OFFER_STATE = CachedDataset(
+    name='provider_offer_state',
+    reader=read_log_data,
+    full_query=query_provider_offer_state_snapshot,
+    ttl_seconds=60
+)
+
+CACHED_DATASETS = {dataset.name: dataset for dataset in (
+    BLOCKED_PAIRS, FIXED_PROVIDERS, STORE_LOCATION_ATTRIBUTES, PROVIDER_RELEASES, PROVIDER_SCORES, PROVIDER_OFFER_STATE
+)}
+# ---------------------------------------------------------
+
+
+def get_store_locations():
+    """
+    Retorna a localização de cada loja (user_id, store_latitude, store_longitude),
+    já com as coordenadas numéricas; o pivot é feito uma vez por recarga do cache.
+    Retorna None se o cache não pôde ser carregado.
+    """
+    return STORE_LOCATION_ATTRIBUTES.get(derived=True)
+
+
+def invalidate_cache(name=None):
+    """Invalida um dataset específico ou, sem `name`, todos eles."""
+    targets = [CACHED_DATASETS[name]] if name else CACHED_DATASETS.values()
+    for dataset in targets:
+        dataset.invalidate()
+
+
+def get_cache_stats():
+    """Retorna os contadores de hit/miss de cada dataset em cache."""
+    return {name: dict(dataset.stats) for name, dataset in CACHED_DATASETS.items()}
+
+
+def print_cache_stats():
+    """Imprime um resumo dos contadores do cache (para acompanhar a carga evitada no banco)."""
+    for name, stats in get_cache_stats().items():
+        total = stats['hits'] + stats['misses'] + stats['incremental_refreshes']
+        hit_rate = (stats['hits'] / total * 100) if total else 0.0
+        print(f"CACHE: '{name}': {stats['hits']} hits, {stats['misses']} cargas completas, "
+              f"{stats['incremental_refreshes']} cargas incrementais, {stats['errors']} erros "
+              f"(taxa de acerto {hit_rate:.1f}%).")
+
+
+def attach_release_counts(providers_df):
+    """
+    Acrescenta a coluna 'total_releases_last_2_weeks' (liberações nos últimos
+    14 dias, do cache PROVIDER_RELEASES) ao DataFrame de entregadores.
+    Sem dados no cache, a contagem fica 0 para todos.
+    """
+    releases_df = PROVIDER_RELEASES.get()
+    if releases_df is None:
+        releases_df = pd.DataFrame(columns=['provider_id', 'total_releases'])
+    providers_df = providers_df.merge(releases_df[['provider_id', 'total_releases']], on='provider_id', how='left')
+    providers_df['total_releases_last_2_weeks'] = providers_df.pop('total_releases').fillna(0).astype(int)
+    return providers_df
+
+
+def attach_provider_scores(providers_df):
+    """
+    Acrescenta a coluna 'score' (do cache PROVIDER_SCORES) ao DataFrame de
+    entregadores. Sem dados no cache, o score fica vazio (NaN) para todos.
+    """
+    scores_df = PROVIDER_SCORES.get()
+    if scores_df is None:
+        scores_df = pd.DataFrame(columns=['provider_id', 'score'])
+    return providers_df.merge(scores_df[['provider_id', 'score']], on='provider_id', how='left')
+
+
+def get_cooldown_provider_ids(provider_ids, max_unanswered, cooldown_hours):
+    """
+    Entre os `provider_ids`, os que ignoraram `max_unanswered` ou mais ofertas
+    seguidas e receberam oferta nas últimas `cooldown_hours` horas (horário do
+    banco). Retorna None se o estado não pôde ser carregado.
+    """
+    state_df = PROVIDER_OFFER_STATE.get()
+    if state_df is None:
+        return None
+    if state_df.empty:
+        return []
+    cutoff = pd.to_datetime(state_df['db_now'].iloc[0]) - pd.Timedelta(hours=int(cooldown_hours))
+    on_cooldown = (
+        state_df['provider_id'].isin(provider_ids)
+        & (state_df['unanswered_offers'] >= int(max_unanswered))
+        & (pd.to_datetime(state_df['last_offer_at']) >= cutoff)
+    )
+    return state_df.loc[on_cooldown, 'provider_id'].tolist()
+
+
+def get_responsive_provider_ids(provider_ids):
+    """
+    Entre os `provider_ids`, os que já responderam (aceitaram ou rejeitaram)
+    a alguma oferta. Retorna None se o estado não pôde ser carregado.
+    """
+    state_df = PROVIDER_OFFER_STATE.get()
+    if state_df is None:
+        return None
+    responsive = state_df['provider_id'].isin(provider_ids) & state_df['last_response_at'].notna()
+    return state_df.loc[responsive, 'provider_id'].tolist()
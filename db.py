@@ -1,51 +1,50 @@
-import os
 import pandas as pd
-from peewee import MySQLDatabase
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from connection_pool import get_production_db
 #from query import query_region
 
+# Ids per query when a long id list is fetched in chunks, and how many
+# chunks run at the same time (each one uses a pooled connection)
+ID_CHUNK_SIZE = 1000
+MAX_PARALLEL_CHUNKS = 4
+
 def read_data_from_db(query: list):
     """
-    Connects to the database using peewee, executes the query,
-    and returns the data as a pandas DataFrame.
+    Takes a connection from the shared production pool (peewee),
+    executes the query and returns the data as a pandas DataFrame.
+    The connection goes back to the pool when the query finishes.
     """
-    # Load environment variables from .env file
-    load_dotenv()
-    host = os.getenv('HOST_2')
-    user = os.getenv('USER_2')
-    password = os.getenv('PASSWORD_2')
-    port = int(os.getenv('PORT_2'))
-    database = os.getenv('DATABASE_2')
-    
-    # --- Troubleshooting Step ---
-    # This will print the host being used, to make sure it's correct.
-    print(f"Attempting to connect to host: {host}")
-
-    # Create the database connection object
-    db = MySQLDatabase(
-        database=database,
-        user=user,
-        password=password,
-        host=host,
-        port=port
-    )
-
-    # query = query_region(cities_ids)
+    db = get_production_db()
 
     try:
-        db.connect()
-        print("Successfully connected to the BANCO DE DADOS!")
-
-        # Use pandas to read the data from the database
-        # The db.connection() method gets the underlying DB-API 2 connection
-        df = pd.read_sql_query(query, db.connection())
-        return df
+        # connection_context() borrows a pooled connection for this thread
+        # and returns it to the pool on exit.
+        with db.connection_context():
+            # The db.connection() method gets the underlying DB-API 2 connection
+            df = pd.read_sql_query(query, db.connection())
+            return df
 
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
-    finally:
-        # Check if the connection is open before trying to close it
-        if not db.is_closed():
-            db.close()
-            print("Database connection closed.")
\ No newline at end of file
+
+
+def read_data_by_id_chunks(query_builder, ids: list, chunk_size: int = ID_CHUNK_SIZE,
+                           max_workers: int = MAX_PARALLEL_CHUNKS):
+    """
+    Runs `query_builder(chunk)` for bounded chunks of `ids` concurrently on
+    the production pool and concatenates the results, so the query text
+    (IN list) never grows with the total number of ids.
+    Returns None if any chunk fails, like read_data_from_db.
+    """
+    ids = list(ids)
+    if len(ids) <= chunk_size:
+        return read_data_from_db(query_builder(ids))
+
+    chunks = [ids[start:start + chunk_size] for start in range(0, len(ids), chunk_size)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks)), thread_name_prefix="db-chunk") as executor:
+        results = list(executor.map(lambda chunk: read_data_from_db(query_builder(chunk)), chunks))
+
+    if any(result is None for result in results):
+        return None
+    return pd.concat(results, ignore_index=True)
@@ -0,0 +1,100 @@
+# etl_state.py
+
+import pandas as pd
+from log_db import read_log_data, execute_log_write
+from query import query_etl_watermark
+
+# Status a partir dos quais uma corrida não muda mais (detalhes podem ser congelados)
+TERMINAL_ORDER_STATUSES = ('COMPLETED', 'CANCELLED')
+
+# Releitura de segurança abaixo da marca d'água: eventos com log_id menor podem
+# ser confirmados depois de um log_id maior (transações concorrentes). É uma
+# faixa de log_id (marca d'água - WATERMARK_OVERLAP_IDS), não uma contagem de
+# linhas. Como a carga é um upsert por log_id, reprocessá-los não duplica nada.
+WATERMARK_OVERLAP_IDS = 1000
+
+# Linhas por comando nas escritas em lote
+UPSERT_CHUNK_SIZE = 1000
+
+WATERMARKS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS sai_etl_watermarks (
+        etl_name VARCHAR(64) PRIMARY KEY,
+        last_log_id BIGINT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    );
+"""
+
+
+def get_watermark(etl_name: str):
+    """
+    Retorna o último log_id já processado pelo ETL, 0 se o ETL nunca rodou
+    no modo incremental, ou None se a leitura falhou.
+    A tabela 'sai_etl_watermarks' é criada pelo setup_database.py.
+    """
+    watermark_df = read_log_data(query_etl_watermark(etl_name))
+    if watermark_df is None:
+        return None
+    if watermark_df.empty:
+        return 0
+    return int(watermark_df.iloc[0]['last_log_id'])
+
+
+def save_watermark(etl_name: str, last_log_id: int):
+    """Grava o último log_id processado pelo ETL."""
+    query = """
+        INSERT INTO sai_etl_watermarks (etl_name, last_log_id)
+        VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE last_log_id = VALUES(last_log_id)
+    """
+    return execute_log_write(query, (etl_name, int(last_log_id))) is not None
+
+
+def dataframe_to_rows(df: pd.DataFrame, columns: list):
+    """
+    Converte as colunas do DataFrame em tuplas de tipos nativos do Python
+    (int, datetime, None no lugar de NaN/NaT), prontas para o executemany.
+    """
+    values = df[columns].copy()
+    for column in columns:
+        if pd.api.types.is_datetime64_any_dtype(values[column]):
+            values[column] = pd.Series(values[column].dt.to_pydatetime(), index=values.index, dtype=object)
+    values = values.astype(object).where(values.notna(), None)
+    return list(values.itertuples(index=False, name=None))
+
+
+def upsert_rows(table_name: str, columns: list, rows: list, update_columns: list):
+    """
+    Insere as linhas na tabela e, em caso de chave duplicada, atualiza as
+    colunas `update_columns`. Escreve em blocos de UPSERT_CHUNK_SIZE linhas.
+    Retorna o número de linhas enviadas, ou None em caso de erro.
+    """
+    if not rows:
+        return 0
+    placeholders = ", ".join(["%s"] * len(columns))
+    updates = ", ".join(f"{column} = VALUES({column})" for column in update_columns)
+    query = f"""
+        INSERT INTO {table_name} ({', '.join(columns)})
+        VALUES ({placeholders})
+        ON DUPLICATE KEY UPDATE {updates}
+    """
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        if execute_log_write(query, rows[start:start + UPSERT_CHUNK_SIZE], many=True) is None:
+            return None
+    return len(rows)
+
+
+def update_order_details(table_name: str, order_details_df: pd.DataFrame, detail_columns: list):
+    """
+    Atualiza os detalhes (status final, datas...) de corridas já carregadas
+    na tabela de análise, uma linha de comando por order_id.
+    Retorna o número de corridas enviadas, ou None em caso de erro.
+    """
+    if order_details_df is None or order_details_df.empty:
+        return 0
+    assignments = ", ".join(f"{column} = %s" for column in detail_columns)
+    query = f"UPDATE {table_name} SET {assignments} WHERE order_id = %s"
+    rows = dataframe_to_rows(order_details_df, detail_columns + ['order_id'])
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        if execute_log_write(query, rows[start:start + UPSERT_CHUNK_SIZE], many=True) is None:
+            return None
+    return len(rows)
@@ -0,0 +1,188 @@
+# event_logger.py
+
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from log_db import insert_sai_events
+
+# --- CONFIGURAÇÕES DO LOG DE EVENTOS EM LOTE ---
+FLUSH_BATCH_SIZE = 100          # Grava assim que houver esse número de eventos na fila
+FLUSH_INTERVAL_SECONDS = 2.0    # ...ou, no máximo, a cada X segundos
+MAX_QUEUE_SIZE = 10000          # Fila cheia (MySQL lento) => eventos vão direto para o spill
+SLOW_FLUSH_SECONDS = 5.0        # Gravações mais lentas que isso geram um aviso
+SHUTDOWN_FLUSH_TIMEOUT_SECONDS = 10
+SPILL_FILE_PATH = os.getenv('SAI_EVENT_SPILL_FILE', 'sai_event_spill.jsonl')
+# -----------------------------------------------
+
+
+class BufferedEventLogger:
+    """
+    Fila em memória para os eventos da 'sai_event_log'. Quem registra um
+    evento só enfileira (sem ida ao banco); uma thread em segundo plano grava
+    os eventos em lote por tamanho ou por tempo. Se o MySQL falhar, ou a fila
+    encher porque as gravações estão lentas, os eventos vão para um arquivo
+    local de spill, que é reenviado no próximo flush bem-sucedido.
+    """
+
+    def __init__(self, batch_size=FLUSH_BATCH_SIZE, flush_interval=FLUSH_INTERVAL_SECONDS,
+                 max_queue_size=MAX_QUEUE_SIZE, spill_path=SPILL_FILE_PATH):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._flush_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'written': 0, 'spilled': 0, 'replayed': 0, 'batches': 0}
+
+    @property
+    def stats(self):
+        """Cópia dos contadores (enfileirados, gravados, spill, reenviados, lotes)."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def log(self, order_id: int, provider_id: int, event_type: str, metadata: dict = None):
+        """Enfileira um evento, guardando o horário em que ele aconteceu."""
+        metadata_json = json.dumps(metadata) if metadata else None
+        event = (order_id, provider_id, event_type, metadata_json, time.time())
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+            self._add_stats(enqueued=1)
+        except queue.Full:
+            print(f"AVISO: Fila de eventos cheia; evento '{event_type}' da ordem {order_id} enviado para o spill.")
+            self._spill([event])
+
+    def flush(self):
+        """Grava agora todos os eventos da fila (e reenvia o spill, se houver)."""
+        with self._flush_lock:
+            while True:
+                batch = self._drain(self.batch_size)
+                if not batch:
+                    break
+                if not self._write(batch):
+                    self._spill(batch)
+                    # O banco está indisponível: o restante também vai para o spill.
+                    self._spill(self._drain(None))
+                    return
+            self._replay_spill()
+
+    def shutdown(self):
+        """Para a thread de flush e grava o que ainda estiver na fila."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=SHUTDOWN_FLUSH_TIMEOUT_SECONDS)
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sai-event-logger", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stop_event.is_set():
+            if self._queue.qsize() >= self.batch_size or time.monotonic() >= next_flush:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"ERRO DE LOG: Falha inesperada no flush de eventos: {e}")
+                next_flush = time.monotonic() + self.flush_interval
+            self._stop_event.wait(0.1)
+
+    def _drain(self, limit):
+        batch = []
+        while limit is None or len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, events):
+        now = time.time()
+        # O atraso (em segundos) deixa o banco calcular o horário real do evento
+        # com o seu próprio relógio (NOW() - INTERVAL atraso SECOND).
+        rows = [(order_id, provider_id, event_type, metadata_json, max(0, int(now - logged_at)))
+                for order_id, provider_id, event_type, metadata_json, logged_at in events]
+
+        started_at = time.monotonic()
+        success = insert_sai_events(rows)
+        elapsed = time.monotonic() - started_at
+
+        if success:
+            self._add_stats(written=len(events), batches=1)
+            print(f"LOG: {len(events)} eventos registrados em lote ({elapsed:.2f}s).")
+            if elapsed > SLOW_FLUSH_SECONDS:
+                print(f"AVISO: Gravação de eventos lenta no banco de log ({elapsed:.1f}s).")
+        return success
+
+    def _spill(self, events):
+        if not events:
+            return
+        with self._spill_lock:
+            try:
+                with open(self.spill_path, 'a', encoding='utf-8') as spill_file:
+                    for event in events:
+                        spill_file.write(json.dumps(event) + "\n")
+                self._add_stats(spilled=len(events))
+                print(f"AVISO: {len(events)} eventos guardados no arquivo de spill '{self.spill_path}'.")
+            except OSError as e:
+                print(f"ERRO DE LOG: Falha ao gravar o spill; {len(events)} eventos perdidos: {e}")
+
+    def _replay_spill(self):
+        if not os.path.exists(self.spill_path):
+            return
+        with self._spill_lock:
+            try:
+                with open(self.spill_path, 'r', encoding='utf-8') as spill_file:
+                    events = [tuple(json.loads(line)) for line in spill_file if line.strip()]
+            except (OSError, ValueError) as e:
+                print(f"ERRO DE LOG: Falha ao ler o arquivo de spill: {e}")
+                return
+
+            for start in range(0, len(events), self.batch_size):
+                if not self._write(events[start:start + self.batch_size]):
+                    if start > 0:
+                        # Mantém no arquivo só o que ainda não foi gravado.
+                        with open(self.spill_path, 'w', encoding='utf-8') as spill_file:
+                            for event in events[start:]:
+                                spill_file.write(json.dumps(event) + "\n")
+                        self._add_stats(replayed=start)
+                    return
+
+            os.remove(self.spill_path)
+            self._add_stats(replayed=len(events))
+            print(f"INFO: {len(events)} eventos do arquivo de spill reenviados ao banco de log.")
+
+    def _add_stats(self, **increments):
+        # Chamado pelas threads de envio, pelos jobs do webhook e pela thread de flush
+        with self._stats_lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+
+event_logger = BufferedEventLogger()
+atexit.register(event_logger.shutdown)
+
+
+def log_sai_event(order_id: int, provider_id: int, event_type: str, metadata: dict = None):
+    """
+    Registra um evento na tabela 'sai_event_log'. O evento é apenas
+    enfileirado; a gravação acontece em lote, em segundo plano.
+    """
+    event_logger.log(order_id, provider_id, event_type, metadata)
+
+
+def flush_sai_events():
+    """Força a gravação imediata dos eventos pendentes (ex.: fim de um script)."""
+    event_logger.flush()
@@ -0,0 +1,71 @@
+# geo_distance.py
+
+import numpy as np
+
+# --- MODOS DE PRECISÃO DISPONÍVEIS ---
+# 'haversine': esfera de raio médio. Mais rápido, erro de até ~0,6%.
+# 'ellipsoidal': fórmula de Lambert sobre o elipsoide WGS-84. Erro de poucos
+#                metros nas distâncias usadas pelo SAI (equivalente ao geodesic).
+DISTANCE_MODE_HAVERSINE = 'haversine'
+DISTANCE_MODE_ELLIPSOIDAL = 'ellipsoidal'
+DISTANCE_MODES = (DISTANCE_MODE_HAVERSINE, DISTANCE_MODE_ELLIPSOIDAL)
+# -------------------------------------
+
+EARTH_MEAN_RADIUS_KM = 6371.0088
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+
+
+def _central_angle(lat1, lon1, lat2, lon2):
+    """
+    Calcula o ângulo central (em radianos) entre pares de pontos já
+    convertidos para radianos, usando a forma numericamente estável do haversine.
+    """
+    sin_dlat = np.sin((lat2 - lat1) / 2.0)
+    sin_dlon = np.sin((lon2 - lon1) / 2.0)
+    h = sin_dlat ** 2 + np.cos(lat1) * np.cos(lat2) * sin_dlon ** 2
+    return 2.0 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Distância em km entre arrays de coordenadas (graus), assumindo a Terra
+    como uma esfera de raio médio.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    return EARTH_MEAN_RADIUS_KM * _central_angle(lat1, lon1, lat2, lon2)
+
+
+def ellipsoidal_km(lat1, lon1, lat2, lon2):
+    """
+    Distância em km entre arrays de coordenadas (graus) usando a fórmula de
+    Lambert para o elipsoide WGS-84 (o mesmo usado pelo geopy.geodesic).
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+
+    # Latitudes reduzidas
+    beta1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    beta2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sigma = _central_angle(beta1, lon1, beta2, lon2)
+
+    p = (beta1 + beta2) / 2.0
+    q = (beta2 - beta1) / 2.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (sigma - np.sin(sigma)) * (np.sin(p) ** 2 * np.cos(q) ** 2) / np.cos(sigma / 2.0) ** 2
+        y = (sigma + np.sin(sigma)) * (np.cos(p) ** 2 * np.sin(q) ** 2) / np.sin(sigma / 2.0) ** 2
+        distance = WGS84_A_KM * (sigma - (WGS84_F / 2.0) * (x + y))
+
+    # Pontos coincidentes geram 0/0 no termo Y
+    return np.where(sigma == 0.0, 0.0, distance)
+
+
+def calculate_distances_km(lat1, lon1, lat2, lon2, mode=DISTANCE_MODE_ELLIPSOIDAL):
+    """
+    Calcula, de forma vetorizada, a distância em km entre cada par de pontos
+    (lat1[i], lon1[i]) -> (lat2[i], lon2[i]) no modo de precisão escolhido.
+    """
+    if mode == DISTANCE_MODE_HAVERSINE:
+        return haversine_km(lat1, lon1, lat2, lon2)
+    if mode == DISTANCE_MODE_ELLIPSOIDAL:
+        return ellipsoidal_km(lat1, lon1, lat2, lon2)
+    raise ValueError(f"Modo de distância desconhecido: '{mode}'. Use um de {DISTANCE_MODES}.")
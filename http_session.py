@@ -0,0 +1,68 @@
+# http_session.py
+
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- CONFIGURAÇÕES DA SESSÃO HTTP COMPARTILHADA ---
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 10))  # Hosts distintos mantidos no pool
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 20))          # Conexões keep-alive por host
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv('HTTP_CONNECT_TIMEOUT_SECONDS', 5))
+# --------------------------------------------------
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Sessão requests única do processo (worker ou webhook), com pool de
+    conexões keep-alive por host: as chamadas ao Chatguru, à API interna e à
+    OpenAI reaproveitam a conexão TCP/TLS em vez de abrir uma nova a cada POST.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def http_timeout(read_timeout_seconds):
+    """Timeout (conexão, leitura) para as chamadas feitas com a sessão compartilhada."""
+    return (HTTP_CONNECT_TIMEOUT_SECONDS, read_timeout_seconds)
+
+
+def get_http_stats():
+    """
+    Retorna, por host, quantas conexões foram abertas e quantas requisições
+    foram feitas pela sessão (contadores do pool do urllib3).
+    """
+    if _session is None:
+        return {}
+    stats = {}
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}"
+            host_stats = stats.setdefault(host, {'connections': 0, 'requests': 0})
+            host_stats['connections'] += pool.num_connections
+            host_stats['requests'] += pool.num_requests
+    return stats
+
+
+def print_http_stats():
+    """Imprime o reaproveitamento de conexões da sessão HTTP compartilhada."""
+    for host, stats in get_http_stats().items():
+        reused = stats['requests'] - stats['connections']
+        reuse_rate = (reused / stats['requests'] * 100) if stats['requests'] else 0.0
+        print(f"HTTP: {host}: {stats['requests']} requisições em {stats['connections']} conexões "
+              f"(reaproveitamento {reuse_rate:.1f}%).")
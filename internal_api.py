@@ -2,13 +2,23 @@
 
 import requests
 import json
+import time
+import base64
+import threading
 import urllib3
+from http_session import get_http_session, http_timeout
 
 # Desativa os avisos de segurança sobre a não verificação do SSL.
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 BASE_URL = "https://api.giross.com.br/api/painel"
 
+# --- CONFIGURAÇÕES DO CACHE DE TOKEN ---
+TOKEN_REFRESH_MARGIN_SECONDS = 300  # Renova o token em segundo plano X segundos antes de expirar
+DEFAULT_TOKEN_TTL_SECONDS = 1800    # Validade assumida quando o token não traz 'exp' (não é um JWT)
+TOKEN_RETRY_DELAY_SECONDS = 30      # Espera antes de tentar de novo uma renovação que falhou
+# ---------------------------------------
+
 def login(email, password):
     """
     Realiza o login na API interna e retorna o token de acesso.
@@ -34,7 +44,7 @@ def login(email, password):
     
     print(f"INFO: A tentar fazer login no ambiente de PRODUÇÃO...")
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=15, verify=False)
+        response = get_http_session().post(url, headers=headers, data=json.dumps(payload), timeout=http_timeout(15), verify=False)
         response.raise_for_status()
         
         data = response.json()
@@ -57,9 +67,10 @@ def login(email, password):
         print(f"ERRO: Falha de rede ao fazer login: {e}")
         return None
 
-def assign_order(access_token, provider_id, order_id):
+def _post_assign(access_token, provider_id, order_id):
     """
-    Atribui uma corrida a um entregador.
+    Chama o endpoint de atribuição e retorna (sucesso, status_http).
+    O status é None quando a falha é de rede.
     """
     url = f"{BASE_URL}/sai/assign"
     payload = {"provider_id": provider_id, "request_id": order_id}
@@ -71,17 +82,122 @@ def assign_order(access_token, provider_id, order_id):
 
     print(f"INFO: A tentar atribuir a ordem {order_id} ao provedor {provider_id}...")
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=15, verify=False)
+        response = get_http_session().post(url, headers=headers, data=json.dumps(payload), timeout=http_timeout(15), verify=False)
         response.raise_for_status()
         
         data = response.json()
         if data.get('success'):
             print(f"SUCESSO: Ordem {order_id} atribuída com sucesso!")
-            return True
+            return True, response.status_code
         else:
             print(f"FALHA: A API não retornou sucesso para a atribuição da ordem {order_id}.")
-            return False
+            return False, response.status_code
 
+    except requests.exceptions.HTTPError as http_err:
+        print(f"ERRO: Falha ao atribuir a ordem: {http_err}")
+        return False, http_err.response.status_code
     except requests.exceptions.RequestException as e:
         print(f"ERRO: Falha ao atribuir a ordem: {e}")
-        return False
+        return False, None
+
+def assign_order(access_token, provider_id, order_id):
+    """
+    Atribui uma corrida a um entregador.
+    """
+    success, _ = _post_assign(access_token, provider_id, order_id)
+    return success
+
+def _decode_token_expiry(access_token):
+    """
+    Lê o campo 'exp' (epoch em segundos) do payload de um JWT, sem validar a
+    assinatura. Retorna None se o token não for um JWT ou não tiver 'exp'.
+    """
+    try:
+        payload_b64 = access_token.split('.')[1]
+        payload_b64 += '=' * (-len(payload_b64) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(payload_b64))
+        return float(payload['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class AccessTokenManager:
+    """
+    Mantém em cache o access_token da API interna, compartilhado por todas as
+    threads do processo. A validade vem do 'exp' do JWT (ou de
+    DEFAULT_TOKEN_TTL_SECONDS); o token é renovado em segundo plano antes de
+    expirar, e uma resposta 401 força um novo login e uma única nova tentativa.
+    """
+
+    def __init__(self, email, password, refresh_margin=TOKEN_REFRESH_MARGIN_SECONDS):
+        self.email = email
+        self.password = password
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_timer = None
+
+    def get_token(self):
+        """Retorna um token válido, fazendo login apenas se não houver um em cache."""
+        token, expires_at = self._token, self._expires_at
+        if token and time.time() < expires_at:
+            return token
+        with self._lock:
+            if self._token and time.time() < self._expires_at:
+                return self._token
+            return self._login_locked()
+
+    def invalidate(self, rejected_token=None):
+        """Descarta o token em cache (se ainda for o `rejected_token`, quando informado)."""
+        with self._lock:
+            if rejected_token is None or self._token == rejected_token:
+                self._token = None
+                self._expires_at = 0.0
+
+    def assign_order(self, provider_id, order_id):
+        """
+        Atribui uma corrida usando o token em cache. Se a API responder 401,
+        renova o token e tenta mais uma vez.
+        Retorna True/False, ou None se não foi possível obter um token (falha no login).
+        """
+        access_token = self.get_token()
+        if not access_token:
+            return None
+
+        success, status_code = _post_assign(access_token, provider_id, order_id)
+        if status_code != 401:
+            return success
+
+        print("AVISO: Token da API interna recusado (401). Renovando e tentando novamente...")
+        self.invalidate(access_token)
+        access_token = self.get_token()
+        if not access_token:
+            return None
+        success, _ = _post_assign(access_token, provider_id, order_id)
+        return success
+
+    def _login_locked(self):
+        token = login(self.email, self.password)
+        if not token:
+            return None
+
+        expires_at = _decode_token_expiry(token) or (time.time() + DEFAULT_TOKEN_TTL_SECONDS)
+        self._token = token
+        # Considera o token expirado um pouco antes, para nunca usar um token no limite
+        self._expires_at = expires_at - min(60, self.refresh_margin)
+        self._schedule_refresh(max(TOKEN_RETRY_DELAY_SECONDS, expires_at - time.time() - self.refresh_margin))
+        return token
+
+    def _schedule_refresh(self, delay_seconds):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        self._refresh_timer = threading.Timer(delay_seconds, self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _background_refresh(self):
+        with self._lock:
+            print("INFO: Renovando o token da API interna em segundo plano...")
+            if self._login_locked() is None:
+                self._schedule_refresh(TOKEN_RETRY_DELAY_SECONDS)
@@ -1,117 +1,78 @@
 # log_db.py
 
-import os
 import pymysql
-import json
 import pandas as pd
-from dotenv import load_dotenv
+from peewee import PeeweeException
+from connection_pool import get_log_db, get_log_engine, log_db_configured
 
-def log_sai_event(order_id: int, provider_id: int, event_type: str, metadata: dict = None):
+# Erros possíveis ao usar uma conexão do pool (driver, peewee ou pandas)
+LOG_DB_ERRORS = (pymysql.Error, PeeweeException, pd.errors.DatabaseError)
+
+def insert_sai_events(events: list):
     """
-    Conecta-se ao banco de dados de desenvolvimento e insere um novo
-    registro de evento na tabela 'sai_event_log'.
+    Insere vários eventos na tabela 'sai_event_log' com um único INSERT de
+    múltiplas linhas, numa única transação. Cada evento é uma tupla
+    (order_id, provider_id, event_type, metadata_json, delay_seconds), onde
+    `delay_seconds` é há quanto tempo o evento aconteceu (para preservar o
+    horário real quando a escrita é feita em lote, mais tarde).
+    Retorna True em caso de sucesso.
     """
-    load_dotenv()
-    
-    # Carrega as credenciais específicas para o banco de dados de log
-    host = os.getenv('LOG_DB_HOST')
-    user = os.getenv('LOG_DB_USER')
-    password = os.getenv('LOG_DB_PASSWORD')
-    port = int(os.getenv('LOG_DB_PORT'))
-    db_name = os.getenv('LOG_DB_NAME')
-
-    if not all([host, user, password, port, db_name]):
+    if not events:
+        return True
+    if not log_db_configured():
         print("ERRO DE LOG: Verifique se as variáveis LOG_DB_* estão definidas no seu .env.")
-        return
+        return False
+
+    placeholders = ", ".join(["(%s, %s, %s, %s, NOW() - INTERVAL %s SECOND)"] * len(events))
+    query = f"""
+        INSERT INTO sai_event_log (order_id, provider_id, event_type, metadata, event_timestamp)
+        VALUES {placeholders}
+    """
+    params = [value for event in events for value in event]
 
-    db_connection = None
-    cursor = None
+    db = get_log_db()
     try:
-        db_connection = pymysql.connect(
-            host=host, user=user, password=password, database=db_name,
-            port=int(port), connect_timeout=15
-        )
-        cursor = db_connection.cursor()
-        
-        # Converte o dicionário de metadados para uma string JSON
-        metadata_json = json.dumps(metadata) if metadata else None
-        
-        query = """
-            INSERT INTO sai_event_log (order_id, provider_id, event_type, metadata)
-            VALUES (%s, %s, %s, %s)
-        """
-        
-        cursor.execute(query, (order_id, provider_id, event_type, metadata_json))
-        db_connection.commit()
-        
-        print(f"LOG: Evento '{event_type}' para a ordem {order_id} registrado com sucesso.")
-
-    except pymysql.Error as err:
-        print(f"ERRO DE LOG: Falha ao registrar o evento '{event_type}': {err}")
-
-    finally:
-        if cursor:
-            cursor.close()
-        if db_connection:
-            db_connection.close()
+        with db.connection_context():
+            with db.atomic():
+                cursor = db.cursor()
+                cursor.execute(query, params)
+                cursor.close()
+        return True
+
+    except LOG_DB_ERRORS as err:
+        print(f"ERRO DE LOG: Falha ao registrar {len(events)} eventos em lote: {err}")
+        return False
 
 def read_log_data(query: str):
     """
-    Conecta-se ao banco de dados de log com as credenciais corretas e
-    lê os dados usando pandas.
+    Usa uma conexão do pool do banco de log e lê os dados usando pandas.
     """
-    load_dotenv()
-    
-    host = os.getenv('LOG_DB_HOST')
-    user = os.getenv('LOG_DB_USER')
-    password = os.getenv('LOG_DB_PASSWORD')
-    port = int(os.getenv('LOG_DB_PORT'))
-    db_name = os.getenv('LOG_DB_NAME')
-
-    if not all([host, user, password, port, db_name]):
+    if not log_db_configured():
         print("ERRO DE LEITURA DE LOG: Verifique se as variáveis LOG_DB_* estão definidas no seu .env.")
         return None
 
-    db_connection = None
+    db = get_log_db()
     try:
-        db_connection = pymysql.connect(
-            host=host, user=user, password=password, database=db_name,
-            port=int(port), connect_timeout=15
-        )
-        
-        result_df = pd.read_sql_query(query, db_connection)
-        return result_df
-
-    except pymysql.Error as err:
+        with db.connection_context():
+            result_df = pd.read_sql_query(query, db.connection())
+            return result_df
+
+    except LOG_DB_ERRORS as err:
         print(f"\nERRO DE LEITURA DE LOG: Ocorreu um erro com o PyMySQL: {err}")
         return None
-    
-    finally:
-        if db_connection:
-            db_connection.close()
-    
+
 def write_dataframe_to_db(df, table_name: str):
     """
-    Conecta-se ao banco de dados de log e salva um DataFrame pandas em uma tabela.
-    A tabela será criada se não existir, e os dados serão anexados.
+    Salva um DataFrame pandas em uma tabela do banco de log, usando a engine
+    SQLAlchemy compartilhada. A tabela será criada se não existir, e os dados serão anexados.
     """
-    load_dotenv()
-    
-    host = os.getenv('LOG_DB_HOST')
-    user = os.getenv('LOG_DB_USER')
-    password = os.getenv('LOG_DB_PASSWORD')
-    port = int(os.getenv('LOG_DB_PORT'))
-    db_name = os.getenv('LOG_DB_NAME')
-
-    if not all([host, user, password, port, db_name]):
+    if not log_db_configured():
         print(f"ERRO DE ESCRITA DE LOG: Verifique as variáveis LOG_DB_* no .env.")
         return False
 
     try:
-        # Usando SQLAlchemy para uma escrita de DataFrame mais robusta
-        from sqlalchemy import create_engine
-        engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}/{db_name}")
-        
+        engine = get_log_engine()
+
         print(f"INFO: Escrevendo {len(df)} registros na tabela '{table_name}'...")
         # 'append' adiciona os dados. Se a tabela não existir, 'to_sql' a cria.
         df.to_sql(table_name, con=engine, if_exists='append', index=False)
@@ -121,45 +82,55 @@ def write_dataframe_to_db(df, table_name: str):
     except Exception as err:
         print(f"ERRO DE ESCRITA DE LOG: Falha ao escrever na tabela '{table_name}': {err}")
         return False
-    
+
+def execute_log_write(query: str, params=None, many: bool = False):
+    """
+    Usa uma conexão do pool do banco de log e executa um comando de escrita
+    (INSERT/UPDATE/DELETE) com parâmetros, numa única transação. Com `many=True`,
+    `params` é uma lista de tuplas enviada via executemany. Retorna o número de
+    linhas afetadas ou None em caso de erro.
+    """
+    if not log_db_configured():
+        print("ERRO DE ESCRITA DE LOG: Verifique as variáveis LOG_DB_* no .env.")
+        return None
+
+    db = get_log_db()
+    try:
+        with db.connection_context():
+            with db.atomic():
+                cursor = db.cursor()
+                if many:
+                    cursor.executemany(query, params or [])
+                else:
+                    cursor.execute(query, params)
+                rowcount = cursor.rowcount
+                cursor.close()
+            return rowcount
+
+    except LOG_DB_ERRORS as err:
+        print(f"ERRO DE ESCRITA DE LOG: Falha ao executar o comando: {err}")
+        return None
+
 def update_city_last_run(city_id: int):
     """
     Atualiza o campo 'last_run_timestamp' para o horário atual para uma
     cidade específica na tabela de configurações.
     """
-    load_dotenv()
-    
-    host = os.getenv('LOG_DB_HOST')
-    user = os.getenv('LOG_DB_USER')
-    password = os.getenv('LOG_DB_PASSWORD')
-    port = int(os.getenv('LOG_DB_PORT'))
-    db_name = os.getenv('LOG_DB_NAME')
-
-    if not all([host, user, password, port, db_name]):
+    if not log_db_configured():
         print(f"ERRO DE ATUALIZAÇÃO DE LOG: Verifique as variáveis LOG_DB_* para a cidade {city_id}.")
         return
 
-    db_connection = None
-    cursor = None
+    db = get_log_db()
     try:
-        db_connection = pymysql.connect(
-            host=host, user=user, password=password, database=db_name,
-            port=int(port), connect_timeout=15
-        )
-        cursor = db_connection.cursor()
-        
         query = "UPDATE sai_city_configs SET last_run_timestamp = NOW() WHERE city_id = %s"
-        
-        cursor.execute(query, (city_id,))
-        db_connection.commit()
-        
+
+        with db.connection_context():
+            with db.atomic():
+                cursor = db.cursor()
+                cursor.execute(query, (city_id,))
+                cursor.close()
+
         print(f"LOG: Timestamp de execução atualizado para a cidade {city_id}.")
 
-    except pymysql.Error as err:
+    except LOG_DB_ERRORS as err:
         print(f"ERRO DE ATUALIZAÇÃO DE LOG: Falha ao atualizar o timestamp para a cidade {city_id}: {err}")
-
-    finally:
-        if cursor:
-            cursor.close()
-        if db_connection:
-            db_connection.close()
\ No newline at end of file
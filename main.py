@@ -7,15 +7,23 @@ from dotenv import load_dotenv
 from chatguru_api import ChatguruWABA
 from db import read_data_from_db
 from query import (
-    query_stuck_orders, query_available_providers, query_blocked_pairs, 
-    query_offers_sent, query_offline_providers_with_history, 
-    query_responsive_providers, query_fixed_providers, query_sai_city_configs,
-    query_providers_on_unanswered_cooldown, query_offline_providers_by_city,
-    query_providers_on_active_orders
+    query_stuck_orders, query_offline_providers_with_history, 
+    query_sai_city_configs, query_offline_providers_by_city
 )
-from geopy.distance import geodesic
+from geo_distance import DISTANCE_MODE_ELLIPSOIDAL
+from spatial_index import find_nearby_pairs
+from cycle_snapshot import CycleSnapshot, load_offers_already_sent
+from data_cache import (
+    get_store_locations, attach_release_counts, attach_provider_scores,
+    get_cooldown_provider_ids, get_responsive_provider_ids
+)
+from offer_dispatcher import dispatch_offers
+from chat_registry import get_registered_chat_number, save_chat_registration, invalidate_chat_registration
+from assignment import select_best_matches, ASSIGNMENT_MODE_GREEDY
 import pandas as pd
-from log_db import log_sai_event, read_log_data
+from log_db import read_log_data
+from event_logger import log_sai_event
+from provider_offer_state import refresh_provider_offer_state
 
 pd.set_option('display.max_columns', None)
 
@@ -23,33 +31,25 @@ pd.set_option('display.max_columns', None)
 DIALOG_ID_PARA_OFERTA = "68681a2827f824ecd929292a" 
 AVG_SPEED_KMH = 25
 FILTER_ONLY_ACTIVE_PROVIDERS = False
+DISTANCE_MODE = DISTANCE_MODE_ELLIPSOIDAL # 'ellipsoidal' (precisão do geodesic) ou 'haversine' (mais rápido)
+ASSIGNMENT_MODE = ASSIGNMENT_MODE_GREEDY # 'greedy' (por corrida) ou 'optimal' (fluxo de custo mínimo na cidade)
+OFFER_DISPATCH_CONCURRENCY = 10 # Ofertas enviadas em paralelo por cidade
 # ---------------------------------------------------------
 
 
-def run_offer_workflow(chat_number, match_data, template_params):
+def register_chat_and_wait(api, chat_number, provider_name):
     """
-    Executa o fluxo completo, com verificação de status do chat e logging.
-    Retorna a resposta da API do Chatguru.
+    Registra o chat no Chatguru e acompanha o status do registro.
+    Retorna (número_final_do_chat, status, None) em caso de sucesso ou
+    (None, None, resposta_de_erro) em caso de falha.
     """
-    load_dotenv()
-    chat_key = os.getenv("CHAT_GURU_KEY")
-    chat_account_id = os.getenv("CHAT_GURU_ACCOUNT_ID")
-    chat_phone_id = os.getenv("CHAT_GURU_PHONE_ID")
-    chat_url = os.getenv("CHAT_GURU_URL")
-
-    if not all([chat_key, chat_account_id, chat_phone_id, chat_url]):
-        print("ERRO: Credenciais do Chatguru não encontradas no .env")
-        return None
-
-    api = ChatguruWABA(chat_key, chat_account_id, chat_phone_id, chat_url)
-    
     print(f"Etapa 1: Registrando chat com o número {chat_number}...")
-    register_response = api.register_chat(chat_number, match_data.get("provider_name", "Novo Provedor"))
+    register_response = api.register_chat(chat_number, provider_name)
     
     chat_add_id = register_response.get('chat_add_id')
     if not chat_add_id:
         print(f"ERRO: Falha ao iniciar o registro do chat para {chat_number}. Resposta: {register_response}")
-        return register_response
+        return None, None, register_response
 
     final_chat_number = chat_number
     for i in range(5):
@@ -69,16 +69,21 @@ def run_offer_workflow(chat_number, match_data, template_params):
                         print(f"INFO: O número do chat foi corrigido para {final_chat_number}")
                 except IndexError:
                     print("AVISO: A descrição continha 'corrigido para', mas não foi possível extrair o novo número.")
-            break
+            return final_chat_number, chat_status, None
         
         if chat_status != 'pending':
             print(f"ERRO: O registro do chat falhou com o status '{chat_status}'. Descrição: {description}")
-            return status_response
+            return None, None, status_response
         sleep(3)
-    else:
-        print(f"ERRO: Timeout. O registro do chat para {chat_number} não foi concluído após 15 segundos.")
-        return {"result": "error", "description": "Timeout on chat registration"}
 
+    print(f"ERRO: Timeout. O registro do chat para {chat_number} não foi concluído após 15 segundos.")
+    return None, None, {"result": "error", "description": "Timeout on chat registration"}
+
+def send_offer_dialog(api, final_chat_number, match_data, template_params):
+    """
+    Atualiza os campos personalizados do chat e executa o diálogo de oferta.
+    Retorna a resposta da execução do diálogo.
+    """
     print(f"Etapa 2: Atualizando campos personalizados para o chat {final_chat_number}...")
     custom_fields = {"order_id": str(match_data.get('order_id')), "provider_id": str(match_data.get('provider_id'))}
     api.update_custom_fields(final_chat_number, custom_fields)
@@ -91,6 +96,42 @@ def run_offer_workflow(chat_number, match_data, template_params):
     
     return dialog_response
 
+def run_offer_workflow(chat_number, match_data, template_params):
+    """
+    Executa o fluxo completo, com verificação de status do chat e logging.
+    Telefones com chat já confirmado no cache de registros pulam o registro
+    e o polling de status. Retorna a resposta da API do Chatguru.
+    """
+    load_dotenv()
+    chat_key = os.getenv("CHAT_GURU_KEY")
+    chat_account_id = os.getenv("CHAT_GURU_ACCOUNT_ID")
+    chat_phone_id = os.getenv("CHAT_GURU_PHONE_ID")
+    chat_url = os.getenv("CHAT_GURU_URL")
+
+    if not all([chat_key, chat_account_id, chat_phone_id, chat_url]):
+        print("ERRO: Credenciais do Chatguru não encontradas no .env")
+        return None
+
+    api = ChatguruWABA(chat_key, chat_account_id, chat_phone_id, chat_url)
+    provider_name = match_data.get("provider_name", "Novo Provedor")
+
+    cached_chat_number = get_registered_chat_number(chat_number)
+    if cached_chat_number:
+        print(f"Etapa 1: Chat de {chat_number} já registrado (cache: {cached_chat_number}). Pulando o registro.")
+        dialog_response = send_offer_dialog(api, cached_chat_number, match_data, template_params)
+        if dialog_response and dialog_response.get('result') == 'success':
+            return dialog_response
+        # O chat em cache pode ter deixado de existir: registra de novo e tenta mais uma vez
+        print(f"AVISO: Falha ao usar o chat em cache para {chat_number}. Refazendo o registro...")
+        invalidate_chat_registration(chat_number)
+
+    final_chat_number, chat_status, error_response = register_chat_and_wait(api, chat_number, provider_name)
+    if error_response is not None:
+        return error_response
+
+    save_chat_registration(chat_number, final_chat_number, chat_status)
+    return send_offer_dialog(api, final_chat_number, match_data, template_params)
+
 def clean_and_format_phone(phone_number):
     """
     Limpa e formata um número de telefone brasileiro para o formato E.164.
@@ -106,9 +147,11 @@ def clean_and_format_phone(phone_number):
         return f"55{cleaned_number}"
     return cleaned_number
 
-def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0):
+def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0, snapshot=None):
     """
     Encapsula toda a lógica de busca e oferta para UMA ÚNICA CIDADE.
+    `snapshot` é a fotografia global do ciclo (CycleSnapshot); se não for
+    informada, é carregada aqui mesmo (ex: execução local de uma cidade).
     """
     city_id = city_config['city_id']
     city_name = city_config['city_name']
@@ -122,13 +165,23 @@ def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0)
     print(f"\n--- PROCESSANDO CIDADE: {city_name} (ID: {city_id}) ---")
     print(f"Configurações: Limite Travada={stuck_threshold}min, MaxOfertas={max_offers}, Distância={offer_distance}km")
     
-    stuck_orders_df = read_data_from_db(query_stuck_orders(city_id, stuck_threshold))
+    stuck_orders_df = read_data_from_db(query_stuck_orders(city_id, stuck_threshold, include_store_location=False))
     
     if stuck_orders_df is None or stuck_orders_df.empty:
         print(f"INFO: Nenhuma corrida travada encontrada para {city_name}.")
         return
 
-    online_providers_df = read_data_from_db(query_available_providers())
+    # Localização das lojas (numérica) vinda do cache, em vez das CTEs sobre a user_attributes
+    store_locations_df = get_store_locations()
+    if store_locations_df is None:
+        print("ERRO: Não foi possível carregar a localização das lojas. Abortando a cidade.")
+        return
+    stuck_orders_df = stuck_orders_df.merge(store_locations_df, on='user_id', how='left')
+
+    if snapshot is None:
+        snapshot = CycleSnapshot.load()
+
+    online_providers_df = snapshot.online_providers()
     
     if offer_all_offline:
         print(f"INFO: {city_name} é uma cidade pequena. Buscando TODOS os entregadores offline da cidade.")
@@ -144,11 +197,15 @@ def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0)
         offline_providers_df['offer_priority'] = 2
 
     providers_df = pd.concat([online_providers_df, offline_providers_df], ignore_index=True)
+    if providers_df.empty:
+        print(f"INFO: Nenhum entregador encontrado para {city_name}.")
+        return
+    providers_df = attach_release_counts(providers_df)
+    providers_df = attach_provider_scores(providers_df)
     
     print("\nINFO: Verificando e removendo provedores que já estão em corridas ativas...")
-    busy_providers_df = read_data_from_db(query_providers_on_active_orders())
-    if busy_providers_df is not None and not busy_providers_df.empty:
-        busy_provider_ids = busy_providers_df['provider_id'].tolist()
+    busy_provider_ids = snapshot.busy_provider_ids
+    if busy_provider_ids:
         initial_count = len(providers_df)
         providers_df = providers_df[~providers_df['provider_id'].isin(busy_provider_ids)]
         print(f"INFO: {len(busy_provider_ids)} provedores em corrida removidos. {initial_count} -> {len(providers_df)} provedores restantes.")
@@ -156,9 +213,8 @@ def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0)
         print("INFO: Nenhum provedor em corrida ativa encontrado.")
 
     print("\nINFO: Buscando e removendo provedores fixos da lista de ofertas...")
-    fixed_providers_df = read_data_from_db(query_fixed_providers())
-    if fixed_providers_df is not None and not fixed_providers_df.empty:
-        fixed_provider_ids = fixed_providers_df['provider_id'].tolist()
+    fixed_provider_ids = snapshot.fixed_provider_ids
+    if fixed_provider_ids:
         initial_count = len(providers_df)
         providers_df = providers_df[~providers_df['provider_id'].isin(fixed_provider_ids)]
         print(f"INFO: {len(fixed_provider_ids)} provedores fixos removidos. {initial_count} -> {len(providers_df)} provedores restantes.")
@@ -166,9 +222,9 @@ def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0)
         print("INFO: Nenhum provedor fixo ativo encontrado.")
 
     print(f"\nINFO: Verificando provedores em cooldown (mais de {max_unanswered} ofertas ignoradas em {cooldown_hours}h)...")
-    cooldown_providers_df = read_log_data(query_providers_on_unanswered_cooldown(max_unanswered, cooldown_hours))
-    if cooldown_providers_df is not None and not cooldown_providers_df.empty:
-        cooldown_provider_ids = cooldown_providers_df['provider_id'].tolist()
+    candidate_provider_ids = providers_df['provider_id'].unique().tolist()
+    cooldown_provider_ids = get_cooldown_provider_ids(candidate_provider_ids, max_unanswered, cooldown_hours)
+    if cooldown_provider_ids:
         initial_count = len(providers_df)
         providers_df = providers_df[~providers_df['provider_id'].isin(cooldown_provider_ids)]
         print(f"INFO: {len(cooldown_provider_ids)} provedores em cooldown removidos. {initial_count} -> {len(providers_df)} provedores restantes.")
@@ -177,10 +233,9 @@ def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0)
 
     if FILTER_ONLY_ACTIVE_PROVIDERS:
         print("\nINFO: Filtro de provedores ativos está LIGADO.")
-        responsive_providers_df = read_log_data(query_responsive_providers())
+        active_provider_ids = get_responsive_provider_ids(providers_df['provider_id'].unique().tolist())
         
-        if responsive_providers_df is not None and not responsive_providers_df.empty:
-            active_provider_ids = responsive_providers_df['provider_id'].tolist()
+        if active_provider_ids:
             initial_provider_count = len(providers_df)
             providers_df = providers_df[providers_df['provider_id'].isin(active_provider_ids)]
             print(f"INFO: {initial_provider_count} provedores totais -> {len(providers_df)} provedores ativos encontrados e filtrados.")
@@ -190,13 +245,6 @@ def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0)
     else:
         print("\nINFO: Filtro de provedores ativos está DESLIGADO. Considerando todos os provedores elegíveis.")
 
-    blocked_pairs_df = read_data_from_db(query_blocked_pairs())
-    offers_sent_df = read_log_data(query_offers_sent())
-    
-    if offers_sent_df is None:
-        print("AVISO: A tabela 'sai_event_log' não foi encontrada. A assumir que nenhuma oferta foi enviada.")
-        offers_sent_df = pd.DataFrame(columns=['order_id', 'provider_id'])
-    
     if providers_df.empty:
         print(f"INFO: Nenhum entregador elegível para {city_name} após os filtros.")
         return
@@ -207,40 +255,28 @@ def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0)
     if print_dfs:
         print("\n" + "="*20 + " DEBUG: stuck_orders_df " + "="*20); print(stuck_orders_df.head())
         print("\n" + "="*20 + " DEBUG: providers_df (com prioridade) " + "="*20); print(providers_df.head())
-        print("\n" + "="*20 + " DEBUG: blocked_pairs_df " + "="*20); print(blocked_pairs_df.head())
+        print("\n" + "="*20 + " DEBUG: blocked_pairs_df " + "="*20); print(snapshot.blocked_pairs_df.head())
 
     stuck_orders_df.dropna(subset=['store_latitude', 'store_longitude'], inplace=True)
     providers_df.dropna(subset=['latitude', 'longitude'], inplace=True)
-    stuck_orders_df['store_latitude'] = pd.to_numeric(stuck_orders_df['store_latitude'])
-    stuck_orders_df['store_longitude'] = pd.to_numeric(stuck_orders_df['store_longitude'])
     providers_df['latitude'] = pd.to_numeric(providers_df['latitude'])
     providers_df['longitude'] = pd.to_numeric(providers_df['longitude'])
-    stuck_orders_df['key'] = 1
-    providers_df['key'] = 1
-    all_combinations_df = pd.merge(stuck_orders_df, providers_df, on='key').drop('key', axis=1)
+    nearby_pairs_df = find_nearby_pairs(stuck_orders_df, providers_df, offer_distance, distance_mode=DISTANCE_MODE)
+    print(f"INFO: {len(nearby_pairs_df)} pares corrida-entregador a até {offer_distance}km "
+          f"(de {len(stuck_orders_df) * len(providers_df)} combinações possíveis).")
     
-    merged_df = pd.merge(all_combinations_df, blocked_pairs_df, on=['user_id', 'provider_id'], how='left', indicator=True)
-    valid_combinations_df = merged_df[merged_df['_merge'] == 'left_only'].drop('_merge', axis=1).copy()
-
-    if not offers_sent_df.empty:
-        valid_combinations_df = pd.merge(
-            valid_combinations_df,
-            offers_sent_df,
-            on=['order_id', 'provider_id'],
-            how='left',
-            indicator=True
-        ).query('_merge == "left_only"').drop('_merge', axis=1)
+    # Ofertas já enviadas: só os pares das corridas travadas desta cidade
+    offers_already_sent = load_offers_already_sent(stuck_orders_df['order_id'].unique().tolist())
+    excluded_mask = (
+        snapshot.blocked_pairs.contains(nearby_pairs_df['user_id'], nearby_pairs_df['provider_id'])
+        | offers_already_sent.contains(nearby_pairs_df['order_id'], nearby_pairs_df['provider_id'])
+    )
+    valid_combinations_df = nearby_pairs_df[~excluded_mask]
     
     print(f"INFO: {len(valid_combinations_df)} combinações restantes após todos os filtros.")
     
     if not valid_combinations_df.empty:
-        def calculate_distance(row):
-            order_coords = (row['store_latitude'], row['store_longitude'])
-            provider_coords = (row['latitude'], row['longitude'])
-            return geodesic(order_coords, provider_coords).kilometers
-        
-        valid_combinations_df['distance_km'] = valid_combinations_df.apply(calculate_distance, axis=1)
-        nearby_providers_df = valid_combinations_df[valid_combinations_df['distance_km'] <= offer_distance].copy()
+        nearby_providers_df = valid_combinations_df.copy()
         
         nearby_providers_df.sort_values(
             by=['order_id', 'offer_priority', 'distance_km', 'total_releases_last_2_weeks', 'score'],
@@ -248,7 +284,9 @@ def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0)
             inplace=True
         )
         
-        best_matches_df = nearby_providers_df.groupby('order_id').head(max_offers).reset_index()
+        best_matches_df = select_best_matches(nearby_providers_df, max_offers, mode=ASSIGNMENT_MODE).reset_index()
+        print(f"INFO: Alocação '{ASSIGNMENT_MODE}': {len(best_matches_df)} ofertas cobrindo "
+              f"{best_matches_df['order_id'].nunique()} de {nearby_providers_df['order_id'].nunique()} corridas com candidatos.")
 
         if print_dfs:
             print("\n" + "="*20 + " DEBUG: best_matches_df (Final com Prioridade) " + "="*20); print(best_matches_df.head())
@@ -257,9 +295,9 @@ def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0)
             if limit > 0:
                 best_matches_df = best_matches_df.head(limit)
             
+            # Garante no máximo uma oferta por entregador nesta execução, antes do envio paralelo
             sent_providers_this_run = set()
-            
-            print(f"\nEncontrados {len(best_matches_df)} melhores provedores para {city_name}. A iniciar o fluxo de ofertas...")
+            offers_to_send = []
             for index, match in best_matches_df.iterrows():
                 match_data = match.to_dict()
                 provider_id = match_data.get('provider_id')
@@ -267,67 +305,81 @@ def process_city_offers(city_config, test_number=None, print_dfs=False, limit=0)
                 if provider_id in sent_providers_this_run:
                     print(f"INFO: Provedor {provider_id} já recebeu uma oferta nesta execução. Pulando para evitar spam.")
                     continue
+                sent_providers_this_run.add(provider_id)
+                offers_to_send.append(match_data)
+
+            print(f"\nEncontrados {len(offers_to_send)} melhores provedores para {city_name}. A iniciar o fluxo de ofertas...")
+            dispatch_offers(
+                offers_to_send,
+                lambda match_data: send_offer(match_data, test_number),
+                max_concurrency=OFFER_DISPATCH_CONCURRENCY
+            )
 
-                try:
-                    # --- INÍCIO DA CORREÇÃO: Montar um DICIONÁRIO com nomes de parâmetros ---
-                    param1_raw = match_data.get('param1_valor', 'R$ N/D')
-                    param2_raw = match_data.get('param2_endereco', 'Endereço: N/D')
-                    
-                    # Parâmetro 1: Valor da Corrida
-                    valor_corrida = param1_raw.split('R$ ')[-1].strip() if 'R$ ' in param1_raw else 'N/D'
-                    
-                    # Parâmetro 2: Endereço de Coleta
-                    endereco_coleta = param2_raw.split('Coleta: ')[-1].strip() if 'Coleta: ' in param2_raw else 'N/D'
-
-                    dist_to_store = match_data.get('distance_km', 0)
-                    eta_to_store = int((dist_to_store / AVG_SPEED_KMH) * 60)
-                    
-                    # Parâmetro 3: Distância até a Coleta
-                    distancia_ate_loja = f"~{dist_to_store:.1f} km"
-                    
-                    # Parâmetro 4: Tempo Estimado até a Coleta
-                    tempo_ate_loja = f"~{eta_to_store} min"
-
-                    template_params = [
-                        valor_corrida,
-                        endereco_coleta,
-                        distancia_ate_loja,
-                        tempo_ate_loja
-                    ]
-                    # --- FIM DA CORREÇÃO ---
-                    
-                    recipient_phone_number = test_number if test_number else match_data.get('mobile')
-                    
-                    if recipient_phone_number:
-                        dialog_response = run_offer_workflow(recipient_phone_number, match_data, template_params)
-                        print("-" * 50)
-                        
-                        sent_providers_this_run.add(provider_id)
-
-                        log_metadata = {
-                            "distance_to_store_km": dist_to_store,
-                            "provider_score": match_data.get('score'),
-                            "provider_releases": match_data.get('total_releases_last_2_weeks'),
-                            "offer_priority": match_data.get('offer_priority')
-                        }
-
-                        if dialog_response and dialog_response.get('result') == 'success':
-                            log_sai_event(
-                                order_id=match_data['order_id'],
-                                provider_id=match_data['provider_id'],
-                                event_type='OFFER_SENT',
-                                metadata=log_metadata
-                            )
-                        else:
-                            log_metadata['api_error_response'] = dialog_response
-                            log_sai_event(
-                                order_id=match_data['order_id'],
-                                provider_id=match_data['provider_id'],
-                                event_type='OFFER_DELIVERY_FAILURE',
-                                metadata=log_metadata
-                            )
-                except Exception as e:
-                    print(f"ERRO ao processar o match para a ordem {match_data.get('order_id')}: {e}")
+def send_offer(match_data, test_number=None):
+    """
+    Monta os parâmetros do template, executa o fluxo de oferta no Chatguru
+    e registra o resultado no log. Chamado em paralelo pelo dispatch_offers.
+    """
+    try:
+        # --- INÍCIO DA CORREÇÃO: Montar um DICIONÁRIO com nomes de parâmetros ---
+        param1_raw = match_data.get('param1_valor', 'R$ N/D')
+        param2_raw = match_data.get('param2_endereco', 'Endereço: N/D')
+        
+        # Parâmetro 1: Valor da Corrida
+        valor_corrida = param1_raw.split('R$ ')[-1].strip() if 'R$ ' in param1_raw else 'N/D'
+        
+        # Parâmetro 2: Endereço de Coleta
+        endereco_coleta = param2_raw.split('Coleta: ')[-1].strip() if 'Coleta: ' in param2_raw else 'N/D'
+
+        dist_to_store = match_data.get('distance_km', 0)
+        eta_to_store = int((dist_to_store / AVG_SPEED_KMH) * 60)
+        
+        # Parâmetro 3: Distância até a Coleta
+        distancia_ate_loja = f"~{dist_to_store:.1f} km"
+        
+        # Parâmetro 4: Tempo Estimado até a Coleta
+        tempo_ate_loja = f"~{eta_to_store} min"
+
+        template_params = [
+            valor_corrida,
+            endereco_coleta,
+            distancia_ate_loja,
+            tempo_ate_loja
+        ]
+        # --- FIM DA CORREÇÃO ---
+        
+        recipient_phone_number = test_number if test_number else match_data.get('mobile')
+        
+        if recipient_phone_number:
+            dialog_response = run_offer_workflow(recipient_phone_number, match_data, template_params)
+            print("-" * 50)
+
+            log_metadata = {
+                "distance_to_store_km": dist_to_store,
+                "provider_score": match_data.get('score'),
+                "provider_releases": match_data.get('total_releases_last_2_weeks'),
+                "offer_priority": match_data.get('offer_priority')
+            }
+
+            if dialog_response and dialog_response.get('result') == 'success':
+                log_sai_event(
+                    order_id=match_data['order_id'],
+                    provider_id=match_data['provider_id'],
+                    event_type='OFFER_SENT',
+                    metadata=log_metadata
+                )
+            else:
+                log_metadata['api_error_response'] = dialog_response
+                log_sai_event(
+                    order_id=match_data['order_id'],
+                    provider_id=match_data['provider_id'],
+                    event_type='OFFER_DELIVERY_FAILURE',
+                    metadata=log_metadata
+                )
+            return dialog_response
+    except Exception as e:
+        print(f"ERRO ao processar o match para a ordem {match_data.get('order_id')}: {e}")
+    return None
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Sistema de Assignação Inteligente (SAI) - Teste Local")
@@ -350,6 +402,8 @@ if __name__ == "__main__":
             print(f"ERRO: Nenhuma configuração encontrada para a cidade com ID {args.city_id}.")
         else:
             city_config = city_config_df.iloc[0].to_dict()
+            # Fora do worker ninguém atualiza o estado de ofertas (cooldown e filtro de ativos)
+            refresh_provider_offer_state()
             process_city_offers(
                 city_config=city_config,
                 test_number=args.numero_teste,
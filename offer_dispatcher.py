@@ -0,0 +1,35 @@
+# offer_dispatcher.py
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import monotonic
+
+# Número padrão de ofertas enviadas em paralelo (cada uma pode ficar até ~15s
+# esperando o registro do chat no Chatguru).
+DEFAULT_DISPATCH_CONCURRENCY = 10
+
+
+def dispatch_offers(offers, send_fn, max_concurrency=DEFAULT_DISPATCH_CONCURRENCY):
+    """
+    Envia uma lista de ofertas em paralelo, mantendo até `max_concurrency`
+    fluxos (registro do chat, polling de status, diálogo) em andamento ao mesmo tempo.
+    `send_fn(offer)` é chamado para cada item; exceções são capturadas por oferta.
+    Retorna uma lista de (offer, resultado, erro) na ordem em que terminaram.
+    """
+    if not offers:
+        return []
+
+    results = []
+    started_at = monotonic()
+    workers = max(1, min(max_concurrency, len(offers)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sai-offer") as executor:
+        futures = {executor.submit(send_fn, offer): offer for offer in offers}
+        for future in as_completed(futures):
+            offer = futures[future]
+            try:
+                results.append((offer, future.result(), None))
+            except Exception as e:
+                results.append((offer, None, e))
+
+    print(f"INFO: {len(offers)} ofertas processadas em {monotonic() - started_at:.1f}s "
+          f"com até {workers} envios simultâneos.")
+    return results
@@ -0,0 +1,45 @@
+# pair_exclusion.py
+
+import numpy as np
+
+
+def pack_pair_keys(left_ids, right_ids):
+    """
+    Empacota pares de IDs inteiros (ex: user_id/provider_id) numa única chave
+    int64: (left << 32) | right. Os IDs precisam caber em 32 bits.
+    """
+    left = np.asarray(left_ids, dtype=np.int64)
+    right = np.asarray(right_ids, dtype=np.int64)
+    return (left << 32) | (right & 0xFFFFFFFF)
+
+
+class PairExclusionSet:
+    """
+    Conjunto compacto de pares (left_id, right_id) a serem excluídos, guardado
+    como um array ordenado de chaves int64. A verificação de pertinência é
+    vetorizada (searchsorted) e não copia o DataFrame de candidatos.
+    """
+    def __init__(self, keys=None):
+        if keys is None:
+            keys = np.empty(0, dtype=np.int64)
+        self.keys = np.unique(np.asarray(keys, dtype=np.int64))
+
+    @classmethod
+    def from_frame(cls, df, left_column, right_column):
+        """Cria o conjunto a partir de duas colunas de um DataFrame (aceita None/vazio)."""
+        if df is None or df.empty:
+            return cls()
+        pairs = df[[left_column, right_column]].dropna()
+        return cls(pack_pair_keys(pairs[left_column].to_numpy(), pairs[right_column].to_numpy()))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def contains(self, left_ids, right_ids):
+        """Retorna uma máscara booleana indicando quais pares estão no conjunto."""
+        candidate_keys = pack_pair_keys(left_ids, right_ids)
+        if len(self.keys) == 0 or len(candidate_keys) == 0:
+            return np.zeros(len(candidate_keys), dtype=bool)
+        positions = np.searchsorted(self.keys, candidate_keys)
+        positions[positions == len(self.keys)] = 0
+        return self.keys[positions] == candidate_keys
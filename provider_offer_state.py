@@ -0,0 +1,129 @@
+# provider_offer_state.py
+
+import pandas as pd
+from log_db import read_log_data
+from query import query_offer_state_events, query_provider_offer_state, query_provider_events_since_last_response
+from data_cache import PROVIDER_OFFER_STATE
+from etl_state import WATERMARK_OVERLAP_IDS, get_watermark, save_watermark, dataframe_to_rows, upsert_rows
+
+STATE_TABLE_NAME = 'provider_offer_state'
+
+RESPONSE_EVENT_TYPES = ('PROVIDER_ACCEPTED', 'PROVIDER_REJECTED')
+
+# Eventos do log lidos por consulta (a primeira carga percorre o log em blocos)
+MAX_EVENTS_PER_REFRESH = 50000
+
+# Entregadores recalculados por consulta ao log
+PROVIDERS_PER_RECOMPUTE = 500
+
+# Contadores por entregador, mantidos a partir da sai_event_log
+STATE_TABLE_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {STATE_TABLE_NAME} (
+        provider_id INT PRIMARY KEY,
+        last_response_at TIMESTAMP NULL COMMENT 'Último aceite ou recusa',
+        last_offer_at TIMESTAMP NULL COMMENT 'Última oferta enviada',
+        unanswered_offers INT NOT NULL DEFAULT 0 COMMENT 'Ofertas enviadas depois da última resposta',
+        last_log_id INT NOT NULL COMMENT 'Maior log_id já contabilizado para o entregador (informativo)',
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        INDEX (last_offer_at)
+    );
+"""
+
+STATE_COLUMNS = ['provider_id', 'last_response_at', 'last_offer_at', 'unanswered_offers', 'last_log_id']
+
+
+def _fold_provider_events(state, events_df):
+    """
+    Recalcula o estado de um entregador a partir do estado gravado e dos seus
+    eventos desde a última resposta registrada. O resultado depende só do
+    conjunto de eventos (não da ordem dos log_id nem de quantas vezes um
+    evento é lido), então reler eventos já contabilizados não muda nada.
+    Ofertas só contam como não respondidas se forem posteriores à última resposta.
+    """
+    last_response_at = state['last_response_at'] if state is not None else pd.NaT
+    last_offer_at = state['last_offer_at'] if state is not None else pd.NaT
+    last_log_id = int(state['last_log_id']) if state is not None else 0
+
+    is_response = events_df['event_type'].isin(RESPONSE_EVENT_TYPES)
+    response_times = events_df.loc[is_response, 'event_timestamp']
+    offer_times = events_df.loc[~is_response, 'event_timestamp']
+
+    if not response_times.empty and (pd.isna(last_response_at) or response_times.max() > last_response_at):
+        last_response_at = response_times.max()
+    if not offer_times.empty and (pd.isna(last_offer_at) or offer_times.max() > last_offer_at):
+        last_offer_at = offer_times.max()
+    # Os eventos cobrem tudo desde a resposta gravada, logo também desde a nova
+    unanswered = int((offer_times > last_response_at).sum()) if not pd.isna(last_response_at) else len(offer_times)
+
+    return {
+        'provider_id': int(events_df['provider_id'].iloc[0]),
+        'last_response_at': last_response_at,
+        'last_offer_at': last_offer_at,
+        'unanswered_offers': unanswered,
+        'last_log_id': max(last_log_id, int(events_df['log_id'].max()))
+    }
+
+
+def refresh_provider_offer_state():
+    """
+    Atualiza a tabela 'provider_offer_state' para os entregadores com eventos
+    de oferta ou de resposta registrados desde a última execução (marca d'água
+    em log_id, relida a partir de marca d'água - WATERMARK_OVERLAP_IDS: eventos
+    gravados em lote por processos concorrentes podem ser confirmados fora de ordem).
+    Roda a cada ciclo do worker e no teste local do main.py: o custo depende só
+    dos eventos novos.
+    As tabelas são criadas pelo setup_database.py.
+    """
+    watermark = get_watermark(STATE_TABLE_NAME)
+    if watermark is None:
+        print("ERRO: Não foi possível ler a marca d'água do estado de ofertas dos entregadores.")
+        return False
+
+    since_log_id = max(0, watermark - WATERMARK_OVERLAP_IDS)
+    while True:
+        events_df = read_log_data(query_offer_state_events(since_log_id, MAX_EVENTS_PER_REFRESH))
+        if events_df is None:
+            print("ERRO: Falha ao ler os novos eventos para o estado de ofertas dos entregadores.")
+            return False
+        if events_df.empty:
+            return True
+
+        if not _recompute_providers(events_df['provider_id'].unique().tolist()):
+            return False
+        since_log_id = int(events_df['log_id'].max())
+        if since_log_id > watermark:
+            watermark = since_log_id
+            save_watermark(STATE_TABLE_NAME, watermark)
+
+        if len(events_df) < MAX_EVENTS_PER_REFRESH:
+            return True
+
+
+def _recompute_providers(provider_ids):
+    new_states = []
+    for start in range(0, len(provider_ids), PROVIDERS_PER_RECOMPUTE):
+        chunk_ids = provider_ids[start:start + PROVIDERS_PER_RECOMPUTE]
+        state_df = read_log_data(query_provider_offer_state(chunk_ids))
+        events_df = read_log_data(query_provider_events_since_last_response(chunk_ids))
+        if state_df is None or events_df is None:
+            print("ERRO: Falha ao ler o estado de ofertas atual ou os eventos dos entregadores.")
+            return False
+        current_state = {int(row['provider_id']): row for _, row in state_df.iterrows()}
+
+        events_df['event_timestamp'] = pd.to_datetime(events_df['event_timestamp'])
+        # Entregadores sem eventos aqui só têm respostas anteriores à gravada: nada muda
+        for provider_id, provider_events_df in events_df.groupby('provider_id', sort=False):
+            new_states.append(_fold_provider_events(current_state.get(int(provider_id)), provider_events_df))
+
+    if new_states:
+        new_state_df = pd.DataFrame(new_states, columns=STATE_COLUMNS)
+        for column in ['last_response_at', 'last_offer_at']:
+            new_state_df[column] = pd.to_datetime(new_state_df[column])
+        rows = dataframe_to_rows(new_state_df, STATE_COLUMNS)
+        if upsert_rows(STATE_TABLE_NAME, STATE_COLUMNS, rows, STATE_COLUMNS[1:]) is None:
+            print("ERRO: Falha ao gravar o estado de ofertas dos entregadores. A marca d'água não foi avançada.")
+            return False
+        PROVIDER_OFFER_STATE.invalidate()
+
+    print(f"INFO: Estado de ofertas recalculado para {len(new_states)} entregadores.")
+    return True
@@ -1,10 +1,20 @@
+import math
 from datetime import datetime
 
-def query_stuck_orders(city_id: int, stuck_threshold: int):
+# --- CONSTANTES GEOGRÁFICAS (BOUNDING BOX) ---
+KM_PER_LATITUDE_DEGREE = 110.574
+KM_PER_LONGITUDE_DEGREE_AT_EQUATOR = 111.320
+BOUNDING_BOX_MARGIN = 1.05  # Folga do retângulo: a distância Haversine (esfera) é o filtro exato
+# ---------------------------------------------
+
+def query_stuck_orders(city_id: int, stuck_threshold: int, include_store_location: bool = True):
     """
     Retorna uma query SQL que encontra as corridas travadas para uma
     cidade específica, usando um limite de tempo dinâmico.
     Nos domingos, inclui as corridas 'D+1'. Nos outros dias, as exclui.
+    Com `include_store_location=False`, não calcula a latitude/longitude da
+    loja (evita as agregações sobre a user_attributes); a localização vem
+    do cache de lojas (STORE_LOCATIONS).
     """
     # Lógica para o filtro D+1
     # datetime.weekday() retorna 6 para Domingo
@@ -15,8 +25,12 @@ def query_stuck_orders(city_id: int, stuck_threshold: int):
         # Se não for domingo, adiciona a cláusula para EXCLUIR as corridas D+1
         d1_filter_clause = "AND (ur.integration_service NOT LIKE '%d+1%' OR ur.integration_service IS NULL)"
 
-    return f"""
-        WITH
+    location_ctes = ""
+    location_columns = ""
+    location_joins = ""
+    location_select = ""
+    if include_store_location:
+        location_ctes = """
         base_latitude as (
             SELECT
                 ua.user_id,
@@ -34,15 +48,25 @@ def query_stuck_orders(city_id: int, stuck_threshold: int):
             INNER JOIN (SELECT user_id, MAX(id) as id FROM giross_producao.user_attributes WHERE attribute_id = 3 GROUP BY 1) ua1
                 ON ua.id = ua1.id
             WHERE ua.attribute_id = 3
-        ),
+        ),"""
+        location_columns = """
+                blat.latitude AS store_latitude,
+                blon.longitude AS store_longitude,"""
+        location_joins = """
+                LEFT JOIN base_latitude blat ON ur.user_id = blat.user_id
+                LEFT JOIN base_longitude blon ON ur.user_id = blon.user_id"""
+        location_select = """
+            store_latitude,
+            store_longitude,"""
+
+    return f"""
+        WITH{location_ctes}
         user_requests_ AS (
             SELECT
                 ur.id,
                 ur.user_id,
                 ur.provider_id,
-                c.id AS city_id,
-                blat.latitude AS store_latitude,
-                blon.longitude AS store_longitude,
+                c.id AS city_id,{location_columns}
                 ur.distance as store_to_delivery_distance,
                 
                 CONCAT('💰 Valor da Corrida: R$ ', FORMAT(
@@ -69,9 +93,7 @@ def query_stuck_orders(city_id: int, stuck_threshold: int):
                     AND ur.user_id = prl.value
                     AND ur.original_created_at BETWEEN prl.created_at AND COALESCE(prl.deleted_at, NOW())
                 LEFT JOIN giross_producao.cities c ON ur.city_id = c.id
-                LEFT JOIN giross_producao.users u ON ur.user_id = u.id
-                LEFT JOIN base_latitude blat ON ur.user_id = blat.user_id
-                LEFT JOIN base_longitude blon ON ur.user_id = blon.user_id
+                LEFT JOIN giross_producao.users u ON ur.user_id = u.id{location_joins}
             WHERE
                 CASE
                     WHEN ur.scheduled_cod IS NULL THEN TIMESTAMPDIFF(MINUTE, ur.original_created_at, NOW())
@@ -89,9 +111,7 @@ def query_stuck_orders(city_id: int, stuck_threshold: int):
         SELECT
             id AS order_id,
             user_id,
-            city_id,
-            store_latitude,
-            store_longitude,
+            city_id,{location_select}
             store_to_delivery_distance,
             param1_valor,
             param2_endereco
@@ -99,50 +119,94 @@ def query_stuck_orders(city_id: int, stuck_threshold: int):
             user_requests_;
     """
 
+def query_store_location_attributes(since_id: int = None):
+    """
+    Retorna uma query SQL que busca a latitude (attribute_id = 2) e a
+    longitude (attribute_id = 3) das lojas na user_attributes.
+    Sem `since_id`, traz apenas o registro mais recente de cada loja/atributo
+    (carga completa do cache); com `since_id`, traz só os registros novos.
+    """
+    if since_id is not None:
+        return f"""
+            SELECT id, user_id, attribute_id, value
+            FROM giross_producao.user_attributes
+            WHERE attribute_id IN (2, 3) AND id > {int(since_id)};
+        """
+
+    return """
+        SELECT
+            ua.id,
+            ua.user_id,
+            ua.attribute_id,
+            ua.value
+        FROM giross_producao.user_attributes ua
+        INNER JOIN (
+            SELECT user_id, attribute_id, MAX(id) AS id
+            FROM giross_producao.user_attributes
+            WHERE attribute_id IN (2, 3)
+            GROUP BY 1, 2
+        ) latest ON ua.id = latest.id;
+    """
+
 def query_available_providers():
+    """
+    Retorna uma query SQL que busca os entregadores online (serviço 'active').
+    A contagem de liberações dos últimos 14 dias e o score vêm dos caches
+    PROVIDER_RELEASES e PROVIDER_SCORES e são juntados em memória
+    (ver attach_release_counts e attach_provider_scores).
+    """
     return f"""
-        WITH
-        provider_releases AS (
-            SELECT
-                provider_id,
-                COUNT(id) AS total_releases
-            FROM
-                giross_producao.provider_cancelled_user_requests
-            GROUP BY
-                1
-        )
         SELECT
             p.id AS provider_id,
             CONCAT(p.first_name, ' ', p.last_name) AS provider_name,
             p.mobile,
             ps.status AS online_status,
             p.latitude,
-            p.longitude,
-            score.score,
-            COALESCE(pr.total_releases, 0) AS total_releases_last_2_weeks
+            p.longitude
         FROM
             giross_producao.providers p
-            INNER JOIN giross_producao.provider_services ps ON p.id = ps.provider_id AND ps.status IN ('active')
-            LEFT JOIN giross_producao.provider_scores score ON p.id = score.provider_id
-            LEFT JOIN provider_releases pr ON p.id = pr.provider_id
-        ORDER BY
-            total_releases_last_2_weeks ASC,
-            score DESC;
+            INNER JOIN giross_producao.provider_services ps ON p.id = ps.provider_id AND ps.status IN ('active');
+    """
+
+def query_provider_release_counts(days: int = 14):
+    """
+    Retorna uma query SQL que conta as liberações (corridas canceladas pelo
+    entregador) de cada entregador nos últimos `days` dias.
+    """
+    return f"""
+        SELECT
+            provider_id,
+            COUNT(id) AS total_releases
+        FROM
+            giross_producao.provider_cancelled_user_requests
+        WHERE
+            created_at >= NOW() - INTERVAL {int(days)} DAY
+        GROUP BY
+            1;
     """
 
-def query_blocked_pairs():
+def query_blocked_pairs(since_id: int = None):
     """
     Retorna uma query SQL que busca todos os pares de user_id e provider_id
     que estão na tabela de bloqueios.
+    Com `since_id`, retorna apenas os bloqueios criados depois desse id
+    (carga incremental do cache).
     """
-    return "SELECT user_id, provider_id FROM giross_producao.user_provider_blocks"
+    where_clause = f"WHERE id > {int(since_id)}" if since_id is not None else ""
+    return f"SELECT id, user_id, provider_id FROM giross_producao.user_provider_blocks {where_clause}"
 
-def query_offers_sent():
+def query_offers_sent_for_orders(order_ids: list):
     """
-    Retorna uma query SQL que busca todos os pares de order_id e provider_id
-    para os quais uma oferta já foi enviada, a partir da tabela de logs.
+    Retorna uma query SQL que busca os pares de order_id e provider_id para os
+    quais uma oferta já foi enviada, restrita às corridas informadas (as
+    travadas no momento). Usa o índice (event_type, order_id, provider_id).
     """
-    return """
+    if not order_ids:
+        return "SELECT order_id, provider_id FROM desenvolvimento_bi.sai_event_log WHERE 1=0;"
+
+    order_ids_str = f"({', '.join(map(str, order_ids))})"
+
+    return f"""
         SELECT DISTINCT
             order_id,
             provider_id
@@ -150,28 +214,38 @@ def query_offers_sent():
             desenvolvimento_bi.sai_event_log
         WHERE
             event_type = 'OFFER_SENT'
+            AND order_id IN {order_ids_str}
     """
 
-def query_responsive_providers():
+def query_provider_scores():
     """
-    Retorna uma query SQL que busca todos os provider_id's únicos que já
-    responderam (aceitaram ou rejeitaram) a uma oferta.
+    Retorna uma query SQL que busca o score de cada entregador.
     """
     return """
-        SELECT DISTINCT provider_id
-        FROM desenvolvimento_bi.sai_event_log
-        WHERE event_type IN ('PROVIDER_ACCEPTED', 'PROVIDER_REJECTED');
+        SELECT provider_id, score
+        FROM giross_producao.provider_scores;
     """
 
-def query_fixed_providers():
+def query_fixed_providers(since_id: int = None, changed_in_last_seconds: int = None):
     """
-    Retorna uma query SQL que busca os IDs de todos os provedores
+    Retorna uma query SQL que busca os vínculos de todos os provedores
     que são 'fixos' e não foram desvinculados (deleted_at IS NULL).
-    """
-    return """
-        SELECT DISTINCT provider_id
+    Com `since_id`/`changed_in_last_seconds`, retorna apenas os vínculos novos
+    ou desvinculados recentemente, incluindo `deleted_at` (carga incremental do cache).
+    """
+    if since_id is None:
+        return """
+            SELECT id, provider_id, deleted_at
+            FROM giross_producao.provider_fixeds
+            WHERE deleted_at IS NULL;
+        """
+
+    return f"""
+        SELECT id, provider_id, deleted_at
         FROM giross_producao.provider_fixeds
-        WHERE deleted_at IS NULL;
+        WHERE
+            id > {int(since_id)}
+            OR deleted_at >= NOW() - INTERVAL {int(changed_in_last_seconds or 0)} SECOND;
     """
 
 def query_offline_providers_with_history(user_ids: list):
@@ -195,17 +269,6 @@ def query_offline_providers_with_history(user_ids: list):
                 AND ur.status = 'COMPLETED'
                 AND ur.original_created_at >= NOW() - INTERVAL 31 DAY
                 AND ur.provider_id IS NOT NULL AND ur.provider_id > 0
-        ),
-        provider_releases AS (
-            SELECT
-                provider_id,
-                COUNT(id) AS total_releases
-            FROM
-                giross_producao.provider_cancelled_user_requests
-            WHERE
-                created_at >= NOW() - INTERVAL 14 DAY
-            GROUP BY
-                1
         )
         SELECT
             p.id AS provider_id,
@@ -213,45 +276,75 @@ def query_offline_providers_with_history(user_ids: list):
             p.mobile,
             ps.status AS online_status,
             p.latitude,
-            p.longitude,
-            score.score,
-            COALESCE(pr.total_releases, 0) AS total_releases_last_2_weeks
+            p.longitude
         FROM
             giross_producao.providers p
             INNER JOIN providers_with_history ph ON p.id = ph.provider_id
             INNER JOIN giross_producao.provider_services ps ON p.id = ps.provider_id
-            LEFT JOIN giross_producao.provider_scores score ON p.id = score.provider_id
-            LEFT JOIN provider_releases pr ON p.id = pr.provider_id
         WHERE
-            ps.status IN ('inactive', 'offline')
-        ORDER BY
-            score DESC;
+            ps.status IN ('inactive', 'offline');
     """
 
 def query_order_status(order_id: int):
     """
-    Retorna uma query SQL para verificar o provider_id atual de uma corrida.
+    Retorna uma query SQL para verificar o provider_id e o status atuais de uma corrida.
     """
     return f"""
-        SELECT provider_id 
+        SELECT provider_id, status
         FROM giross_producao.user_requests 
         WHERE id = {order_id};
     """
 
-def query_accepted_offers_log():
+def query_accepted_offers_log(since_log_id: int = None):
     """
-    Retorna uma query que busca todos os eventos de 'PROVIDER_ACCEPTED' do log,
-    incluindo o order_id, provider_id e o timestamp do aceite.
+    Retorna uma query que busca os eventos de 'PROVIDER_ACCEPTED' do log,
+    incluindo o log_id, order_id, provider_id e o timestamp do aceite.
+    Com `since_log_id`, busca apenas os eventos com log_id maior (carga incremental).
     """
-    return """
+    since_filter = f"AND log_id > {int(since_log_id)}" if since_log_id is not None else ""
+    return f"""
         SELECT
+            log_id,
             order_id,
             provider_id,
             event_timestamp AS accepted_at
         FROM
             desenvolvimento_bi.sai_event_log
         WHERE
-            event_type = 'PROVIDER_ACCEPTED';
+            event_type = 'PROVIDER_ACCEPTED'
+            {since_filter}
+        ORDER BY
+            log_id;
+    """
+
+def query_open_orders_in_analytics(table_name: str, terminal_statuses: tuple):
+    """
+    Retorna uma query que lista os order_ids de uma tabela de análise cujo
+    status final ainda pode mudar (não terminal ou ainda sem detalhes).
+    """
+    statuses_str = ", ".join(f"'{status}'" for status in terminal_statuses)
+    return f"""
+        SELECT DISTINCT
+            order_id
+        FROM
+            desenvolvimento_bi.{table_name}
+        WHERE
+            final_status IS NULL
+            OR final_status NOT IN ({statuses_str});
+    """
+
+def query_etl_watermark(etl_name: str):
+    """
+    Retorna uma query que busca a marca d'água (último log_id processado)
+    de um ETL incremental.
+    """
+    return f"""
+        SELECT
+            last_log_id
+        FROM
+            desenvolvimento_bi.sai_etl_watermarks
+        WHERE
+            etl_name = '{etl_name}';
     """
 
 def query_order_details_by_ids(order_ids: list):
@@ -278,20 +371,26 @@ def query_order_details_by_ids(order_ids: list):
         WHERE
             ur.id IN {order_ids_str};
     """
-def query_sent_offers_log():
+def query_sent_offers_log(since_log_id: int = None):
     """
-    Retorna uma query que busca todos os eventos de 'OFFER_SENT' do log,
-    incluindo o order_id, provider_id e o timestamp do envio.
+    Retorna uma query que busca os eventos de 'OFFER_SENT' do log,
+    incluindo o log_id, order_id, provider_id e o timestamp do envio.
+    Com `since_log_id`, busca apenas os eventos com log_id maior (carga incremental).
     """
-    return """
+    since_filter = f"AND log_id > {int(since_log_id)}" if since_log_id is not None else ""
+    return f"""
         SELECT
+            log_id,
             order_id,
             provider_id,
             event_timestamp AS sent_at
         FROM
             desenvolvimento_bi.sai_event_log
         WHERE
-            event_type = 'OFFER_SENT';
+            event_type = 'OFFER_SENT'
+            {since_filter}
+        ORDER BY
+            log_id;
     """
 
 def query_sai_city_configs():
@@ -320,45 +419,89 @@ def query_sai_city_configs():
             is_active = TRUE;
     """
 
-def query_providers_on_unanswered_cooldown(max_unanswered: int, cooldown_hours: int):
+def query_provider_offer_state_snapshot():
     """
-    Retorna uma query que busca provedores que ignoraram mais ofertas
-    consecutivas do que o permitido (`max_unanswered`).
+    Retorna uma query que busca a 'provider_offer_state' inteira (uma linha por
+    entregador), com o horário do banco para os filtros de cooldown em memória.
+    """
+    return """
+        SELECT
+            provider_id,
+            last_response_at,
+            last_offer_at,
+            unanswered_offers,
+            NOW() AS db_now
+        FROM
+            desenvolvimento_bi.provider_offer_state;
+    """
+
+def query_offer_state_events(since_log_id: int, limit: int):
+    """
+    Retorna uma query que busca os eventos de oferta e de resposta com log_id
+    acima de `since_log_id`; indicam quais entregadores precisam ter o estado
+    da 'provider_offer_state' recalculado.
     """
     return f"""
-        WITH last_response AS (
-            SELECT
-                provider_id,
-                MAX(event_timestamp) AS last_response_time
-            FROM
-                desenvolvimento_bi.sai_event_log
-            WHERE
-                event_type IN ('PROVIDER_ACCEPTED', 'PROVIDER_REJECTED')
-            GROUP BY
-                provider_id
-        ),
-        unanswered_offers AS (
-            SELECT
-                log.provider_id,
-                COUNT(log.log_id) AS unanswered_count,
-                MAX(log.event_timestamp) as last_offer_sent_time
-            FROM
-                desenvolvimento_bi.sai_event_log log
-            LEFT JOIN
-                last_response lr ON log.provider_id = lr.provider_id
-            WHERE
-                log.event_type = 'OFFER_SENT'
-                AND (log.event_timestamp > lr.last_response_time OR lr.last_response_time IS NULL)
-            GROUP BY
-                log.provider_id
-        )
         SELECT
-            provider_id
+            log_id,
+            provider_id,
+            event_type,
+            event_timestamp
+        FROM
+            desenvolvimento_bi.sai_event_log
+        WHERE
+            log_id > {int(since_log_id)}
+            AND event_type IN ('OFFER_SENT', 'PROVIDER_ACCEPTED', 'PROVIDER_REJECTED')
+        ORDER BY
+            log_id
+        LIMIT {int(limit)};
+    """
+
+def query_provider_events_since_last_response(provider_ids: list):
+    """
+    Retorna uma query que busca, para os entregadores informados, todos os
+    eventos de oferta e de resposta a partir da última resposta já registrada
+    na 'provider_offer_state' (todo o histórico, se o entregador nunca respondeu).
+    É a base para recalcular o estado sem depender da ordem dos log_id.
+    """
+    provider_ids_str = f"({', '.join(map(str, provider_ids))})"
+
+    return f"""
+        SELECT
+            e.log_id,
+            e.provider_id,
+            e.event_type,
+            e.event_timestamp
+        FROM
+            desenvolvimento_bi.sai_event_log e
+        LEFT JOIN
+            desenvolvimento_bi.provider_offer_state s ON s.provider_id = e.provider_id
+        WHERE
+            e.provider_id IN {provider_ids_str}
+            AND e.event_type IN ('OFFER_SENT', 'PROVIDER_ACCEPTED', 'PROVIDER_REJECTED')
+            AND (s.last_response_at IS NULL OR e.event_timestamp >= s.last_response_at);
+    """
+
+def query_provider_offer_state(provider_ids: list):
+    """
+    Retorna uma query que busca o estado de ofertas atual dos entregadores informados.
+    """
+    if not provider_ids:
+        return "SELECT * FROM desenvolvimento_bi.provider_offer_state WHERE 1=0;"
+
+    provider_ids_str = f"({', '.join(map(str, provider_ids))})"
+
+    return f"""
+        SELECT
+            provider_id,
+            last_response_at,
+            last_offer_at,
+            unanswered_offers,
+            last_log_id
         FROM
-            unanswered_offers
+            desenvolvimento_bi.provider_offer_state
         WHERE
-            unanswered_count >= {max_unanswered}
-            AND last_offer_sent_time >= NOW() - INTERVAL {cooldown_hours} HOUR;
+            provider_id IN {provider_ids_str};
     """
 
 def query_providers_on_active_orders():
@@ -382,69 +525,45 @@ def query_offline_providers_by_city(city_id: int):
     de uma cidade específica.
     """
     return f"""
-        WITH provider_releases AS (
-            SELECT
-                provider_id,
-                COUNT(id) AS total_releases
-            FROM
-                giross_producao.provider_cancelled_user_requests
-            WHERE
-                created_at >= NOW() - INTERVAL 14 DAY
-            GROUP BY 1
-        )
         SELECT
             p.id AS provider_id,
             CONCAT(p.first_name, ' ', p.last_name) AS provider_name,
             p.mobile,
             ps.status AS online_status,
             p.latitude,
-            p.longitude,
-            score.score,
-            COALESCE(pr.total_releases, 0) AS total_releases_last_2_weeks
+            p.longitude
         FROM
             giross_producao.providers p
             INNER JOIN giross_producao.provider_services ps ON p.id = ps.provider_id
-            LEFT JOIN giross_producao.provider_scores score ON p.id = score.provider_id
-            LEFT JOIN provider_releases pr ON p.id = pr.provider_id
         WHERE
             p.city_id = {city_id}
             AND ps.status IN ('inactive', 'offline');
     """
 
-def query_unanswered_offers_to_log():
+def query_insert_unanswered_offers():
     """
-    Retorna uma query que identifica pares (order_id, provider_id) de ofertas
-    enviadas que não foram respondidas e para as quais ainda não foi gerado
-    um log de 'UNANSWERED_OFFER'.
+    Retorna um comando INSERT ... SELECT que grava, de uma só vez, um evento
+    'UNANSWERED_OFFER' para cada par (order_id, provider_id) de oferta enviada
+    que não foi respondida e que ainda não tem esse log.
     """
     return """
-        WITH sent_pairs AS (
+        INSERT INTO desenvolvimento_bi.sai_event_log (order_id, provider_id, event_type)
+        SELECT
+            s.order_id,
+            s.provider_id,
+            'UNANSWERED_OFFER'
+        FROM (
             SELECT DISTINCT order_id, provider_id
             FROM desenvolvimento_bi.sai_event_log
             WHERE event_type = 'OFFER_SENT'
-        ),
-        responded_pairs AS (
+        ) s
+        LEFT JOIN (
             SELECT DISTINCT order_id, provider_id
             FROM desenvolvimento_bi.sai_event_log
-            WHERE event_type IN ('PROVIDER_ACCEPTED', 'PROVIDER_REJECTED')
-        ),
-        already_logged_unanswered AS (
-            SELECT DISTINCT order_id, provider_id
-            FROM desenvolvimento_bi.sai_event_log
-            WHERE event_type = 'UNANSWERED_OFFER'
-        )
-        SELECT
-            s.order_id,
-            s.provider_id
-        FROM
-            sent_pairs s
-        LEFT JOIN
-            responded_pairs r ON s.order_id = r.order_id AND s.provider_id = r.provider_id
-        LEFT JOIN
-            already_logged_unanswered alu ON s.order_id = alu.order_id AND s.provider_id = alu.provider_id
+            WHERE event_type IN ('PROVIDER_ACCEPTED', 'PROVIDER_REJECTED', 'UNANSWERED_OFFER')
+        ) closed ON s.order_id = closed.order_id AND s.provider_id = closed.provider_id
         WHERE
-            r.provider_id IS NULL
-            AND alu.provider_id IS NULL;
+            closed.provider_id IS NULL
     """
 
 def query_sai_costs_daily():
@@ -539,51 +658,30 @@ def query_provider_by_phone(phone_number: str):
             p.mobile = '{phone_number}';
     """
 
-def query_best_stuck_order_for_provider(provider_id: int, provider_lat: float, provider_lon: float):
+def query_stuck_orders_for_passive_index():
     """
-    Retorna uma query que encontra a melhor corrida travada para um provedor específico,
-    baseado na distância e nas regras de negócio.
+    Retorna uma query que busca todas as corridas travadas das cidades ativas
+    (respeitando o tempo de cada cidade), com as coordenadas da loja e o raio
+    de oferta da cidade. Alimenta o índice em memória do modo passivo e usa
+    exatamente os mesmos filtros de query_best_stuck_order_for_provider.
     """
-    return f"""
-        WITH
-        -- 1. Encontra todas as corridas travadas em cidades ativas, respeitando o tempo de cada uma
-        stuck_orders_in_active_cities AS (
-            SELECT
-                ur.id AS order_id,
-                ur.user_id,
-                ur.s_latitude AS store_latitude,
-                ur.s_longitude AS store_longitude
-            FROM
-                giross_producao.user_requests ur
-            JOIN
-                desenvolvimento_bi.sai_city_configs scc ON ur.city_id = scc.city_id
-            WHERE
-                ur.status = 'SEARCHING'
-                AND scc.is_active = TRUE
-                AND CASE
-                    WHEN ur.scheduled_cod IS NULL THEN TIMESTAMPDIFF(MINUTE, ur.original_created_at, NOW())
-                    ELSE TIMESTAMPDIFF(MINUTE, ur.started_at, NOW())
-                END >= scc.stuck_order_threshold_minutes
-        )
-        -- 2. Calcula a distância e aplica os filtros
+    return """
         SELECT
-            so.order_id,
-            so.user_id,
-            -- Fórmula Haversine para calcular a distância em KM
-            (6371 * ACOS(
-                COS(RADIANS({provider_lat})) * COS(RADIANS(so.store_latitude)) *
-                COS(RADIANS(so.store_longitude) - RADIANS({provider_lon})) +
-                SIN(RADIANS({provider_lat})) * SIN(RADIANS(so.store_latitude))
-            )) AS distance_km
+            ur.id AS order_id,
+            ur.user_id,
+            ur.city_id,
+            ur.s_latitude AS store_latitude,
+            ur.s_longitude AS store_longitude,
+            scc.offer_distance_km
         FROM
-            stuck_orders_in_active_cities so
-        LEFT JOIN
-            giross_producao.user_provider_blocks upb ON so.user_id = upb.user_id AND upb.provider_id = {provider_id}
+            desenvolvimento_bi.sai_city_configs scc
+        JOIN
+            giross_producao.user_requests ur ON ur.city_id = scc.city_id
         WHERE
-            upb.provider_id IS NULL -- Garante que o provedor não está bloqueado pela loja
-        ORDER BY
-            distance_km ASC -- Ordena pela menor distância
-        LIMIT 1; -- Retorna apenas a melhor opção
+            scc.is_active = TRUE
+            AND ur.status = 'SEARCHING'
+            AND ur.provider_id IN (0, 1266)
+            AND TIMESTAMPDIFF(MINUTE, ur.original_created_at, NOW()) >= scc.stuck_order_threshold_minutes;
     """
 
 def query_provider_by_id(provider_id: int):
@@ -615,53 +713,66 @@ def query_best_stuck_order_for_provider(provider_id: int, provider_lat: float, p
     """
     Encontra a melhor corrida travada para um entregador específico, aplicando todas as
     regras de negócio e ordenando pela distância.
-    """
+    Um retângulo (bounding box) em volta do entregador, do tamanho do raio de oferta
+    de cada cidade, descarta as corridas distantes pelas coordenadas da loja antes de
+    qualquer trigonometria; a distância é calculada uma única vez por corrida.
+    """
+    provider_lat = float(provider_lat)
+    provider_lon = float(provider_lon)
+    # KM por grau de latitude/longitude na latitude do entregador, com a folga do retângulo
+    km_per_lat_degree = KM_PER_LATITUDE_DEGREE / BOUNDING_BOX_MARGIN
+    km_per_lon_degree = (KM_PER_LONGITUDE_DEGREE_AT_EQUATOR / BOUNDING_BOX_MARGIN
+                         * max(math.cos(math.radians(provider_lat)), 0.01))
     return f"""
-        WITH active_configs AS (
-            -- Busca todas as configurações ativas para saber os critérios de cada cidade
-            SELECT city_id, stuck_order_threshold_minutes, offer_distance_km
-            FROM desenvolvimento_bi.sai_city_configs
-            WHERE is_active = TRUE
-        ),
-        stuck_orders AS (
-            -- Encontra todas as corridas travadas em todas as cidades ativas
-            SELECT 
+        SELECT
+            s.order_id,
+            s.distance_km
+        FROM (
+            -- Corridas travadas das cidades ativas dentro do retângulo do raio de oferta da cidade
+            SELECT
                 ur.id AS order_id,
                 ur.user_id,
-                ur.s_latitude,
-                ur.s_longitude,
-                ac.offer_distance_km
+                scc.offer_distance_km,
+                (6371 * ACOS(
+                    COS(RADIANS({provider_lat})) * COS(RADIANS(ur.s_latitude)) *
+                    COS(RADIANS(ur.s_longitude) - RADIANS({provider_lon})) +
+                    SIN(RADIANS({provider_lat})) * SIN(RADIANS(ur.s_latitude))
+                )) AS distance_km
             FROM
-                giross_producao.user_requests ur
-            JOIN 
-                active_configs ac ON ur.city_id = ac.city_id
+                desenvolvimento_bi.sai_city_configs scc
+            JOIN
+                giross_producao.user_requests ur ON ur.city_id = scc.city_id
             WHERE
-                ur.status = 'SEARCHING'
+                scc.is_active = TRUE
+                AND ur.status = 'SEARCHING'
                 AND ur.provider_id IN (0, 1266)
-                AND TIMESTAMPDIFF(MINUTE, ur.original_created_at, NOW()) >= ac.stuck_order_threshold_minutes
-        )
-        -- Seleciona e ranqueia as corridas elegíveis
-        SELECT
-            s.order_id,
-            (6371 * ACOS(
-                COS(RADIANS({provider_lat})) * COS(RADIANS(s.s_latitude)) *
-                COS(RADIANS(s.s_longitude) - RADIANS({provider_lon})) +
-                SIN(RADIANS({provider_lat})) * SIN(RADIANS(s.s_latitude))
-            )) AS distance_km
-        FROM
-            stuck_orders s
+                AND TIMESTAMPDIFF(MINUTE, ur.original_created_at, NOW()) >= scc.stuck_order_threshold_minutes
+                AND ur.s_latitude BETWEEN {provider_lat} - scc.offer_distance_km / {km_per_lat_degree:.6f}
+                                      AND {provider_lat} + scc.offer_distance_km / {km_per_lat_degree:.6f}
+                AND ur.s_longitude BETWEEN {provider_lon} - scc.offer_distance_km / {km_per_lon_degree:.6f}
+                                       AND {provider_lon} + scc.offer_distance_km / {km_per_lon_degree:.6f}
+        ) s
         -- Filtro para remover corridas onde o entregador está bloqueado pela loja
-        LEFT JOIN 
+        LEFT JOIN
             giross_producao.user_provider_blocks b ON s.user_id = b.user_id AND b.provider_id = {provider_id}
         WHERE
             b.provider_id IS NULL -- Garante que não há bloqueio
             -- Garante que a distância calculada está dentro do limite daquela cidade específica
-            AND (6371 * ACOS(
-                COS(RADIANS({provider_lat})) * COS(RADIANS(s.s_latitude)) *
-                COS(RADIANS(s.s_longitude) - RADIANS({provider_lon})) +
-                SIN(RADIANS({provider_lat})) * SIN(RADIANS(s.s_latitude))
-            )) <= s.offer_distance_km
+            AND s.distance_km <= s.offer_distance_km
         ORDER BY
-            distance_km ASC
+            s.distance_km ASC
         LIMIT 1;
-    """
\ No newline at end of file
+    """
+
+def query_registered_chat(phone_number: str):
+    """
+    Retorna uma query que busca no cache de registros do Chatguru o número de
+    chat confirmado para um telefone, se o registro ainda não expirou.
+    """
+    return f"""
+        SELECT chat_number, registration_status
+        FROM desenvolvimento_bi.sai_chat_registry
+        WHERE
+            phone_number = '{phone_number}'
+            AND expires_at > NOW();
+    """
@@ -2,7 +2,39 @@
 
 import os
 import pymysql
+from datetime import datetime
 from dotenv import load_dotenv
+from etl_state import WATERMARKS_TABLE_DDL
+from analytics_etl import ANALYTICS_TABLE_NAME, ANALYTICS_TABLE_DDL
+import create_sent_offers_analytics as sent_offers_analytics
+from provider_offer_state import STATE_TABLE_NAME, STATE_TABLE_DDL
+from webhook_dedupe import DELIVERIES_TABLE_DDL
+
+def migrate_analytics_table(cursor, table_name, create_table_ddl):
+    """
+    Cria a tabela de análise de um ETL incremental. Se ela ainda existe no
+    schema antigo (criada pelo pandas, sem a chave 'log_id'), é renomeada para
+    '<tabela>_legacy_<data>' (os dados antigos são preservados), a tabela nova
+    é criada e a marca d'água do ETL é zerada para a carga completa.
+    """
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = %s
+    """, (table_name,))
+    table_exists = cursor.fetchone()[0] > 0
+    if table_exists:
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = 'log_id'
+        """, (table_name,))
+        if cursor.fetchone()[0] == 0:
+            legacy_name = f"{table_name}_legacy_{datetime.now().strftime('%Y%m%d')}"
+            print(f"INFO: A tabela '{table_name}' está no schema antigo. A renomeá-la para '{legacy_name}'...")
+            cursor.execute(f"RENAME TABLE {table_name} TO {legacy_name}")
+            cursor.execute("DELETE FROM sai_etl_watermarks WHERE etl_name = %s", (table_name,))
+
+    print(f"INFO: A executar o comando para criar a tabela '{table_name}'...")
+    cursor.execute(create_table_ddl)
 
 def setup_analytics_tables():
     """
@@ -43,16 +75,63 @@ def setup_analytics_tables():
             event_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             metadata JSON COMMENT 'Para guardar dados extras, como distância, score, etc.',
             INDEX (order_id),
-            INDEX (event_type)
+            INDEX (event_type),
+            INDEX idx_event_order_provider (event_type, order_id, provider_id),
+            INDEX idx_event_provider_time (provider_id, event_timestamp)
         );
         """
         
         print("INFO: A executar o comando para criar a tabela 'sai_event_log'...")
         cursor.execute(create_log_table_query)
         db_connection.commit()
+
+        # Índices compostos usados na busca das ofertas já enviadas para as corridas
+        # travadas e no recálculo do estado de ofertas por entregador; são criados
+        # também em tabelas que já existiam antes deles.
+        event_log_indexes = {
+            'idx_event_order_provider': '(event_type, order_id, provider_id)',
+            'idx_event_provider_time': '(provider_id, event_timestamp)',
+        }
+        for index_name, index_columns in event_log_indexes.items():
+            cursor.execute("""
+                SELECT COUNT(*) FROM information_schema.statistics
+                WHERE table_schema = DATABASE() AND table_name = 'sai_event_log'
+                  AND index_name = %s
+            """, (index_name,))
+            if cursor.fetchone()[0] == 0:
+                print(f"INFO: A criar o índice '{index_name}' na tabela 'sai_event_log'...")
+                cursor.execute(f"ALTER TABLE sai_event_log ADD INDEX {index_name} {index_columns}")
+                db_connection.commit()
+
+        # --- Definição da Tabela de Cache de Registros do Chatguru ---
+        create_chat_registry_table_query = """
+        CREATE TABLE IF NOT EXISTS sai_chat_registry (
+            phone_number VARCHAR(20) PRIMARY KEY COMMENT 'Telefone do entregador, já formatado (E.164)',
+            chat_number VARCHAR(20) NOT NULL COMMENT 'Número confirmado no Chatguru (pode ser o corrigido)',
+            registration_status VARCHAR(20) NOT NULL COMMENT 'Status retornado pelo chat_add_status',
+            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            INDEX (expires_at)
+        );
+        """
+
+        print("INFO: A executar o comando para criar a tabela 'sai_chat_registry'...")
+        cursor.execute(create_chat_registry_table_query)
+        db_connection.commit()
         
+        # --- Tabelas dos ETLs incrementais (marca d'água e tabelas de análise) ---
+        print("INFO: A executar o comando para criar a tabela 'sai_etl_watermarks'...")
+        cursor.execute(WATERMARKS_TABLE_DDL)
+        migrate_analytics_table(cursor, ANALYTICS_TABLE_NAME, ANALYTICS_TABLE_DDL)
+        migrate_analytics_table(cursor, sent_offers_analytics.ANALYTICS_TABLE_NAME, sent_offers_analytics.ANALYTICS_TABLE_DDL)
+        print(f"INFO: A executar o comando para criar a tabela '{STATE_TABLE_NAME}'...")
+        cursor.execute(STATE_TABLE_DDL)
+        print("INFO: A executar o comando para criar a tabela 'sai_webhook_deliveries'...")
+        cursor.execute(DELIVERIES_TABLE_DDL)
+        db_connection.commit()
+
         print("\n==========================================================")
-        print("SUCESSO: Tabela 'sai_event_log' pronta para uso!")
+        print("SUCESSO: Tabelas do SAI prontas para uso!")
         print("==========================================================")
 
     except pymysql.Error as err:
@@ -0,0 +1,123 @@
+# spatial_index.py
+
+import math
+import numpy as np
+import pandas as pd
+from geo_distance import calculate_distances_km, DISTANCE_MODE_ELLIPSOIDAL
+
+# Comprimento mínimo de 1 grau de latitude (nos polos é ~110,57 km). Usado para
+# que a caixa de busca nunca seja menor do que o raio pedido.
+KM_PER_DEGREE_LAT_MIN = 110.574
+KM_PER_DEGREE_LON_EQUATOR = 111.320
+# Folga aplicada à caixa de busca antes do filtro exato de distância
+BBOX_PADDING = 1.01
+
+
+def _degree_deltas(radius_km, max_abs_lat):
+    """
+    Converte um raio em km para deltas de latitude/longitude (graus) que
+    cobrem o raio inteiro até a latitude absoluta informada.
+    """
+    dlat = radius_km * BBOX_PADDING / KM_PER_DEGREE_LAT_MIN
+    cos_lat = max(math.cos(math.radians(min(max_abs_lat, 89.0))), 1e-6)
+    dlon = radius_km * BBOX_PADDING / (KM_PER_DEGREE_LON_EQUATOR * cos_lat)
+    return dlat, dlon
+
+
+class GridIndex:
+    """
+    Índice espacial em grade (buckets de latitude/longitude) sobre um conjunto
+    de pontos. Cada célula tem, no mínimo, `cell_km` de lado, de modo que uma
+    busca por raio só precisa visitar as células vizinhas ao ponto consultado.
+    """
+    def __init__(self, latitudes, longitudes, cell_km, distance_mode=DISTANCE_MODE_ELLIPSOIDAL):
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.distance_mode = distance_mode
+
+        max_abs_lat = float(np.abs(self.latitudes).max()) if len(self.latitudes) else 0.0
+        self.cell_dlat, self.cell_dlon = _degree_deltas(cell_km, max_abs_lat)
+
+        self.buckets = {}
+        if len(self.latitudes):
+            rows = np.floor(self.latitudes / self.cell_dlat).astype(np.int64)
+            cols = np.floor(self.longitudes / self.cell_dlon).astype(np.int64)
+            cell_df = pd.DataFrame({'row': rows, 'col': cols, 'idx': np.arange(len(rows))})
+            for (row, col), group in cell_df.groupby(['row', 'col'], sort=False):
+                self.buckets[(row, col)] = group['idx'].to_numpy()
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def candidates_in_bbox(self, lat, lon, radius_km):
+        """
+        Retorna os índices dos pontos cujas células intersectam a caixa
+        delimitadora do círculo (lat, lon, radius_km). Pode conter falsos positivos.
+        """
+        dlat, dlon = _degree_deltas(radius_km, abs(lat) + radius_km / KM_PER_DEGREE_LAT_MIN)
+        row_min = math.floor((lat - dlat) / self.cell_dlat)
+        row_max = math.floor((lat + dlat) / self.cell_dlat)
+        col_min = math.floor((lon - dlon) / self.cell_dlon)
+        col_max = math.floor((lon + dlon) / self.cell_dlon)
+
+        found = [
+            self.buckets[(row, col)]
+            for row in range(row_min, row_max + 1)
+            for col in range(col_min, col_max + 1)
+            if (row, col) in self.buckets
+        ]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(found)
+
+    def query_radius(self, lat, lon, radius_km):
+        """
+        Retorna (índices, distâncias_km) de todos os pontos a até `radius_km`
+        de (lat, lon), já filtrados pela distância exata.
+        """
+        candidates = self.candidates_in_bbox(lat, lon, radius_km)
+        if len(candidates) == 0:
+            return candidates, np.empty(0, dtype=float)
+
+        distances = calculate_distances_km(
+            np.full(len(candidates), lat), np.full(len(candidates), lon),
+            self.latitudes[candidates], self.longitudes[candidates],
+            mode=self.distance_mode
+        )
+        within = distances <= radius_km
+        return candidates[within], distances[within]
+
+
+def find_nearby_pairs(stuck_orders_df, providers_df, radius_km, distance_mode=DISTANCE_MODE_ELLIPSOIDAL):
+    """
+    Substitui o produto cartesiano corrida x entregador: indexa os entregadores
+    em grade e, para cada loja, busca apenas os que estão a até `radius_km`.
+    Retorna um DataFrame com as colunas das duas tabelas e a coluna 'distance_km'.
+    """
+    radius_km = float(radius_km)
+    empty_pairs_df = pd.concat([stuck_orders_df.iloc[:0].reset_index(drop=True),
+                                providers_df.iloc[:0].reset_index(drop=True)], axis=1).assign(distance_km=pd.Series(dtype=float))
+    if radius_km <= 0 or stuck_orders_df.empty or providers_df.empty:
+        return empty_pairs_df
+
+    index = GridIndex(providers_df['latitude'].to_numpy(), providers_df['longitude'].to_numpy(),
+                      cell_km=radius_km, distance_mode=distance_mode)
+
+    order_positions, provider_positions, pair_distances = [], [], []
+    store_lats = stuck_orders_df['store_latitude'].to_numpy(dtype=float)
+    store_lons = stuck_orders_df['store_longitude'].to_numpy(dtype=float)
+    for position, (lat, lon) in enumerate(zip(store_lats, store_lons)):
+        provider_idx, distances = index.query_radius(lat, lon, radius_km)
+        if len(provider_idx):
+            order_positions.append(np.full(len(provider_idx), position))
+            provider_positions.append(provider_idx)
+            pair_distances.append(distances)
+
+    if not order_positions:
+        return empty_pairs_df
+
+    orders_part = stuck_orders_df.iloc[np.concatenate(order_positions)].reset_index(drop=True)
+    providers_part = providers_df.iloc[np.concatenate(provider_positions)].reset_index(drop=True)
+    pairs_df = pd.concat([orders_part, providers_part], axis=1)
+    pairs_df['distance_km'] = np.concatenate(pair_distances)
+    return pairs_df
@@ -0,0 +1,115 @@
+# stuck_order_index.py
+
+import time
+import threading
+import numpy as np
+import pandas as pd
+from db import read_data_from_db
+from query import query_stuck_orders_for_passive_index
+from data_cache import BLOCKED_PAIRS
+from pair_exclusion import PairExclusionSet
+from spatial_index import GridIndex
+from geo_distance import DISTANCE_MODE_HAVERSINE
+
+# --- CONFIGURAÇÕES DO ÍNDICE DE CORRIDAS TRAVADAS (MODO PASSIVO) ---
+STUCK_ORDER_INDEX_REFRESH_SECONDS = 30   # Intervalo entre recargas das corridas travadas
+STUCK_ORDER_INDEX_MAX_AGE_SECONDS = 180  # Índice mais velho que isso não é usado (volta para a query)
+# -------------------------------------------------------------------
+
+
+class StuckOrderIndex:
+    """
+    Índice em memória (GridIndex pelas coordenadas da loja) das corridas
+    travadas das cidades ativas, já com o limite de tempo de cada cidade.
+    Usa os mesmos filtros e a mesma distância (Haversine) da consulta ao banco
+    query_best_stuck_order_for_provider, que continua sendo o fallback.
+    Uma thread em segundo plano recarrega o índice periodicamente; a busca da
+    corrida mais próxima para um entregador não toca no banco.
+    """
+
+    def __init__(self, refresh_seconds=STUCK_ORDER_INDEX_REFRESH_SECONDS,
+                 max_age_seconds=STUCK_ORDER_INDEX_MAX_AGE_SECONDS, distance_mode=DISTANCE_MODE_HAVERSINE):
+        self.refresh_seconds = refresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self.distance_mode = distance_mode
+        self._state = None  # (orders_df, grid, max_radius_km, blocked_pairs, loaded_at)
+        self._taken_order_ids = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Inicia (uma vez por processo) a thread que mantém o índice atualizado."""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stuck-order-index", daemon=True)
+                self._thread.start()
+
+    def is_ready(self):
+        """Indica se há um índice carregado e recente o bastante para ser usado."""
+        state = self._state
+        return state is not None and time.monotonic() - state[4] <= self.max_age_seconds
+
+    def refresh(self):
+        """Recarrega as corridas travadas e os bloqueios e reconstrói o índice."""
+        orders_df = read_data_from_db(query_stuck_orders_for_passive_index())
+        if orders_df is None:
+            print("AVISO: Falha ao recarregar o índice de corridas travadas. Mantendo a versão anterior.")
+            return False
+
+        for column in ['store_latitude', 'store_longitude', 'offer_distance_km']:
+            orders_df[column] = pd.to_numeric(orders_df[column], errors='coerce')
+        orders_df = orders_df.dropna(subset=['store_latitude', 'store_longitude', 'offer_distance_km']).reset_index(drop=True)
+        max_radius_km = float(orders_df['offer_distance_km'].max()) if not orders_df.empty else 0.0
+        grid = GridIndex(orders_df['store_latitude'], orders_df['store_longitude'],
+                         cell_km=max(max_radius_km, 1.0), distance_mode=self.distance_mode)
+        blocked_pairs = PairExclusionSet.from_frame(BLOCKED_PAIRS.get(), 'user_id', 'provider_id')
+
+        with self._lock:
+            self._state = (orders_df, grid, max_radius_km, blocked_pairs, time.monotonic())
+            self._taken_order_ids = set()
+        return True
+
+    def find_best_order(self, provider_id: int, provider_lat: float, provider_lon: float):
+        """
+        Retorna (order_id, distance_km) da corrida travada mais próxima dentro do
+        raio de oferta da sua cidade, sem bloqueio loja-entregador, ou None.
+        """
+        with self._lock:
+            orders_df, grid, max_radius_km, blocked_pairs, _ = self._state
+            taken_order_ids = set(self._taken_order_ids)
+
+        if orders_df.empty:
+            return None
+        indices, distances = grid.query_radius(float(provider_lat), float(provider_lon), max_radius_km)
+        if len(indices) == 0:
+            return None
+
+        candidates = orders_df.iloc[indices]
+        eligible = distances <= candidates['offer_distance_km'].to_numpy()
+        eligible &= ~blocked_pairs.contains(candidates['user_id'].to_numpy(), np.full(len(candidates), provider_id))
+        if taken_order_ids:
+            eligible &= ~candidates['order_id'].isin(taken_order_ids).to_numpy()
+        if not eligible.any():
+            return None
+
+        best = np.flatnonzero(eligible)[np.argmin(distances[eligible])]
+        return int(candidates['order_id'].iloc[best]), float(distances[best])
+
+    def mark_taken(self, order_id: int):
+        """Tira a corrida das próximas buscas até a próxima recarga (ex.: acabou de ser alocada)."""
+        with self._lock:
+            self._taken_order_ids.add(int(order_id))
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"ERRO: Falha inesperada ao recarregar o índice de corridas travadas: {e}")
+            time.sleep(self.refresh_seconds)
+
+
+stuck_order_index = StuckOrderIndex()
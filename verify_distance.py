@@ -0,0 +1,58 @@
+# verify_distance.py
+
+import sys
+import numpy as np
+from geopy.distance import geodesic
+from geo_distance import calculate_distances_km, DISTANCE_MODE_HAVERSINE, DISTANCE_MODE_ELLIPSOIDAL
+
+# Tolerância relativa máxima aceita para cada modo em relação ao geodesic
+TOLERANCES = {
+    DISTANCE_MODE_HAVERSINE: 0.006,
+    DISTANCE_MODE_ELLIPSOIDAL: 0.0005,
+}
+
+# Centros de referência (algumas capitais atendidas) para gerar pontos realistas
+REFERENCE_CENTERS = [
+    (-19.9167, -43.9345),  # Belo Horizonte
+    (-23.5505, -46.6333),  # São Paulo
+    (-3.7319, -38.5267),   # Fortaleza
+    (-30.0346, -51.2177),  # Porto Alegre
+]
+
+def check_distance_modes(samples_per_center=500, spread_deg=0.2, seed=42):
+    """
+    Gera pares de pontos aleatórios em torno das cidades de referência e
+    compara o cálculo vetorizado de cada modo com o geopy.geodesic.
+    Retorna True se todos os modos ficarem dentro da tolerância.
+    """
+    rng = np.random.default_rng(seed)
+    lat1, lon1, lat2, lon2 = [], [], [], []
+    for center_lat, center_lon in REFERENCE_CENTERS:
+        lat1.append(center_lat + rng.uniform(-spread_deg, spread_deg, samples_per_center))
+        lon1.append(center_lon + rng.uniform(-spread_deg, spread_deg, samples_per_center))
+        lat2.append(center_lat + rng.uniform(-spread_deg, spread_deg, samples_per_center))
+        lon2.append(center_lon + rng.uniform(-spread_deg, spread_deg, samples_per_center))
+    lat1, lon1, lat2, lon2 = (np.concatenate(v) for v in (lat1, lon1, lat2, lon2))
+
+    # Inclui um par de pontos coincidentes para garantir que não há divisão por zero
+    lat1, lon1 = np.append(lat1, -19.9167), np.append(lon1, -43.9345)
+    lat2, lon2 = np.append(lat2, -19.9167), np.append(lon2, -43.9345)
+
+    reference = np.array([geodesic((a, b), (c, d)).kilometers for a, b, c, d in zip(lat1, lon1, lat2, lon2)])
+
+    all_ok = True
+    for mode, tolerance in TOLERANCES.items():
+        result = calculate_distances_km(lat1, lon1, lat2, lon2, mode=mode)
+        abs_error = np.abs(result - reference)
+        rel_error = np.divide(abs_error, reference, out=np.zeros_like(abs_error), where=reference > 0)
+        ok = bool(np.all(np.isfinite(result)) and rel_error.max() <= tolerance)
+        all_ok = all_ok and ok
+
+        print(f"Modo '{mode}': erro absoluto máx = {abs_error.max() * 1000:.2f} m, "
+              f"erro relativo máx = {rel_error.max():.5%} (tolerância {tolerance:.3%}) -> {'OK' if ok else 'FALHA'}")
+
+    return all_ok
+
+if __name__ == "__main__":
+    print("--- A verificar o cálculo vetorizado de distâncias contra o geopy.geodesic ---")
+    sys.exit(0 if check_distance_modes() else 1)
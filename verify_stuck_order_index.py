@@ -0,0 +1,59 @@
+# verify_stuck_order_index.py
+
+import sys
+import pandas as pd
+from db import read_data_from_db
+from query import query_available_providers, query_best_stuck_order_for_provider
+from stuck_order_index import StuckOrderIndex
+
+# Entregadores online usados como amostra
+SAMPLE_PROVIDERS = 50
+# Diferença de distância (km) aceita quando o índice e o banco escolhem corridas empatadas
+DISTANCE_TOLERANCE_KM = 0.01
+
+def check_index_matches_query(sample_size=SAMPLE_PROVIDERS):
+    """
+    Carrega o índice em memória do modo passivo e, para uma amostra de
+    entregadores online, confere se ele escolhe a mesma corrida que a
+    consulta ao banco (query_best_stuck_order_for_provider).
+    Retorna True se as escolhas coincidirem para todos os entregadores.
+    """
+    index = StuckOrderIndex()
+    if not index.refresh():
+        print("ERRO: Não foi possível carregar o índice de corridas travadas.")
+        return False
+
+    providers_df = read_data_from_db(query_available_providers())
+    if providers_df is None or providers_df.empty:
+        print("ERRO: Nenhum entregador online para a amostra.")
+        return False
+    for column in ['latitude', 'longitude']:
+        providers_df[column] = pd.to_numeric(providers_df[column], errors='coerce')
+    providers_df = providers_df.dropna(subset=['latitude', 'longitude']).drop_duplicates('provider_id').head(sample_size)
+
+    mismatches = 0
+    for provider in providers_df.itertuples(index=False):
+        provider_id = int(provider.provider_id)
+        from_index = index.find_best_order(provider_id, provider.latitude, provider.longitude)
+        result_df = read_data_from_db(query_best_stuck_order_for_provider(provider_id, provider.latitude, provider.longitude))
+        if result_df is None:
+            print(f"ERRO: Falha na consulta ao banco para o entregador {provider_id}.")
+            mismatches += 1
+            continue
+        from_query = None if result_df.empty else (int(result_df.iloc[0]['order_id']), float(result_df.iloc[0]['distance_km']))
+
+        if from_index is None or from_query is None:
+            same = from_index is None and from_query is None
+        else:
+            # Corridas diferentes só são aceitas se estiverem empatadas na distância
+            same = from_index[0] == from_query[0] or abs(from_index[1] - from_query[1]) <= DISTANCE_TOLERANCE_KM
+        if not same:
+            mismatches += 1
+            print(f"FALHA: Entregador {provider_id}: índice = {from_index}, banco = {from_query}.")
+
+    print(f"Entregadores verificados: {len(providers_df)}, divergências: {mismatches} -> {'OK' if mismatches == 0 else 'FALHA'}")
+    return mismatches == 0
+
+if __name__ == "__main__":
+    print("--- A comparar o índice de corridas travadas com a consulta ao banco ---")
+    sys.exit(0 if check_index_matches_query() else 1)
@@ -0,0 +1,145 @@
+# webhook_dedupe.py
+
+import time
+import threading
+from collections import OrderedDict
+from log_db import execute_log_write
+
+# --- CONFIGURAÇÕES DA DEDUPLICAÇÃO DO WEBHOOK ---
+DEDUPE_TTL_SECONDS = 3600        # Por quanto tempo uma entrega repetida é ignorada (memória e banco de log)
+DEDUPE_MAX_ENTRIES = 50000       # Limite de chaves em memória (as mais antigas saem primeiro)
+DEDUPE_USE_LOG_DB = True         # Confirma no banco de log (chave única), valendo entre processos
+DELIVERIES_PURGE_INTERVAL_SECONDS = 600  # Frequência (por processo) da limpeza das entregas expiradas
+DELIVERIES_PURGE_BATCH_SIZE = 5000       # Linhas apagadas por comando de limpeza
+# Campo do payload do "POST para URL" do Chatguru com o id da mensagem. O payload
+# padrão não traz esse campo (só chat_id, celular, texto_mensagem, bot_context,
+# campos_personalizados...); ele só existe se for incluído na configuração da
+# ação. Sem ele, a chave fica (ordem, entregador, status): a mesma resposta para
+# a mesma oferta dentro do TTL é tratada como repetida, que é o que se quer.
+MESSAGE_ID_FIELD = 'message_id'
+# -------------------------------------------------
+
+DELIVERIES_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS sai_webhook_deliveries (
+        delivery_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        order_id INT NOT NULL,
+        provider_id INT NOT NULL,
+        response_status VARCHAR(50) NOT NULL,
+        message_id VARCHAR(100) NOT NULL DEFAULT '',
+        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_delivery (order_id, provider_id, response_status, message_id),
+        INDEX (received_at)
+    );
+"""
+
+
+class TTLDedupeCache:
+    """
+    Conjunto de chaves já vistas, com expiração (TTL) e tamanho máximo.
+    `add_if_new` é atômico entre as threads do processo.
+    """
+
+    def __init__(self, ttl_seconds=DEDUPE_TTL_SECONDS, max_entries=DEDUPE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'new': 0, 'duplicates': 0}
+
+    def add_if_new(self, key):
+        """Registra a chave e retorna True, ou retorna False se ela já foi vista dentro do TTL."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            if key in self._entries:
+                self.stats['duplicates'] += 1
+                return False
+            self._entries[key] = now + self.ttl_seconds
+            self.stats['new'] += 1
+            return True
+
+    def discard(self, key):
+        """Esquece a chave (ex.: o job não pôde ser enfileirado e a entrega deve ser aceita de novo)."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _evict(self, now):
+        # As entradas estão em ordem de inserção, logo também de expiração
+        while self._entries:
+            expires_at = next(iter(self._entries.values()))
+            if expires_at > now and len(self._entries) < self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+
+delivery_cache = TTLDedupeCache()
+_last_purge_at = None
+_purge_lock = threading.Lock()
+
+
+def extract_message_id(data: dict):
+    """Id da mensagem (MESSAGE_ID_FIELD) no payload do Chatguru, ou string vazia quando ausente."""
+    value = data.get(MESSAGE_ID_FIELD)
+    return str(value)[:100] if value else ''
+
+
+def delivery_key(order_id: int, provider_id: int, response_status, message_id: str):
+    """Chave de idempotência de uma resposta de oferta."""
+    return (order_id, provider_id, str(response_status), message_id)
+
+
+def claim_delivery_in_log_db(key):
+    """
+    Registra a entrega na tabela 'sai_webhook_deliveries' (chave única, criada
+    pelo setup_database.py). Retorna False se uma entrega igual foi registrada
+    (por qualquer processo) há menos de DEDUPE_TTL_SECONDS; uma entrega igual
+    mais antiga que o TTL é aceita de novo. Em caso de erro no banco, retorna
+    True para não perder a resposta.
+    """
+    if not DEDUPE_USE_LOG_DB:
+        return True
+    _purge_expired_deliveries()
+    # Linhas afetadas: 1 = nova, 2 = existia mas já tinha expirado, 0 = repetida dentro do TTL
+    query = f"""
+        INSERT INTO sai_webhook_deliveries (order_id, provider_id, response_status, message_id)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE received_at = IF(
+            received_at < NOW() - INTERVAL {int(DEDUPE_TTL_SECONDS)} SECOND, NOW(), received_at
+        )
+    """
+    affected = execute_log_write(query, key)
+    return affected is None or affected > 0
+
+
+def release_delivery(key):
+    """
+    Desfaz o registro da entrega (memória e banco de log) quando o seu
+    processamento falhou, para que uma nova entrega igual não seja descartada.
+    """
+    delivery_cache.discard(key)
+    if not DEDUPE_USE_LOG_DB:
+        return
+    query = """
+        DELETE FROM sai_webhook_deliveries
+        WHERE order_id = %s AND provider_id = %s AND response_status = %s AND message_id = %s
+    """
+    if execute_log_write(query, key) is None:
+        print(f"AVISO: Não foi possível liberar a entrega {key} no banco de log.")
+
+
+def _purge_expired_deliveries():
+    # Apaga as entregas expiradas no máximo uma vez a cada DELIVERIES_PURGE_INTERVAL_SECONDS por processo
+    global _last_purge_at
+    now = time.monotonic()
+    with _purge_lock:
+        if _last_purge_at is not None and now - _last_purge_at < DELIVERIES_PURGE_INTERVAL_SECONDS:
+            return
+        _last_purge_at = now
+    query = f"""
+        DELETE FROM sai_webhook_deliveries
+        WHERE received_at < NOW() - INTERVAL {int(DEDUPE_TTL_SECONDS)} SECOND
+        LIMIT {int(DELIVERIES_PURGE_BATCH_SIZE)}
+    """
+    deleted = execute_log_write(query)
+    if deleted:
+        print(f"INFO: {deleted} entregas expiradas do webhook apagadas da 'sai_webhook_deliveries'.")
@@ -0,0 +1,113 @@
+# webhook_jobs.py
+
+import time
+import queue
+import atexit
+import threading
+
+# --- CONFIGURAÇÕES DA FILA DE JOBS DO WEBHOOK ---
+WEBHOOK_JOB_WORKERS = 4          # Threads que processam os jobs, por processo do gunicorn
+WEBHOOK_JOB_QUEUE_SIZE = 1000    # Fila cheia => a rota responde 503 e o Chatguru tenta de novo
+SHUTDOWN_DRAIN_TIMEOUT_SECONDS = 20
+# ------------------------------------------------
+
+
+class WebhookJobQueue:
+    """
+    Fila de jobs em memória com um pool de threads. A rota do webhook só
+    valida o payload e enfileira o job, respondendo em milissegundos; o
+    fluxo demorado (consulta ao banco, atribuição, logs) roda em segundo plano.
+    Mantém métricas de profundidade da fila e de latência (espera e processamento).
+    """
+
+    def __init__(self, num_workers=WEBHOOK_JOB_WORKERS, max_queue_size=WEBHOOK_JOB_QUEUE_SIZE):
+        self.num_workers = num_workers
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0,
+            'total_wait_seconds': 0.0, 'total_processing_seconds': 0.0,
+            'max_wait_seconds': 0.0, 'max_processing_seconds': 0.0
+        }
+
+    def submit(self, job_name, fn, *args):
+        """Enfileira `fn(*args)`. Retorna False se a fila estiver cheia."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((job_name, fn, args, time.monotonic()))
+        except queue.Full:
+            self._add_stats(rejected=1)
+            print(f"AVISO: Fila de jobs do webhook cheia. Job '{job_name}' recusado.")
+            return False
+        self._add_stats(submitted=1)
+        return True
+
+    def drain(self, timeout=SHUTDOWN_DRAIN_TIMEOUT_SECONDS):
+        """Espera (até `timeout` segundos) que os jobs pendentes terminem."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+    def metrics(self):
+        """Profundidade da fila, contadores e latências médias/máximas (em ms)."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        finished = stats['completed'] + stats['failed']
+        return {
+            'queue_depth': self._queue.qsize(),
+            'in_flight': self._queue.unfinished_tasks,
+            'workers': len(self._threads),
+            'submitted': stats['submitted'],
+            'rejected': stats['rejected'],
+            'completed': stats['completed'],
+            'failed': stats['failed'],
+            'avg_wait_ms': round(stats['total_wait_seconds'] / finished * 1000, 1) if finished else 0.0,
+            'max_wait_ms': round(stats['max_wait_seconds'] * 1000, 1),
+            'avg_processing_ms': round(stats['total_processing_seconds'] / finished * 1000, 1) if finished else 0.0,
+            'max_processing_ms': round(stats['max_processing_seconds'] * 1000, 1)
+        }
+
+    def _ensure_started(self):
+        # As threads nascem no primeiro job, já dentro do processo do gunicorn
+        if self._threads:
+            return
+        with self._start_lock:
+            if not self._threads:
+                for index in range(self.num_workers):
+                    thread = threading.Thread(target=self._run, name=f"webhook-job-{index}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job_name, fn, args, enqueued_at = self._queue.get()
+            started_at = time.monotonic()
+            failed = False
+            try:
+                fn(*args)
+            except Exception as e:
+                failed = True
+                print(f"ERRO: Job '{job_name}' do webhook falhou: {e}")
+            finally:
+                finished_at = time.monotonic()
+                self._record(started_at - enqueued_at, finished_at - started_at, failed)
+                self._queue.task_done()
+
+    def _record(self, wait_seconds, processing_seconds, failed):
+        with self._stats_lock:
+            self._stats['failed' if failed else 'completed'] += 1
+            self._stats['total_wait_seconds'] += wait_seconds
+            self._stats['total_processing_seconds'] += processing_seconds
+            self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], wait_seconds)
+            self._stats['max_processing_seconds'] = max(self._stats['max_processing_seconds'], processing_seconds)
+
+    def _add_stats(self, **increments):
+        with self._stats_lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+
+job_queue = WebhookJobQueue()
+atexit.register(job_queue.drain)
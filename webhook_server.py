@@ -5,12 +5,16 @@ import pandas as pd
 import json
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
-from internal_api import login, assign_order
-from log_db import log_sai_event
+from internal_api import AccessTokenManager
+from event_logger import log_sai_event, event_logger
+from webhook_jobs import job_queue
+from webhook_dedupe import delivery_cache, delivery_key, extract_message_id, claim_delivery_in_log_db, release_delivery
+from http_session import get_http_stats
 from datetime import datetime
 from db import read_data_from_db
 from query import query_order_status, query_provider_by_id, query_best_stuck_order_for_provider
 from chatguru_api import ChatguruWABA
+from stuck_order_index import stuck_order_index
 
 load_dotenv()
 app = Flask(__name__)
@@ -18,6 +22,13 @@ app = Flask(__name__)
 GIROSS_EMAIL = os.getenv("GIROSS_EMAIL")
 GIROSS_PASSWORD = os.getenv("GIROSS_PASSWORD")
 
+# Token da API interna em cache, compartilhado pelas threads deste processo
+token_manager = AccessTokenManager(GIROSS_EMAIL, GIROSS_PASSWORD)
+
+# Índice em memória das corridas travadas para o modo passivo (recarregado em segundo plano)
+stuck_order_index.start()
+PASSIVE_INDEX_MAX_CANDIDATES = 3  # Corridas do índice conferidas no banco antes de usar a consulta completa
+
 CHAT_GURU_KEY = os.getenv("CHAT_GURU_KEY")
 CHAT_GURU_ACCOUNT_ID = os.getenv("CHAT_GURU_ACCOUNT_ID")
 CHAT_GURU_PHONE_ID = os.getenv("CHAT_GURU_PHONE_ID")
@@ -50,37 +61,35 @@ def find_next_provider_and_send_offer(order_id, rejected_provider_id):
     print("A lógica para encontrar o próximo provedor precisa ser implementada aqui.")
     pass
 
-@app.route('/webhook', methods=['POST'])
-def receive_message():
+def process_provider_response(order_id_int, provider_id_int, response_status, delivery=None):
     """
-    Recebe a resposta do provedor, registra o evento e toma a ação apropriada.
+    Fluxo de aceite/recusa de uma oferta, executado em segundo plano pela
+    fila de jobs: registra o evento, verifica a ordem e tenta a atribuição.
+    `delivery` é a chave de idempotência da entrega; se outro processo já a
+    registrou no banco de log, o job termina sem repetir nada. Se o fluxo
+    falhar (erro no banco ou na API interna), a entrega é liberada para que
+    uma nova entrega da mesma resposta seja processada.
     """
-    # (O código desta rota permanece o mesmo que você forneceu)
-    print("\n" + "="*50)
-    print(f">>> ROTA /webhook ACIONADA ÀS {datetime.now()} <<<")
-    print(f"INFO: Método da Requisição: {request.method}")
-    print(f"INFO: IP de Origem: {request.remote_addr}")
-    print("="*50)
-
-    data = request.json
-    print("\n" + "="*50)
-    print(">>> DADOS JSON RECEBIDOS DO CHATGURU <<<")
-    print(data)
-    
-    bot_context = data.get('bot_context', {})
-    response_status = bot_context.get('Status')
-    custom_fields = data.get('campos_personalizados', {})
-    
-    order_id = custom_fields.get('order_id')
-    provider_id = custom_fields.get('provider_id')
+    if delivery is not None and not claim_delivery_in_log_db(delivery):
+        print(f"INFO: Entrega repetida da resposta do provedor {provider_id_int} para a ordem {order_id_int}. Ignorando.")
+        return
 
-    if not order_id or not provider_id:
-        print("ERRO: 'order_id' ou 'provider_id' não encontrados nos campos personalizados.")
-        return jsonify({"status": "error", "message": "Missing required custom fields"}), 400
-
-    order_id_int = int(order_id)
-    provider_id_int = int(provider_id)
+    try:
+        completed = handle_provider_response(order_id_int, provider_id_int, response_status)
+    except Exception:
+        if delivery is not None:
+            release_delivery(delivery)
+        raise
+    if not completed and delivery is not None:
+        print(f"AVISO: Resposta do provedor {provider_id_int} para a ordem {order_id_int} não foi concluída. "
+              "Uma nova entrega será processada.")
+        release_delivery(delivery)
 
+def handle_provider_response(order_id_int, provider_id_int, response_status):
+    """
+    Executa o aceite/recusa. Retorna False se o fluxo não chegou a um
+    resultado final por falha no banco ou na API interna.
+    """
     if response_status == 'Resposta_sim':
         print(f"INFO: Provedor {provider_id_int} ACEITOU a ordem {order_id_int}.")
         log_sai_event(order_id_int, provider_id_int, 'PROVIDER_ACCEPTED')
@@ -88,35 +97,152 @@ def receive_message():
         print(f"INFO: Verificando o status atual da ordem {order_id_int} no banco de dados...")
         order_status_df = read_data_from_db(query_order_status(order_id_int))
 
-        if order_status_df is None or order_status_df.empty:
+        if order_status_df is None:
+            print(f"ERRO: Falha ao consultar a ordem {order_id_int} no banco de dados para verificação.")
+            log_sai_event(order_id_int, provider_id_int, 'VERIFICATION_FAILED_DB_ERROR')
+            return False
+
+        if order_status_df.empty:
             print(f"ERRO: Não foi possível encontrar a ordem {order_id_int} no banco de dados para verificação.")
             log_sai_event(order_id_int, provider_id_int, 'VERIFICATION_FAILED_NOT_FOUND')
-            return jsonify({"status": "error", "message": "Order not found for verification"}), 404
+            return True
 
         current_provider_id = order_status_df.iloc[0]['provider_id']
 
         if current_provider_id not in [0, 1266]:
             print(f"INFO: A ordem {order_id_int} já foi atribuída ao provedor {current_provider_id}. Esta oferta não está mais disponível para o provedor {provider_id_int}.")
             log_sai_event(order_id_int, provider_id_int, 'ORDER_ALREADY_TAKEN')
-            return jsonify({"status": "success", "message": "Order already assigned"}), 200
+            return True
         
         print(f"INFO: A ordem {order_id_int} está disponível. Tentando atribuir ao provedor {provider_id_int}...")
 
-        access_token = login(GIROSS_EMAIL, GIROSS_PASSWORD)
+        success = token_manager.assign_order(provider_id_int, order_id_int)
         
-        if access_token:
-            success = assign_order(access_token, provider_id_int, order_id_int)
+        if success is not None:
             log_event = 'ASSIGNMENT_SUCCESS' if success else 'ASSIGNMENT_FAILURE'
             log_sai_event(order_id_int, provider_id_int, log_event)
+            return bool(success)
         else:
             print("ERRO: Não foi possível atribuir a ordem devido a falha no login.")
             log_sai_event(order_id_int, provider_id_int, 'ASSIGNMENT_FAILURE_LOGIN')
+            return False
             
     else:
         log_sai_event(order_id_int, provider_id_int, 'PROVIDER_REJECTED')
-        find_next_provider_and_send_offer(order_id, provider_id)
-        
-    return jsonify({"status": "success"}), 200
+        find_next_provider_and_send_offer(order_id_int, provider_id_int)
+        return True
+
+@app.route('/webhook', methods=['POST'])
+def receive_message():
+    """
+    Recebe a resposta do provedor, valida o payload e enfileira o fluxo de
+    aceite/recusa (process_provider_response), respondendo imediatamente.
+    """
+    print("\n" + "="*50)
+    print(f">>> ROTA /webhook ACIONADA ÀS {datetime.now()} <<<")
+    print(f"INFO: Método da Requisição: {request.method}")
+    print(f"INFO: IP de Origem: {request.remote_addr}")
+    print("="*50)
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        print("ERRO: Corpo da requisição não é um JSON válido.")
+        return jsonify({"status": "error", "message": "Invalid JSON body"}), 400
+
+    print("\n" + "="*50)
+    print(">>> DADOS JSON RECEBIDOS DO CHATGURU <<<")
+    print(data)
+    
+    bot_context = data.get('bot_context') or {}
+    response_status = bot_context.get('Status')
+    custom_fields = data.get('campos_personalizados') or {}
+    
+    order_id = custom_fields.get('order_id')
+    provider_id = custom_fields.get('provider_id')
+
+    if not order_id or not provider_id:
+        print("ERRO: 'order_id' ou 'provider_id' não encontrados nos campos personalizados.")
+        return jsonify({"status": "error", "message": "Missing required custom fields"}), 400
+
+    try:
+        order_id_int = int(order_id)
+        provider_id_int = int(provider_id)
+    except (TypeError, ValueError):
+        print(f"ERRO: 'order_id' ({order_id}) ou 'provider_id' ({provider_id}) inválidos.")
+        return jsonify({"status": "error", "message": "Invalid custom fields"}), 400
+
+    # Idempotência: o Chatguru pode disparar o "POST para URL" mais de uma vez
+    delivery = delivery_key(order_id_int, provider_id_int, response_status, extract_message_id(data))
+    if not delivery_cache.add_if_new(delivery):
+        print(f"INFO: Entrega repetida da resposta do provedor {provider_id_int} para a ordem {order_id_int}. Ignorando.")
+        return jsonify({"status": "success", "message": "Duplicate delivery"}), 200
+
+    if not job_queue.submit('provider_response', process_provider_response, order_id_int, provider_id_int, response_status, delivery):
+        delivery_cache.discard(delivery)
+        return jsonify({"status": "error", "message": "Server busy, retry later"}), 503
+
+    return jsonify({"status": "success", "message": "Queued"}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Métricas deste processo: fila de jobs do webhook (profundidade e
+    latências), log de eventos em lote, entregas repetidas descartadas e
+    reaproveitamento de conexões HTTP.
+    """
+    return jsonify({
+        "webhook_jobs": job_queue.metrics(),
+        "event_logger": dict(event_logger.stats),
+        "webhook_dedupe": dict(delivery_cache.stats),
+        "http_connections": get_http_stats()
+    }), 200
+
+def is_order_still_available(order_id: int):
+    """
+    Confere no banco de produção se a corrida ainda está SEARCHING e sem
+    entregador (0 ou 1266). Retorna None se a consulta falhar.
+    """
+    order_status_df = read_data_from_db(query_order_status(order_id))
+    if order_status_df is None:
+        return None
+    if order_status_df.empty:
+        return False
+    order_status = order_status_df.iloc[0]
+    return order_status['status'] == 'SEARCHING' and order_status['provider_id'] in [0, 1266]
+
+def find_available_stuck_order(provider_id: int, provider_lat, provider_lon):
+    """
+    Escolhe a corrida travada mais próxima do entregador pelo índice em memória
+    e confirma no banco que ela continua disponível (o índice pode ter até
+    STUCK_ORDER_INDEX_MAX_AGE_SECONDS e não vê as alocações do fluxo ativo nem
+    do outro processo do gunicorn). Corridas já tomadas saem do índice e a busca
+    passa para a próxima; se o índice não resolver, usa a consulta ao banco.
+    Retorna o order_id ou None.
+    """
+    if stuck_order_index.is_ready():
+        for _ in range(PASSIVE_INDEX_MAX_CANDIDATES):
+            best_order = stuck_order_index.find_best_order(provider_id, provider_lat, provider_lon)
+            if best_order is None:
+                return None
+            order_id, distance_km = best_order
+            available = is_order_still_available(order_id)
+            if available:
+                print(f"INFO: Corrida {order_id} encontrada no índice em memória a {distance_km:.2f}km.")
+                return order_id
+            if available is None:
+                break
+            print(f"INFO: Corrida {order_id} do índice já não está disponível. Tentando a próxima.")
+            stuck_order_index.mark_taken(order_id)
+        print("AVISO: O índice de corridas travadas não confirmou uma corrida. Usando a consulta ao banco.")
+    else:
+        print("AVISO: Índice de corridas travadas indisponível. Usando a consulta ao banco.")
+
+    best_order_df = read_data_from_db(query_best_stuck_order_for_provider(
+        provider_id=provider_id, provider_lat=provider_lat, provider_lon=provider_lon
+    ))
+    if best_order_df is None or best_order_df.empty:
+        return None
+    return int(best_order_df.iloc[0]['order_id'])
 
 # --- ROTA ATUALIZADA PARA O MODO PASSIVO (BASEADA EM ID) ---
 @app.route('/request_order', methods=['POST'])
@@ -171,34 +297,30 @@ def request_order_by_id():
             chat_api.send_text_message(chat_number, "Não conseguimos encontrar sua localização atual. Verifique se o GPS está ativado no seu aplicativo e tente novamente.")
         return jsonify({"status": "success"}), 200
 
-    # 3. Encontrar a melhor corrida
+    # 3. Encontrar a melhor corrida (no índice em memória; a query é o plano B)
     print(f"INFO: Buscando a melhor corrida para o provedor {provider_id}...")
-    best_order_df = read_data_from_db(query_best_stuck_order_for_provider(
-        provider_id=provider_id,
-        provider_lat=provider_info['provider_latitude'],
-        provider_lon=provider_info['provider_longitude']
-    ))
+    best_order_id = find_available_stuck_order(
+        provider_id, provider_info['provider_latitude'], provider_info['provider_longitude']
+    )
 
     # 4. Lógica de Alocação e Resposta
-    if best_order_df is None or best_order_df.empty:
+    if best_order_id is None:
         print(f"INFO: Nenhuma corrida encontrada para o provedor {provider_id}.")
         log_sai_event(0, provider_id, 'PASSIVE_ASSIGNMENT_NO_ORDER_FOUND')
         if chat_api and chat_number:
             chat_api.send_text_message(chat_number, "Obrigado pela disponibilidade! No momento, não encontramos corridas travadas perto de você. Continue online!")
     else:
-        best_order_info = best_order_df.iloc[0]
-        order_id = int(best_order_info['order_id'])
+        order_id = best_order_id
         print(f"INFO: Melhor corrida encontrada: {order_id}. Alocando...")
 
-        access_token = login(GIROSS_EMAIL, GIROSS_PASSWORD)
-        if access_token:
-            # MODO DE TESTE SEGURO: A alocação real está comentada.
-            # Descomente a linha abaixo para habilitar a alocação em produção.
-            success = assign_order(access_token, provider_id, order_id)
-            # success = True # Linha para simular sucesso no teste sem alocar de verdade.
-            
+        # MODO DE TESTE SEGURO: A alocação real está comentada.
+        # Descomente a linha abaixo para habilitar a alocação em produção.
+        success = token_manager.assign_order(provider_id, order_id)
+        # success = True # Linha para simular sucesso no teste sem alocar de verdade.
+        if success is not None:
             if success:
                 print(f"SUCESSO: Corrida {order_id} alocada para o provedor {provider_id}.")
+                stuck_order_index.mark_taken(order_id)
                 log_sai_event(order_id, provider_id, 'PASSIVE_ASSIGNMENT_SUCCESS')
                 if chat_api and chat_number:
                     chat_api.send_text_message(chat_number, f"✅ Ótima notícia! Alocamos a corrida #{order_id} para você. Por favor, verifique os detalhes no seu aplicativo.")
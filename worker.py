@@ -1,9 +1,15 @@
 # worker.py
 
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 import pandas as pd
 from main import process_city_offers
+from cycle_snapshot import CycleSnapshot
+from data_cache import print_cache_stats
+from http_session import print_http_stats
+from provider_offer_state import refresh_provider_offer_state
 from log_db import read_log_data, update_city_last_run
 from query import query_sai_city_configs, query_offers_sent_today
 from analytics_etl import run_analytics_etl
@@ -17,11 +23,109 @@ DAILY_SPEND_LIMIT_BRL = 60.00
 COST_PER_OFFER_BRL = 0.046
 # -----------------------------------------
 
+# --- CONFIGURAÇÕES DE PARALELISMO ENTRE CIDADES ---
+MAX_PARALLEL_CITIES = 4
+CITY_TIMEOUT_SECONDS = 600     # Tempo máximo de uma cidade, contado a partir do seu início
+CITY_WAIT_POLL_SECONDS = 5     # Intervalo em que o ciclo confere os prazos das cidades
+CITY_MAX_CONSECUTIVE_OVERDUE = 3   # Execuções seguidas acima do prazo antes de pôr a cidade em quarentena
+CITY_QUARANTINE_MINUTES = 30       # Tempo em que uma cidade em quarentena não é disparada
+# --------------------------------------------------
+
+# Cidades rodam num pool limitado. Uma cidade que estoura o prazo continua
+# rodando em segundo plano (as leituras do banco têm read timeout, então ela
+# termina) e não é disparada de novo até terminar. Uma cidade que estoura o
+# prazo várias vezes seguidas fica em quarentena, para não prender as vagas
+# do pool ciclo após ciclo.
+city_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_CITIES, thread_name_prefix="sai-city")
+running_city_ids = set()             # Cidades enviadas ao pool (na fila ou em execução)
+city_started_at = {}                 # city_id -> time.monotonic() do início da execução
+city_overdue_runs = {}               # city_id -> execuções seguidas acima do prazo
+city_quarantined_until = {}          # city_id -> time.monotonic() do fim da quarentena
+running_city_ids_lock = threading.Lock()
+
 # --- INTERRUPTOR DE SEGURANÇA GLOBAL ---
 # Esta variável será alterada para False se um e-mail de alerta for detetado.
 is_sai_enabled = True
 # ------------------------------------
 
+def run_city(city_config, snapshot):
+    """
+    Processa uma cidade dentro do pool de threads. O 'last_run_timestamp'
+    só é registrado quando a cidade termina com sucesso.
+    """
+    city_id = city_config['city_id']
+    city_name = city_config['city_name']
+    with running_city_ids_lock:
+        city_started_at[city_id] = time.monotonic()
+    try:
+        print(f"\n>>> EXECUTANDO SAI PARA: {city_name} (ID: {city_id}) <<<")
+        process_city_offers(city_config=city_config, snapshot=snapshot)
+        update_city_last_run(city_id)
+        print(f">>> FINALIZADO SAI PARA: {city_name} <<<")
+    except Exception as e:
+        print(f"ERRO ao processar a cidade {city_name} (ID: {city_id}): {e}")
+    finally:
+        with running_city_ids_lock:
+            running_city_ids.discard(city_id)
+            elapsed = time.monotonic() - city_started_at.pop(city_id)
+            if elapsed < CITY_TIMEOUT_SECONDS:
+                city_overdue_runs.pop(city_id, None)
+                overdue_runs = 0
+            else:
+                overdue_runs = city_overdue_runs.get(city_id, 0) + 1
+                city_overdue_runs[city_id] = overdue_runs
+                if overdue_runs >= CITY_MAX_CONSECUTIVE_OVERDUE:
+                    city_quarantined_until[city_id] = time.monotonic() + CITY_QUARANTINE_MINUTES * 60
+        if overdue_runs >= CITY_MAX_CONSECUTIVE_OVERDUE:
+            print(f"ALERTA: {city_name} (ID: {city_id}) estourou o prazo em {overdue_runs} execuções seguidas "
+                  f"(última: {elapsed:.0f}s). Em quarentena por {CITY_QUARANTINE_MINUTES} minutos.")
+
+def count_overdue_slots():
+    """
+    Retorna quantas vagas do pool estão presas em cidades que já passaram
+    de CITY_TIMEOUT_SECONDS desde o início da execução.
+    """
+    now = time.monotonic()
+    with running_city_ids_lock:
+        return sum(1 for started_at in city_started_at.values() if now - started_at >= CITY_TIMEOUT_SECONDS)
+
+def wait_for_cities(city_futures):
+    """
+    Espera as cidades do ciclo, cada uma com o seu próprio prazo
+    (CITY_TIMEOUT_SECONDS a partir do momento em que começou a rodar).
+    Se todas as vagas do pool estão presas em cidades que estouraram o prazo,
+    as cidades ainda na fila são canceladas e voltam a ser disparadas num
+    próximo ciclo. Retorna (cidades atrasadas, cidades canceladas na fila).
+    """
+    pending = set(city_futures)
+    while pending:
+        _, pending = wait(pending, timeout=CITY_WAIT_POLL_SECONDS)
+        now = time.monotonic()
+        with running_city_ids_lock:
+            started = {future: city_started_at.get(city_futures[future][0]) for future in pending}
+            # Vagas do pool ocupadas por cidades dentro do prazo (inclusive de ciclos anteriores)
+            slots_in_use = len(city_started_at)
+            slots_on_time = sum(1 for started_at in city_started_at.values() if now - started_at < CITY_TIMEOUT_SECONDS)
+        overdue = [future for future, started_at in started.items()
+                   if started_at is not None and now - started_at >= CITY_TIMEOUT_SECONDS]
+        queued = [future for future, started_at in started.items() if started_at is None]
+        running = len(pending) - len(queued)
+
+        if running > len(overdue):
+            continue  # Alguma cidade deste ciclo ainda está dentro do prazo
+        if queued and (slots_in_use < MAX_PARALLEL_CITIES or slots_on_time > 0):
+            continue  # Uma vaga está livre ou vai liberar dentro do prazo: a fila anda
+
+        cancelled = []
+        for future in queued:
+            if future.cancel():
+                city_id, city_name = city_futures[future]
+                with running_city_ids_lock:
+                    running_city_ids.discard(city_id)
+                cancelled.append(city_name)
+        return [city_futures[future][1] for future in overdue], cancelled
+    return [], []
+
 def main():
     """
     Loop principal do worker. A cada minuto, verifica o status de segurança,
@@ -75,6 +179,12 @@ def main():
                 continue # Pula para a próxima iteração do loop
             # --- FIM DA VERIFICAÇÃO ---
 
+            # --- ESTADO DE OFERTAS DOS ENTREGADORES (cooldown e filtro de ativos) ---
+            try:
+                refresh_provider_offer_state()
+            except Exception as e:
+                print(f"ERRO ao atualizar o estado de ofertas dos entregadores: {e}")
+
             # --- LÓGICA DE OFERTAS POR CIDADE (a cada minuto) ---
             city_configs_df = read_log_data(query_sai_city_configs())
 
@@ -82,6 +192,15 @@ def main():
                 print("AVISO: Nenhuma configuração de cidade ativa encontrada.")
             else:
                 now = datetime.now()
+                # Dados globais carregados apenas uma vez por ciclo (e só se alguma cidade rodar)
+                snapshot = None
+                city_futures = {}
+                hung_cities = []
+                overdue_slots = count_overdue_slots()
+                pool_blocked = overdue_slots >= MAX_PARALLEL_CITIES
+                if pool_blocked:
+                    print(f"ALERTA: Todas as {MAX_PARALLEL_CITIES} vagas do pool estão presas em cidades que estouraram "
+                          f"o prazo. Nenhuma cidade nova será disparada neste ciclo.")
                 for index, city_config in city_configs_df.iterrows():
                     city_id = city_config['city_id']
                     city_name = city_config['city_name']
@@ -92,11 +211,58 @@ def main():
                     
                     if not should_run:
                         print(f"INFO: Aguardando para {city_name}. Próxima execução após {(last_run + interval).strftime('%H:%M:%S')}.")
-                    else:
-                        print(f"\n>>> EXECUTANDO SAI PARA: {city_name} (ID: {city_id}) <<<")
-                        process_city_offers(city_config=city_config.to_dict())
-                        update_city_last_run(city_id)
-                        print(f">>> FINALIZADO SAI PARA: {city_name} <<<")
+                        continue
+
+                    with running_city_ids_lock:
+                        already_submitted = city_id in running_city_ids
+                        started_at = city_started_at.get(city_id)
+                    if already_submitted:
+                        if started_at is None:
+                            print(f"INFO: {city_name} ainda está na fila desde um ciclo anterior. Pulando.")
+                        elif time.monotonic() - started_at >= CITY_TIMEOUT_SECONDS:
+                            hung_cities.append(f"{city_name} (há {time.monotonic() - started_at:.0f}s)")
+                        else:
+                            print(f"INFO: {city_name} ainda está em execução desde um ciclo anterior "
+                                  f"(há {time.monotonic() - started_at:.0f}s). Pulando.")
+                        continue
+
+                    with running_city_ids_lock:
+                        quarantined_until = city_quarantined_until.get(city_id)
+                    if quarantined_until is not None:
+                        if time.monotonic() < quarantined_until:
+                            print(f"AVISO: {city_name} está em quarentena por estourar o prazo repetidamente. "
+                                  f"Volta a rodar em {(quarantined_until - time.monotonic()) / 60:.0f} min.")
+                            continue
+                        with running_city_ids_lock:
+                            city_quarantined_until.pop(city_id, None)
+
+                    if pool_blocked:
+                        continue
+
+                    if snapshot is None:
+                        snapshot = CycleSnapshot.load()
+                    with running_city_ids_lock:
+                        running_city_ids.add(city_id)
+                    future = city_executor.submit(run_city, city_config.to_dict(), snapshot)
+                    city_futures[future] = (city_id, city_name)
+
+                if hung_cities:
+                    print(f"ALERTA: {len(hung_cities)} cidade(s) presa(s) acima de {CITY_TIMEOUT_SECONDS}s, ocupando "
+                          f"{overdue_slots} de {MAX_PARALLEL_CITIES} vagas do pool e sem novo disparo: {', '.join(hung_cities)}.")
+
+                if city_futures:
+                    print(f"\nINFO: {len(city_futures)} cidades disparadas (até {MAX_PARALLEL_CITIES} em paralelo)...")
+                    overdue_cities, cancelled_cities = wait_for_cities(city_futures)
+                    for city_name in overdue_cities:
+                        print(f"AVISO: {city_name} excedeu {CITY_TIMEOUT_SECONDS}s desde o início. Continua em segundo plano; "
+                              "o horário de execução será registrado quando terminar.")
+                    for city_name in cancelled_cities:
+                        print(f"AVISO: {city_name} não chegou a começar (todas as vagas presas em cidades atrasadas). "
+                              "Será disparada de novo num próximo ciclo.")
+
+                if snapshot is not None:
+                    print_cache_stats()
+                    print_http_stats()
 
             # --- LÓGICA DO GATILHO DE ETL (uma vez por dia) ---
             now = datetime.now()